@@ -18,6 +18,9 @@ from datetime import datetime, timedelta
 from functools import wraps
 from flask import Blueprint, render_template, request, session, redirect, url_for, flash, jsonify, Response, g
 from werkzeug.security import check_password_hash, generate_password_hash
+from redirect_plan import invalidate_user
+from database import epoch_ms
+from config import DATABASE
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -84,7 +87,6 @@ def admin_required(f):
 def get_db():
     """Enhanced database connection with pooling and WAL mode"""
     if "db" not in g:
-        DATABASE = os.path.join(os.path.dirname(__file__), "smart_links.db")
         g.db = sqlite3.connect(DATABASE, check_same_thread=False, timeout=10.0)
         g.db.row_factory = sqlite3.Row
         # Enable WAL mode for better concurrent access
@@ -111,7 +113,6 @@ def execute_db(query: str, args=None):
 
 def ensure_admin_tables():
     """Ensure admin-specific tables exist"""
-    DATABASE = os.path.join(os.path.dirname(__file__), "smart_links.db")
     conn = sqlite3.connect(DATABASE)
     conn.row_factory = sqlite3.Row
     
@@ -380,6 +381,33 @@ def recent_activities_api():
             'error': str(e)
         }), 500
 
+@admin_bp.route('/api/pipeline/stats')
+@admin_required
+def pipeline_stats_api():
+    """Get visit pipeline counters (group-commit batch size, flush latency, enrichment queue)"""
+    from visit_pipeline import pipeline_stats
+    from redirect_plan import redirect_plan_stats
+    from reverse_dns import resolver
+    from bot_counter import bot_counter
+    from rate_limiter import rate_limiter
+    from ddos_events import event_aggregator
+    from fast_reject import fast_reject
+    from ip_rules import ip_rules
+    from pow_challenge import proof_of_work
+    from anomaly import anomaly_detector
+    
+    stats = pipeline_stats()
+    stats['redirect_plans'] = redirect_plan_stats()
+    stats['reverse_dns'] = resolver.get_stats()
+    stats['bot_counter'] = bot_counter.get_stats()
+    stats['rate_limiter'] = rate_limiter.get_stats()
+    stats['ddos_events'] = event_aggregator.get_stats()
+    stats['fast_reject'] = fast_reject.get_stats()
+    stats['ip_rules'] = ip_rules.get_stats()
+    stats['proof_of_work'] = proof_of_work.get_stats()
+    stats['anomaly'] = anomaly_detector.get_stats()
+    return jsonify({'success': True, 'stats': stats})
+
 @admin_bp.route('/api/revenue/live')
 @admin_required
 def live_revenue():
@@ -389,25 +417,27 @@ def live_revenue():
         total_revenue = query_db("SELECT SUM(revenue) as total FROM ad_impressions", one=True)
         total = float(total_revenue['total']) if total_revenue['total'] else 0.0
         
-        # Today's revenue
+        # Today's revenue (UTC day)
+        now = datetime.utcnow()
+        today_start_ms = epoch_ms(now.replace(hour=0, minute=0, second=0, microsecond=0))
         today_revenue = query_db("""
             SELECT SUM(revenue) as total FROM ad_impressions 
-            WHERE DATE(timestamp) = DATE('now')
-        """, one=True)
+            WHERE ts_ms >= ?
+        """, [today_start_ms], one=True)
         today = float(today_revenue['total']) if today_revenue['total'] else 0.0
         
         # This week's revenue
         week_revenue = query_db("""
             SELECT SUM(revenue) as total FROM ad_impressions 
-            WHERE timestamp >= datetime('now', '-7 days')
-        """, one=True)
+            WHERE ts_ms >= ?
+        """, [epoch_ms(now - timedelta(days=7))], one=True)
         week = float(week_revenue['total']) if week_revenue['total'] else 0.0
         
         # Impression count today
         impressions_today = query_db("""
             SELECT COUNT(*) as count FROM ad_impressions 
-            WHERE DATE(timestamp) = DATE('now')
-        """, one=True)['count']
+            WHERE ts_ms >= ?
+        """, [today_start_ms], one=True)['count']
         
         return jsonify({
             'success': True,
@@ -546,11 +576,17 @@ def delete_user(user_id):
         execute_db("DELETE FROM ad_impressions WHERE user_id = ?", [user_id])
         execute_db("DELETE FROM user_activity WHERE user_id = ?", [user_id])
         execute_db("DELETE FROM visits WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [user_id])
+        execute_db("DELETE FROM session_stats WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [user_id])
+        execute_db("DELETE FROM rate_limits WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [user_id])
+        execute_db("DELETE FROM link_baselines WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [user_id])
+        execute_db("DELETE FROM bot_hits WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [user_id])
         execute_db("DELETE FROM ddos_events WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [user_id])
         execute_db("DELETE FROM personalized_ads WHERE user_id = ?", [user_id])
         execute_db("DELETE FROM behavior_rules WHERE user_id = ?", [user_id])
+        execute_db("DELETE FROM ip_rules WHERE user_id = ?", [user_id])
         execute_db("DELETE FROM links WHERE user_id = ?", [user_id])
         execute_db("DELETE FROM users WHERE id = ?", [user_id])
+        invalidate_user(user_id)
         
         # Log admin activity
         log_admin_activity("delete_user", "user", user_id, f"Deleted user: {user['username']}")
@@ -590,6 +626,7 @@ def toggle_user_premium(user_id):
         SET is_premium = ?, premium_expires_at = ?, membership_tier = ?
         WHERE id = ?
     """, [new_status, expires_at, new_tier, user_id])
+    invalidate_user(user_id)
     
     status_text = f"activated ({new_tier})" if new_status else "deactivated"
     log_admin_activity("toggle_premium", "user", user_id, 
@@ -953,10 +990,10 @@ def analytics():
                SUM(revenue) as daily_revenue,
                COUNT(*) as impressions
         FROM ad_impressions 
-        WHERE timestamp >= ?
+        WHERE ts_ms >= ?
         GROUP BY DATE(timestamp)
         ORDER BY date DESC
-    """, [start_date.isoformat()])
+    """, [epoch_ms(start_date)])
     
     # Top revenue generating users
     top_revenue_users = query_db("""
@@ -965,11 +1002,11 @@ def analytics():
                COUNT(ai.id) as impressions
         FROM users u
         JOIN ad_impressions ai ON u.id = ai.user_id
-        WHERE ai.timestamp >= ?
+        WHERE ai.ts_ms >= ?
         GROUP BY u.id
         ORDER BY total_revenue DESC
         LIMIT 10
-    """, [start_date.isoformat()])
+    """, [epoch_ms(start_date)])
     
     # Ad performance by type
     ad_performance = query_db("""
@@ -978,9 +1015,9 @@ def analytics():
                SUM(revenue) as revenue,
                AVG(revenue) as avg_revenue
         FROM ad_impressions
-        WHERE timestamp >= ?
+        WHERE ts_ms >= ?
         GROUP BY ad_type
-    """, [start_date.isoformat()])
+    """, [epoch_ms(start_date)])
     
     # User growth over time
     user_growth = query_db("""
@@ -1383,12 +1420,14 @@ def track_user_activity(user_id, activity_type, details=None, ip_address=None):
 def track_ad_impression(link_id, user_id, ad_type, ad_position, ip_address=None, ad_id=None):
     """Track ad impression and calculate revenue"""
     revenue = AD_REVENUE_RATES.get(ad_type, 0.0)
+    now = datetime.utcnow()
     
     execute_db("""
         INSERT INTO ad_impressions 
-        (link_id, user_id, ad_type, ad_position, revenue, ip_address, ad_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, [link_id, user_id, ad_type, ad_position, revenue, ip_address, ad_id])
+        (link_id, user_id, ad_type, ad_position, revenue, ip_address, ad_id, timestamp, ts_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [link_id, user_id, ad_type, ad_position, revenue, ip_address, ad_id,
+          now.strftime('%Y-%m-%d %H:%M:%S'), epoch_ms(now)])
     
     return revenue
 
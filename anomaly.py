@@ -0,0 +1,200 @@
+"""
+Smart Link Intelligence - Traffic Anomaly Detection
+Streaming per-link baselines (exponentially weighted mean and variance of requests per minute and of
+the suspicious ratio) in O(1) memory per link, z-scores against them, and periodic persistence
+"""
+
+import atexit
+import math
+import time
+from collections import namedtuple
+from cache import LRUCache, WriteBehindBuffer
+from database import connect_db
+from config import (
+    ANOMALY_SAMPLE_SECONDS, ANOMALY_HALF_LIFE_MINUTES, ANOMALY_Z_THRESHOLD, ANOMALY_WARMUP_SAMPLES,
+    ANOMALY_MIN_RATE, ANOMALY_FLUSH_SECONDS, TRAFFIC_CACHE_LINKS
+)
+
+# Result of one observation; the *_anomaly flags are only ever set on a warmed-up baseline
+AnomalyScore = namedtuple("AnomalyScore", "warmed rate_z ratio_z rate_anomaly ratio_anomaly")
+
+# Anomalous samples still move the baseline at this fraction of the normal weight, so a lasting
+# shift becomes the new normal over hours while a flood does not within minutes
+ANOMALY_WEIGHT = 0.1
+
+# Floor of the suspicious ratio's standard deviation (rates are floored at Poisson noise, sqrt(mean))
+MIN_RATIO_STD = 0.05
+
+UPSERT_SQL = """
+    INSERT INTO link_baselines (link_id, rate_mean, rate_var, ratio_mean, ratio_var, samples, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(link_id) DO UPDATE SET
+        rate_mean = excluded.rate_mean, rate_var = excluded.rate_var,
+        ratio_mean = excluded.ratio_mean, ratio_var = excluded.ratio_var,
+        samples = excluded.samples, updated_at = excluded.updated_at
+"""
+
+
+class LinkBaseline:
+    """EWMA mean/variance of one link's requests per minute and suspicious ratio"""
+
+    __slots__ = ("rate_mean", "rate_var", "ratio_mean", "ratio_var", "samples", "updated_at", "anomalous_at")
+
+    def __init__(self, rate_mean=0.0, rate_var=0.0, ratio_mean=0.0, ratio_var=0.0, samples=0, updated_at=0.0):
+        self.rate_mean = rate_mean
+        self.rate_var = rate_var
+        self.ratio_mean = ratio_mean
+        self.ratio_var = ratio_var
+        self.samples = samples
+        self.updated_at = updated_at
+        self.anomalous_at = 0.0  # last anomalous observation (not persisted)
+
+    def update(self, rate: float, ratio, alpha: float):
+        if not self.samples:
+            # Start from the first sample rather than from zero, which would inflate the variance for hours
+            self.rate_mean = float(rate)
+            self.ratio_mean = ratio or 0.0
+        diff = rate - self.rate_mean
+        incr = alpha * diff
+        self.rate_mean += incr
+        self.rate_var = (1 - alpha) * (self.rate_var + diff * incr)
+        if ratio is not None:
+            diff = ratio - self.ratio_mean
+            incr = alpha * diff
+            self.ratio_mean += incr
+            self.ratio_var = (1 - alpha) * (self.ratio_var + diff * incr)
+        self.samples += 1
+
+    def decay(self, alpha: float, idle_samples: int):
+        """Apply idle_samples zero-request samples at once (closed form of repeated update(0, None))"""
+        d = (1 - alpha) ** idle_samples
+        self.rate_var = d * (self.rate_var + self.rate_mean ** 2 * (1 - d))
+        self.rate_mean *= d
+        self.samples += idle_samples
+
+    def rate_std(self) -> float:
+        return max(math.sqrt(self.rate_var), math.sqrt(self.rate_mean), 1.0)
+
+    def ratio_std(self) -> float:
+        return max(math.sqrt(self.ratio_var), MIN_RATIO_STD)
+
+
+class AnomalyDetector(WriteBehindBuffer):
+    """
+    Per-link baselines fed by DDoS detection with the current per-minute counts.
+
+    Every observation is scored against the baseline; the baseline itself takes
+    one sample per sample_seconds. Changed baselines are written to
+    link_baselines every flush_interval seconds and read back on first use, so
+    restarts keep what was learned.
+    """
+
+    name = "Baseline"
+    thread_name = "anomaly-baselines"
+
+    def __init__(self, sample_seconds: float = ANOMALY_SAMPLE_SECONDS, half_life_minutes: float = ANOMALY_HALF_LIFE_MINUTES,
+                 threshold: float = ANOMALY_Z_THRESHOLD, warmup: int = ANOMALY_WARMUP_SAMPLES,
+                 min_rate: int = ANOMALY_MIN_RATE, flush_interval: float = ANOMALY_FLUSH_SECONDS,
+                 max_links: int = TRAFFIC_CACHE_LINKS):
+        # _pending: link_id -> UPSERT_SQL parameters of a baseline changed since the last flush
+        super().__init__(flush_interval)
+        self.sample_seconds = sample_seconds
+        self.alpha = 1 - 0.5 ** (sample_seconds / (half_life_minutes * 60))
+        self.threshold = threshold
+        self.warmup = warmup
+        self.min_rate = min_rate
+        self.links = LRUCache(maxsize=max_links)
+        self.stats.update(observations=0, samples=0, anomalies=0, loaded=0)
+
+    def _baseline(self, link_id: int) -> LinkBaseline:
+        baseline = self.links.get(link_id)
+        if baseline is not None:
+            return baseline
+        baseline = LinkBaseline()
+        try:
+            conn = connect_db(check_same_thread=False)
+            try:
+                row = conn.execute(
+                    "SELECT rate_mean, rate_var, ratio_mean, ratio_var, samples, updated_at "
+                    "FROM link_baselines WHERE link_id = ?", [link_id]
+                ).fetchone()
+            finally:
+                conn.close()
+            if row:
+                baseline = LinkBaseline(*row)
+                with self._lock:
+                    self.stats["loaded"] += 1
+        except Exception as e:
+            print(f"Baseline load failed for link {link_id}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+        self.links.set(link_id, baseline)
+        return baseline
+
+    def observe(self, link_id: int, rate: int, suspicious: int, now: float = None) -> AnomalyScore:
+        """Score a link's requests and suspicious requests of the last minute against its baseline"""
+        now = time.time() if now is None else now
+        baseline = self._baseline(link_id)
+        ratio = suspicious / rate if rate else None
+        with self._lock:
+            self.stats["observations"] += 1
+            warmed = baseline.samples >= self.warmup
+            rate_z = (rate - baseline.rate_mean) / baseline.rate_std()
+            ratio_z = (ratio - baseline.ratio_mean) / baseline.ratio_std() if ratio is not None else 0.0
+            busy = warmed and rate >= self.min_rate
+            rate_anomaly = busy and rate_z >= self.threshold
+            ratio_anomaly = busy and ratio_z >= self.threshold
+
+            if now - baseline.updated_at >= self.sample_seconds:
+                if baseline.updated_at:
+                    # Minutes without requests never reached us: they were zero samples
+                    idle = int((now - baseline.updated_at) // self.sample_seconds) - 1
+                    if idle > 0:
+                        baseline.decay(self.alpha, idle)
+                weight = ANOMALY_WEIGHT if rate_anomaly or ratio_anomaly else 1.0
+                baseline.update(rate, ratio, self.alpha * weight)
+                baseline.updated_at = now
+                self._pending[link_id] = [link_id, baseline.rate_mean, baseline.rate_var, baseline.ratio_mean,
+                                          baseline.ratio_var, baseline.samples, int(now)]
+                self.stats["samples"] += 1
+            if rate_anomaly or ratio_anomaly:
+                baseline.anomalous_at = now
+                self.stats["anomalies"] += 1
+        self.start()
+        return AnomalyScore(warmed, rate_z, ratio_z, rate_anomaly, ratio_anomaly)
+
+    def anomalous_since(self, link_id: int, since: float) -> bool:
+        """True if this process observed anomalous traffic on a link at or after since (epoch seconds)"""
+        baseline = self.links.get(link_id)
+        return baseline is not None and baseline.anomalous_at >= since
+
+    def describe(self, link_id: int) -> dict:
+        """A link's learned normal traffic, for display"""
+        baseline = self._baseline(link_id)
+        with self._lock:
+            return {
+                "rate_mean": baseline.rate_mean,
+                "rate_std": math.sqrt(baseline.rate_var),
+                "ratio_mean": baseline.ratio_mean,
+                "samples": baseline.samples,
+                "warmed": baseline.samples >= self.warmup,
+                "warmup": self.warmup,
+            }
+
+    def write(self, conn, batch: dict):
+        conn.executemany(UPSERT_SQL, list(batch.values()))
+
+    def merge(self, batch: dict):
+        for link_id, row in batch.items():
+            # A baseline sampled again since is newer
+            self._pending.setdefault(link_id, row)
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        stats = super().get_stats()
+        stats.update(alpha=round(self.alpha, 5), threshold=self.threshold, cache=self.links.stats())
+        return stats
+
+
+anomaly_detector = AnomalyDetector()
+atexit.register(anomaly_detector.shutdown)
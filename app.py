@@ -7,7 +7,11 @@ import os
 from flask import Flask, g, session
 from config import FLASK_CONFIG, USER_SESSION_KEY
 from database import ensure_db, close_db, query_db
-from ddos_protection import DDoSProtection
+from migrations import run_migrations
+from link_state import link_states
+from link_traffic import link_traffic
+from fast_reject import fast_reject_request
+from ip_rules import ip_rules
 
 # Import blueprints
 from admin_panel import admin_bp, ensure_admin_tables
@@ -28,7 +32,8 @@ def create_app() -> Flask:
     for key, value in FLASK_CONFIG.items():
         app.config[key] = value
     
-    # Set up request handlers
+    # Set up request handlers (blocked redirects are answered first, before sessions and DB access)
+    app.before_request(fast_reject_request)
     app.before_request(_before_request)
     app.teardown_appcontext(close_db)
     
@@ -38,9 +43,16 @@ def create_app() -> Flask:
     # Initialize database
     ensure_db()
     ensure_admin_tables()
+    run_migrations()
     
-    # Initialize DDoS Protection
-    ddos_protection = DDoSProtection(os.path.join(os.path.dirname(__file__), "smart_links.db"))
+    # Start link health persistence and the idle-link decay sweep
+    link_states.start()
+    
+    # Per-link traffic counters for DDoS detection, rebuilt from recent visits
+    link_traffic.rebuild()
+    
+    # CIDR block/allow rules into the prefix trie
+    ip_rules.load()
     
     # Register blueprints
     app.register_blueprint(admin_bp)
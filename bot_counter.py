@@ -0,0 +1,58 @@
+"""
+Smart Link Intelligence - Bot Counter
+In-memory per-link counters for bot and link-preview hits, flushed to the bot_hits table periodically
+"""
+
+import atexit
+from datetime import datetime
+from cache import WriteBehindBuffer
+from config import BOT_COUNTER_FLUSH_SECONDS
+
+UPSERT_BOT_HITS_SQL = """
+    INSERT INTO bot_hits (link_id, hits, last_seen) VALUES (?, ?, ?)
+    ON CONFLICT(link_id) DO UPDATE SET
+        hits = hits + excluded.hits,
+        last_seen = MAX(COALESCE(last_seen, ''), excluded.last_seen)
+"""
+
+
+class BotCounter(WriteBehindBuffer):
+    """Counts bot hits per link (link_id -> [hits, last_seen]) without touching the database on the request path"""
+
+    name = "Bot counter"
+    thread_name = "bot-counter"
+
+    def __init__(self, interval: float = BOT_COUNTER_FLUSH_SECONDS):
+        super().__init__(interval)
+        self.stats.update(hits=0)
+
+    def hit(self, link_id: int, now: datetime = None):
+        """Record one bot/preview request for a link"""
+        ts = (now or datetime.utcnow()).isoformat()
+        with self._lock:
+            entry = self._pending.get(link_id)
+            if entry is None:
+                self._pending[link_id] = [1, ts]
+            else:
+                entry[0] += 1
+                entry[1] = ts
+            self.stats["hits"] += 1
+        self.schedule()
+
+    def pending(self, link_id: int) -> int:
+        """Hits for a link that have not been written yet"""
+        with self._lock:
+            return sum(buffer[link_id][0] for buffer in (self._pending, self._inflight) if link_id in buffer)
+
+    def write(self, conn, batch: dict):
+        conn.executemany(UPSERT_BOT_HITS_SQL, [[link_id, c[0], c[1]] for link_id, c in batch.items()])
+
+    def merge(self, batch: dict):
+        for link_id, (hits, ts) in batch.items():
+            entry = self._pending.setdefault(link_id, [0, ts])
+            entry[0] += hits
+            entry[1] = max(entry[1], ts)
+
+
+bot_counter = BotCounter()
+atexit.register(bot_counter.shutdown)
@@ -0,0 +1,238 @@
+"""
+Smart Link Intelligence - In-Process Caches
+Thread-safe LRU cache with optional TTL, a single-flight call coalescer and a write-behind buffer base,
+shared by the hot-path subsystems
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from database import connect_db
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Size-bounded, thread-safe LRU cache with an optional per-entry TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing/expired"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        """Store a value, evicting the least recently used entry when full"""
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def incr(self, key, delta=1) -> bool:
+        """Add delta to a cached number in place (keeping its expiry); False if key is not cached"""
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return False
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return False
+            self._data[key] = (value + delta, expires_at)
+            return True
+
+    def pop(self, key, default=None):
+        """Remove a key and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def discard_where(self, predicate) -> int:
+        """Remove every entry whose (key, value) matches predicate"""
+        with self._lock:
+            doomed = [k for k, (v, _) in self._data.items() if predicate(k, v)]
+            for k in doomed:
+                del self._data[k]
+        return len(doomed)
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        """Return hit/miss/eviction counters"""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Run fn() once per key at a time; concurrent callers wait for and share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+class WriteBehindBuffer:
+    """
+    Base of the in-memory buffers that a background thread writes to the database.
+
+    Request threads update self._pending under self._lock and call schedule().
+    Every `interval` seconds (on each call if interval <= 0, and at shutdown)
+    flush() swaps the buffer for an empty one under the lock and hands it to
+    write() on a standalone connection, so writers never wait on the database.
+    While written the batch stays visible as self._inflight. A batch whose write
+    fails is folded back with merge() and goes out with the next flush.
+
+    Subclasses provide write(conn, batch) and merge(batch), and may hook
+    written(batch, result) and tick().
+    """
+
+    name = "Write-behind buffer"
+    thread_name = "write-behind"
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"flushes": 0, "rows_flushed": 0, "errors": 0}
+
+    def start(self):
+        """Start the flusher thread (idempotent)"""
+        with self._lock:
+            if self._thread or self.interval <= 0 or self._stop.is_set():
+                return
+            self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+            self._thread.start()
+
+    def schedule(self):
+        """Called after buffering: write now if there is no flusher thread, else make sure it runs"""
+        if self.interval <= 0 or self._stop.is_set():
+            self.flush()
+        else:
+            self.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.tick()
+
+    def tick(self):
+        """One run of the flusher thread"""
+        self.flush()
+
+    def write(self, conn, batch: dict):
+        """Write a batch on conn (committed by the caller); the return value goes to written()"""
+        raise NotImplementedError
+
+    def merge(self, batch: dict):
+        """Fold a batch that failed to write back into self._pending (caller holds the lock)"""
+        raise NotImplementedError
+
+    def written(self, batch: dict, result):
+        """Called under the lock after a batch was committed"""
+
+    def flush(self):
+        """Write what was buffered since the previous flush in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch = self._inflight = self._pending
+                self._pending = {}
+            try:
+                conn = connect_db(check_same_thread=False)
+                try:
+                    result = self.write(conn, batch)
+                    conn.commit()
+                finally:
+                    conn.close()
+            except Exception as e:
+                print(f"{self.name} flush failed ({len(batch)} keys): {e}")
+                with self._lock:
+                    self._inflight = {}
+                    self.stats["errors"] += 1
+                    self.merge(batch)
+                return
+            with self._lock:
+                self._inflight = {}
+                self.stats["flushes"] += 1
+                self.stats["rows_flushed"] += len(batch)
+                self.written(batch, result)
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        with self._lock:
+            return dict(self.stats, pending_keys=len(self._pending), interval_seconds=self.interval)
+
+    def shutdown(self):
+        """Stop the flusher thread and write what is left"""
+        self._stop.set()
+        self.flush()
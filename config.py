@@ -11,7 +11,7 @@ from datetime import timedelta
 load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 
 # Database Configuration
-DATABASE = os.path.join(os.path.dirname(__file__), "smart_links.db")
+DATABASE = os.environ.get("DATABASE", os.path.join(os.path.dirname(__file__), "smart_links.db"))
 
 # Session Configuration
 SESSION_COOKIE_NAME = "smartlink_session"
@@ -24,6 +24,146 @@ SUSPICIOUS_INTERVAL_SECONDS = 1.0
 ATTENTION_DECAY_DAYS = 14
 STATE_DECAY_DAYS = 21
 
+# Link State Machine
+# Per-link health counters live in memory (re-seeded from visits after LINK_STATE_TTL_SECONDS);
+# last visit times are persisted every LINK_STATE_FLUSH_SECONDS and idle links are decayed
+# every LINK_STATE_SWEEP_SECONDS
+LINK_STATE_CACHE_SIZE = int(os.environ.get("LINK_STATE_CACHE_SIZE", 50000))
+LINK_STATE_TTL_SECONDS = float(os.environ.get("LINK_STATE_TTL_SECONDS", 600))
+LINK_STATE_FLUSH_SECONDS = float(os.environ.get("LINK_STATE_FLUSH_SECONDS", 30))
+LINK_STATE_SWEEP_SECONDS = float(os.environ.get("LINK_STATE_SWEEP_SECONDS", 3600))
+
+# Redirect Plan Cache Configuration
+# Resolved per-code redirect plans (link + owner tier + rules) kept in process memory
+REDIRECT_PLAN_CACHE_SIZE = int(os.environ.get("REDIRECT_PLAN_CACHE_SIZE", 10000))
+REDIRECT_PLAN_TTL_SECONDS = int(os.environ.get("REDIRECT_PLAN_TTL_SECONDS", 60))
+
+# Visit Enrichment Configuration
+# When enabled, visits are stored with the raw IP/UA/referrer and geo/ISP/hostname
+# fields are filled in by a background worker pool after the redirect is sent
+DEFERRED_VISIT_ENRICHMENT = os.environ.get("DEFERRED_VISIT_ENRICHMENT", "1") == "1"
+ENRICHMENT_WORKERS = int(os.environ.get("ENRICHMENT_WORKERS", 4))
+ENRICHMENT_QUEUE_SIZE = int(os.environ.get("ENRICHMENT_QUEUE_SIZE", 1000))
+ENRICHMENT_ENQUEUE_TIMEOUT = 0.05  # seconds to wait for queue space before enriching inline
+ENRICHMENT_SHUTDOWN_TIMEOUT = 10  # seconds to drain pending jobs on graceful shutdown
+
+# Visit Write Batching (group commit)
+# Visits are buffered and written with one executemany transaction per flush.
+# VISIT_FLUSH_INTERVAL_MS is the durability window; 0 commits every visit synchronously.
+VISIT_FLUSH_INTERVAL_MS = int(os.environ.get("VISIT_FLUSH_INTERVAL_MS", 50))
+VISIT_FLUSH_MAX_ROWS = int(os.environ.get("VISIT_FLUSH_MAX_ROWS", 200))
+VISIT_BUFFER_MAX_ROWS = 5000  # request threads flush inline beyond this (backpressure)
+
+# Per-session visit counts (session_stats table, maintained by the visit writer) cached in memory.
+# The TTL bounds staleness when the same session is served by several worker processes.
+SESSION_STATS_CACHE_SIZE = int(os.environ.get("SESSION_STATS_CACHE_SIZE", 100000))
+SESSION_STATS_CACHE_TTL_SECONDS = int(os.environ.get("SESSION_STATS_CACHE_TTL_SECONDS", 60))
+
+# Per-link ring buffers of the most recent visits (epoch, ip_hash) for behavior/suspicious checks.
+# Bounded by an LRU over links; the TTL re-seeds them so visits served by other workers show up.
+VISIT_WINDOW_SIZE = 20
+VISIT_WINDOW_CACHE_LINKS = int(os.environ.get("VISIT_WINDOW_CACHE_LINKS", 20000))
+VISIT_WINDOW_TTL_SECONDS = int(os.environ.get("VISIT_WINDOW_TTL_SECONDS", 60))
+
+# Geolocation Cache Configuration
+# In-memory LRU in front of the persistent geo_cache table, shared by all workers
+GEO_CACHE_MEMORY_SIZE = int(os.environ.get("GEO_CACHE_MEMORY_SIZE", 50000))
+GEO_CACHE_TTL_SECONDS = int(os.environ.get("GEO_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+GEO_CACHE_NEGATIVE_TTL_SECONDS = int(os.environ.get("GEO_CACHE_NEGATIVE_TTL_SECONDS", 15 * 60))
+
+# Offline Geolocation Configuration
+# Memory-mapped IP-range index (see offline_geo.py); consulted before the online providers.
+# If OFFLINE_GEO_CSV is set, the index is (re)built from it on first use when missing or stale.
+OFFLINE_GEO_INDEX = os.environ.get("OFFLINE_GEO_INDEX", os.path.join(os.path.dirname(__file__), "data", "ip_ranges.bin"))
+OFFLINE_GEO_CSV = os.environ.get("OFFLINE_GEO_CSV", "")
+GEO_ONLINE_FALLBACK = os.environ.get("GEO_ONLINE_FALLBACK", "1") == "1"
+
+# Public IP Fallback
+# Private/loopback client IPs (local dev, proxy without X-Forwarded-For) are geolocated
+# as the server's public IP. Set PUBLIC_IP_OVERRIDE to skip ipify, or PUBLIC_IP_FALLBACK=0 to disable.
+PUBLIC_IP_FALLBACK = os.environ.get("PUBLIC_IP_FALLBACK", "1") == "1"
+PUBLIC_IP_OVERRIDE = os.environ.get("PUBLIC_IP_OVERRIDE", "").strip() or None
+PUBLIC_IP_REFRESH_SECONDS = int(os.environ.get("PUBLIC_IP_REFRESH_SECONDS", 6 * 3600))
+PUBLIC_IP_RETRY_SECONDS = 300  # after a failed fetch
+
+# Reverse DNS Configuration
+# PTR lookups run on their own pool; callers give up after RDNS_TIMEOUT_SECONDS
+RDNS_WORKERS = int(os.environ.get("RDNS_WORKERS", 8))
+RDNS_TIMEOUT_SECONDS = float(os.environ.get("RDNS_TIMEOUT_SECONDS", 0.5))
+RDNS_MAX_PENDING = 256  # lookups in flight before new IPs are skipped
+RDNS_CACHE_SIZE = int(os.environ.get("RDNS_CACHE_SIZE", 50000))
+RDNS_CACHE_TTL_SECONDS = int(os.environ.get("RDNS_CACHE_TTL_SECONDS", 6 * 3600))
+RDNS_NEGATIVE_TTL_SECONDS = int(os.environ.get("RDNS_NEGATIVE_TTL_SECONDS", 30 * 60))
+
+# User-Agent classification cache (distinct UA strings)
+UA_CACHE_SIZE = int(os.environ.get("UA_CACHE_SIZE", 4096))
+
+# Bot/preview hits are counted in memory and added to bot_hits every interval (0 = write on every hit)
+BOT_COUNTER_FLUSH_SECONDS = float(os.environ.get("BOT_COUNTER_FLUSH_SECONDS", 10))
+
+# Schema migrations: rows per backfill transaction (keeps write-lock hold times short)
+MIGRATION_BATCH_SIZE = int(os.environ.get("MIGRATION_BATCH_SIZE", 5000))
+
+# Rate limiter: per-(ip, link) sliding windows kept in process memory (~1.2 KB per key).
+# Keys idle for RATE_LIMIT_IDLE_SECONDS (the longest window) expire; beyond RATE_LIMIT_MAX_KEYS the coldest are evicted.
+RATE_LIMIT_IDLE_SECONDS = 3600
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 50000))
+# Where the counters live: "local" (per worker process), or shared by every worker on the node
+# through "shm" (a named shared memory table) or "sqlite" (rate_limits rows, written behind every sync)
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "local")
+RATE_LIMIT_SHM_NAME = os.environ.get("RATE_LIMIT_SHM_NAME", "smart_links_rate_limits")
+RATE_LIMIT_SHM_SLOTS = int(os.environ.get("RATE_LIMIT_SHM_SLOTS", 65536))  # 48 bytes each
+RATE_LIMIT_SYNC_SECONDS = float(os.environ.get("RATE_LIMIT_SYNC_SECONDS", 0.2))
+
+# Per-link traffic counters for DDoS detection: TRAFFIC_BUCKET_SECONDS buckets covering the longest
+# detection window. Re-seeded from visits every TRAFFIC_RESYNC_SECONDS so other workers' traffic counts (0 = never).
+TRAFFIC_BUCKET_SECONDS = 10
+TRAFFIC_HORIZON_MINUTES = int(os.environ.get("TRAFFIC_HORIZON_MINUTES", 30))
+TRAFFIC_CACHE_LINKS = int(os.environ.get("TRAFFIC_CACHE_LINKS", 10000))
+TRAFFIC_RESYNC_SECONDS = float(os.environ.get("TRAFFIC_RESYNC_SECONDS", 30))
+
+# DDoS events are coalesced per (link, event type, IP) and written every DDOS_EVENT_FLUSH_SECONDS
+# (0 = write immediately). Beyond DDOS_EVENT_MAX_KEYS distinct keys per window, IPs are merged per link.
+DDOS_EVENT_FLUSH_SECONDS = float(os.environ.get("DDOS_EVENT_FLUSH_SECONDS", 2))
+DDOS_EVENT_MAX_KEYS = int(os.environ.get("DDOS_EVENT_MAX_KEYS", 10000))
+
+# Fast reject path: blocked links and rate-limited IPs are answered from memory before any DB access.
+# Link blocks are re-checked against the database every FAST_REJECT_LINK_SECONDS (recoveries made
+# by other workers take effect within that); IP blocks last FAST_REJECT_IP_SECONDS (per-minute limit)
+# or FAST_REJECT_BLOCK_SECONDS (hourly limit, bursts). At most FAST_REJECT_MAX_IPS IP blocks are kept.
+FAST_REJECT_LINK_SECONDS = float(os.environ.get("FAST_REJECT_LINK_SECONDS", 30))
+FAST_REJECT_IP_SECONDS = float(os.environ.get("FAST_REJECT_IP_SECONDS", 10))
+FAST_REJECT_BLOCK_SECONDS = float(os.environ.get("FAST_REJECT_BLOCK_SECONDS", 60))
+FAST_REJECT_MAX_IPS = int(os.environ.get("FAST_REJECT_MAX_IPS", 100000))
+
+# CIDR block/allow rules (ip_rules): reloaded from the database every IP_RULES_REFRESH_SECONDS so rules
+# added by other workers apply; IPs caught in a burst attack are blocked for IP_AUTO_BLOCK_SECONDS.
+IP_RULES_REFRESH_SECONDS = float(os.environ.get("IP_RULES_REFRESH_SECONDS", 10))
+IP_AUTO_BLOCK_SECONDS = int(os.environ.get("IP_AUTO_BLOCK_SECONDS", 3600))
+IP_RULES_MAX_PER_USER = int(os.environ.get("IP_RULES_MAX_PER_USER", 500))
+
+# Proof-of-work challenge for links at protection level 3: solutions need POW_BASE_BITS leading zero
+# bits (plus POW_BITS_PER_LEVEL per level above 3, at most 32); challenges are valid for
+# POW_CHALLENGE_SECONDS and a solved one earns a pass cookie for POW_PASS_SECONDS.
+POW_BASE_BITS = int(os.environ.get("POW_BASE_BITS", 18))
+POW_BITS_PER_LEVEL = int(os.environ.get("POW_BITS_PER_LEVEL", 2))
+POW_CHALLENGE_SECONDS = int(os.environ.get("POW_CHALLENGE_SECONDS", 120))
+POW_PASS_SECONDS = int(os.environ.get("POW_PASS_SECONDS", 3600))
+
+# Per-link traffic baselines (EWMA mean/variance of requests per minute and suspicious ratio), sampled
+# every ANOMALY_SAMPLE_SECONDS with a half-life of ANOMALY_HALF_LIFE_MINUTES and persisted every
+# ANOMALY_FLUSH_SECONDS. Deviations above ANOMALY_Z_THRESHOLD standard deviations are flagged once a
+# baseline has ANOMALY_WARMUP_SAMPLES samples; rates below ANOMALY_MIN_RATE per minute never are.
+ANOMALY_SAMPLE_SECONDS = 60
+ANOMALY_HALF_LIFE_MINUTES = float(os.environ.get("ANOMALY_HALF_LIFE_MINUTES", 60))
+ANOMALY_Z_THRESHOLD = float(os.environ.get("ANOMALY_Z_THRESHOLD", 4.0))
+ANOMALY_WARMUP_SAMPLES = int(os.environ.get("ANOMALY_WARMUP_SAMPLES", 30))
+ANOMALY_MIN_RATE = int(os.environ.get("ANOMALY_MIN_RATE", 30))
+ANOMALY_FLUSH_SECONDS = float(os.environ.get("ANOMALY_FLUSH_SECONDS", 60))
+# Level 3 protection raised by an anomaly alone lifts after ANOMALY_PROTECTION_SECONDS once the link's
+# traffic is back within its baseline (threshold-triggered protection stays until recovered or expired)
+ANOMALY_PROTECTION_SECONDS = int(os.environ.get("ANOMALY_PROTECTION_SECONDS", 900))
+
 # File Upload Configuration
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), "static", "uploads")
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
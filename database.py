@@ -5,18 +5,25 @@ Database connection, queries, and setup functions
 
 import os
 import sqlite3
+from datetime import datetime, timezone
 from flask import g
 from config import DATABASE
 
 
+def connect_db(check_same_thread=True):
+    """Open a standalone connection (for background threads outside the app context)"""
+    conn = sqlite3.connect(DATABASE, timeout=10, check_same_thread=check_same_thread) # 10 seconds timeout
+    conn.row_factory = sqlite3.Row
+    
+    # Enable WAL mode for better concurrency
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
 def get_db():
     """Get database connection"""
     if "db" not in g:
-        g.db = sqlite3.connect(DATABASE, timeout=10) # 10 seconds timeout
-        g.db.row_factory = sqlite3.Row
-        
-        # Enable WAL mode for better concurrency
-        g.db.execute("PRAGMA journal_mode=WAL")
+        g.db = connect_db()
     return g.db
 
 
@@ -29,10 +36,27 @@ def query_db(query: str, args=None, one=False):
 
 
 def execute_db(query: str, args=None):
-    """Execute database command"""
+    """Execute database command and return the last inserted row id"""
     db = get_db()
-    db.execute(query, args or [])
+    cur = db.execute(query, args or [])
     db.commit()
+    return cur.lastrowid
+
+
+def epoch_ms(dt: datetime = None) -> int:
+    """Milliseconds since the epoch of a naive UTC datetime (default now), as stored in ts_ms columns"""
+    dt = dt or datetime.utcnow()
+    return round(dt.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def row_epoch_ms(row):
+    """ts_ms of a visit row, parsed from its ts when ts_ms is NULL; None if neither is usable"""
+    if row["ts_ms"] is not None:
+        return row["ts_ms"]
+    try:
+        return epoch_ms(datetime.fromisoformat(row["ts"]))
+    except (TypeError, ValueError):
+        return None
 
 
 def close_db(error):
@@ -173,23 +197,39 @@ def ensure_db():
         )
     """)
 
-    # Ensure additional columns exist
-    ensure_column("links", "protection_level", "protection_level INTEGER DEFAULT 0")
-    ensure_column("links", "auto_disabled", "auto_disabled INTEGER DEFAULT 0")
-    ensure_column("links", "ddos_detected_at", "ddos_detected_at TEXT")
-    ensure_column("links", "password_hash", "password_hash TEXT")
-    ensure_column("users", "membership_tier", "membership_tier TEXT DEFAULT 'free'")
-    ensure_column("users", "premium_expires_at", "premium_expires_at TEXT")
-    ensure_column("users", "premium_expires_at", "premium_expires_at TEXT")
-    ensure_column("links", "expires_at", "expires_at TEXT")
-
-    # Ensure behavior_rules columns
-    ensure_column("behavior_rules", "requests_per_ip_per_minute", "requests_per_ip_per_minute INTEGER DEFAULT 60")
-    ensure_column("behavior_rules", "requests_per_ip_per_hour", "requests_per_ip_per_hour INTEGER DEFAULT 1000")
-    ensure_column("behavior_rules", "requests_per_link_per_minute", "requests_per_link_per_minute INTEGER DEFAULT 500")
-    ensure_column("behavior_rules", "burst_threshold", "burst_threshold INTEGER DEFAULT 100")
-    ensure_column("behavior_rules", "suspicious_threshold", "suspicious_threshold INTEGER DEFAULT 10")
-    ensure_column("behavior_rules", "ddos_threshold", "ddos_threshold INTEGER DEFAULT 50")
+    # Geolocation cache table (IP -> JSON lookup result, expires_at in epoch seconds)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS geo_cache (
+            ip TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            status TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+    # Visit count per (link, session), upserted with each visit batch (see visit_pipeline.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS session_stats (
+            link_id INTEGER NOT NULL,
+            session_id TEXT NOT NULL,
+            visit_count INTEGER NOT NULL DEFAULT 0,
+            first_ts TEXT,
+            last_ts TEXT,
+            PRIMARY KEY (link_id, session_id)
+        ) WITHOUT ROWID
+    """)
+
+    # Bot/preview hits per link (aggregated in memory, see bot_counter.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bot_hits (
+            link_id INTEGER PRIMARY KEY,
+            hits INTEGER NOT NULL DEFAULT 0,
+            last_seen TEXT,
+            FOREIGN KEY(link_id) REFERENCES links(id)
+        )
+    """)
+
+    # Columns added to existing tables, backfills and indexes are versioned migrations (migrations.py)
     
     # Notification dismissals table
     conn.execute("""
@@ -0,0 +1,76 @@
+"""
+Smart Link Intelligence - DDoS Event Aggregator
+Coalesces DDoS events per (link, event type, IP) in memory and writes one ddos_events row per
+key and flush window, so a flood of rejected requests does not become a flood of inserts
+"""
+
+import atexit
+from datetime import datetime
+from cache import WriteBehindBuffer
+from database import epoch_ms
+from config import DDOS_EVENT_FLUSH_SECONDS, DDOS_EVENT_MAX_KEYS
+
+INSERT_DDOS_EVENT_SQL = """
+    INSERT INTO ddos_events
+    (link_id, event_type, severity, ip_address, ip_hash, detected_at, ts_ms, last_detected_at,
+     event_count, protection_level)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class DDoSEventAggregator(WriteBehindBuffer):
+    """Buffers DDoS events and flushes them in batches; repeats of a key within a window add to its count"""
+
+    name = "DDoS event aggregator"
+    thread_name = "ddos-events"
+
+    def __init__(self, interval: float = DDOS_EVENT_FLUSH_SECONDS, max_keys: int = DDOS_EVENT_MAX_KEYS):
+        # (link_id, event_type, ip_address) -> [severity, protection_level, count, first, last]
+        super().__init__(interval)
+        self.max_keys = max_keys
+        self.stats.update(events=0, overflowed=0)
+
+    def log(self, link_id, event_type: str, severity: int, ip_address: str = None,
+            protection_level: int = None, now: datetime = None):
+        """Record one event occurrence"""
+        now = now or datetime.utcnow()
+        level = severity if protection_level is None else protection_level
+        with self._lock:
+            key = (link_id, event_type, ip_address)
+            if key not in self._pending and len(self._pending) >= self.max_keys:
+                # Too many distinct IPs in this window: count the rest on one per-link row
+                key = (link_id, event_type, None)
+                self.stats["overflowed"] += 1
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [severity, level, 1, now, now]
+            else:
+                entry[0] = max(entry[0], severity)
+                entry[1] = max(entry[1], level)
+                entry[2] += 1
+                entry[4] = now
+            self.stats["events"] += 1
+        self.schedule()
+
+    def write(self, conn, batch: dict):
+        from utils import hash_value
+
+        conn.executemany(INSERT_DDOS_EVENT_SQL, [
+            [link_id, event_type, severity, ip_address,
+             hash_value(ip_address) if ip_address else None,
+             first.isoformat(), epoch_ms(first), last.isoformat(), count, level]
+            for (link_id, event_type, ip_address), (severity, level, count, first, last) in batch.items()
+        ])
+
+    def merge(self, batch: dict):
+        for key, (severity, level, count, first, last) in batch.items():
+            entry = self._pending.setdefault(key, [severity, level, 0, first, last])
+            entry[0] = max(entry[0], severity)
+            entry[1] = max(entry[1], level)
+            entry[2] += count
+            entry[3] = min(entry[3], first)
+            entry[4] = max(entry[4], last)
+
+
+event_aggregator = DDoSEventAggregator()
+atexit.register(event_aggregator.shutdown)
@@ -2,12 +2,26 @@
 import sqlite3
 import time
 from datetime import datetime, timedelta
-from collections import defaultdict
 import hashlib
 from flask import Blueprint, render_template, request, redirect, url_for, flash, abort, g
 from functools import wraps
-from database import query_db, execute_db
-from config import MEMBERSHIP_TIERS
+from database import query_db, execute_db, epoch_ms
+from config import (
+    MEMBERSHIP_TIERS, DATABASE, IP_AUTO_BLOCK_SECONDS, IP_RULES_MAX_PER_USER,
+    ANOMALY_PROTECTION_SECONDS, ANOMALY_SAMPLE_SECONDS
+)
+from redirect_plan import invalidate_link, invalidate_user
+from rate_limiter import rate_limiter
+from link_traffic import link_traffic
+from anomaly import anomaly_detector
+from ddos_events import event_aggregator
+from ip_rules import ip_rules
+
+# Level 4 protection lifts this long after the attack was detected
+TEMPORARY_DISABLE_SECONDS = 3600
+
+# Detection reasons from the learned baselines; the protection they raise expires on its own
+ANOMALY_REASONS = ('traffic_anomaly', 'suspicious_ratio_anomaly')
 
 # Create Blueprint for DDoS protection routes
 ddos_bp = Blueprint('ddos', __name__, url_prefix='/ddos-protection')
@@ -34,8 +48,10 @@ def ddos_required(f):
     return decorated_function
 
 class DDoSProtection:
-    def __init__(self, database_path):
+    def __init__(self, database_path, limiter=None):
         self.db_path = database_path
+        # Request counters must outlive a single request: share the process-wide limiter
+        self.limiter = limiter or rate_limiter
         self.rate_limits = {
             'requests_per_ip_per_minute': 60,
             'requests_per_ip_per_hour': 1000,
@@ -48,10 +64,7 @@ class DDoSProtection:
             'detection_window_minutes': 5,
         }
         
-        self.request_cache = defaultdict(list)
-        self.blocked_ips = {}
-        
-    def get_link_rules(self, link_id):
+    def get_link_rules(self, link_id, link=None):
         """Get DDoS rules for a link (custom or default)"""
         # Default rules
         rules = self.rate_limits.copy()
@@ -61,7 +74,8 @@ class DDoSProtection:
             
         try:
             # Get security_profile_id and user_id for the link
-            link = query_db("SELECT security_profile_id, user_id FROM links WHERE id = ?", [link_id], one=True)
+            if link is None:
+                link = query_db("SELECT security_profile_id, user_id FROM links WHERE id = ?", [link_id], one=True)
             
             profile = None
             if link:
@@ -90,7 +104,7 @@ class DDoSProtection:
         return rules
         
         
-    def check_rate_limit(self, ip_address, link_id=None):
+    def check_rate_limit(self, ip_address, link_id=None, rules=None):
         """Check if request should be rate limited"""
         from flask import request
         
@@ -113,52 +127,32 @@ class DDoSProtection:
             if any(agent in user_agent for agent in load_test_agents):
                 return True, 'load_test_tool_allowed'
         
-        now = datetime.utcnow()
-        
         # Get rules for this link
-        rules = self.get_link_rules(link_id)
-        
-        # Clean old entries
-        self._cleanup_cache(now)
-        
-        # Check IP-based rate limits
-        ip_requests = self.request_cache[f"ip_{ip_address}"]
+        if rules is None:
+            rules = self.get_link_rules(link_id)
         
-        # Count requests in last minute
-        minute_ago = now - timedelta(minutes=1)
-        recent_requests = [req for req in ip_requests if req > minute_ago]
+        # Per-minute, per-hour and 10 second burst windows of this IP on this link
+        status = self.limiter.check(ip_address, link_id, rules)
         
-        if len(recent_requests) > rules['requests_per_ip_per_minute']:
+        if status == 'rate_limited':
             self._log_ddos_event(link_id, 'rate_limit', 2, ip_address)
             return False, 'rate_limited'
-            
-        # Count requests in last hour
-        hour_ago = now - timedelta(hours=1)
-        hourly_requests = [req for req in ip_requests if req > hour_ago]
-        
-        if len(hourly_requests) > rules['requests_per_ip_per_hour']:
+        if status == 'hourly_rate_limited':
             self._log_ddos_event(link_id, 'hourly_rate_limit', 2, ip_address)
-            return False, 'rate_limited'
-        
-        # Check for burst attacks (requests in 10 seconds)
-        burst_window = now - timedelta(seconds=10)
-        burst_requests = [req for req in ip_requests if req > burst_window]
-        
-        if len(burst_requests) > rules['burst_threshold']:
+            return False, 'hourly_rate_limited'
+        if status == 'burst_attack':
             self._log_ddos_event(link_id, 'burst_attack', 4, ip_address)
             return False, 'burst_attack'
         
-        # Add current request to cache
-        self.request_cache[f"ip_{ip_address}"].append(now)
-        
         return True, 'allowed'
     
-    def detect_ddos_attack(self, link_id):
+    def detect_ddos_attack(self, link_id, rules=None):
         """Detect if link is under DDoS attack"""
         from flask import request
         
         # Get rules for this link
-        rules = self.get_link_rules(link_id)
+        if rules is None:
+            rules = self.get_link_rules(link_id)
         
         # Check for load testing - don't trigger DDoS protection for legitimate tests
         if request and hasattr(request, 'headers'):
@@ -179,26 +173,14 @@ class DDoSProtection:
             if any(agent in user_agent for agent in load_test_agents):
                 return False, 'load_test_tool_bypass', 1
         
-        # Check recent suspicious activity using CUSTOM WINDOW
+        # Request rate (last minute) and suspicious activity within the CUSTOM WINDOW,
+        # from the in-memory per-link counters fed by the visit pipeline
         window = rules.get('detection_window_minutes', 5)
-        recent_suspicious = query_db(f"""
-            SELECT COUNT(*) as count
-            FROM visits 
-            WHERE link_id = ? 
-            AND is_suspicious = 1 
-            AND datetime(ts) > datetime('now', '-{window} minutes')
-        """, [link_id], one=True)
-        
-        # Check request rate
-        recent_requests = query_db("""
-            SELECT COUNT(*) as count
-            FROM visits 
-            WHERE link_id = ? 
-            AND datetime(ts) > datetime('now', '-1 minute')
-        """, [link_id], one=True)
+        request_count, suspicious_count = link_traffic.counts(link_id, window)
         
-        suspicious_count = recent_suspicious['count'] if recent_suspicious else 0
-        request_count = recent_requests['count'] if recent_requests else 0
+        # Deviation from this link's own learned traffic (z-scores of rate and suspicious ratio)
+        _, suspicious_last_minute = link_traffic.counts(link_id, 1)
+        score = anomaly_detector.observe(link_id, request_count, suspicious_last_minute)
         
         # DDoS Detection Logic
         if suspicious_count > rules['ddos_threshold']:
@@ -207,19 +189,25 @@ class DDoSProtection:
             return True, 'high_request_rate', 4
         elif suspicious_count > rules['suspicious_threshold']:
             return True, 'moderate_suspicious_activity', 3
+        elif score.rate_anomaly:
+            return True, 'traffic_anomaly', 3
+        elif score.ratio_anomaly:
+            return True, 'suspicious_ratio_anomaly', 3
         
         return False, 'normal', 1
     
-    def apply_protection(self, link_id, protection_level):
-        """Apply protection measures based on severity"""
+    def apply_protection(self, link_id, protection_level, reason=None):
+        """Apply protection measures based on severity (reason: what detect_ddos_attack reported)"""
+        if protection_level >= 3:
+            invalidate_link(link_id)
         
         if protection_level >= 5:
             # Level 5: Break the link (disable completely)
             execute_db("""
                 UPDATE links 
-                SET protection_level = ?, auto_disabled = 1, ddos_detected_at = ?
+                SET protection_level = ?, auto_disabled = 1, ddos_detected_at = ?, protection_reason = ?
                 WHERE id = ?
-            """, [protection_level, datetime.utcnow().isoformat(), link_id])
+            """, [protection_level, datetime.utcnow().isoformat(), reason, link_id])
             
             self._log_ddos_event(link_id, 'link_disabled', 5)
             return 'link_disabled'
@@ -228,9 +216,9 @@ class DDoSProtection:
             # Level 4: Temporary disable (1 hour)
             execute_db("""
                 UPDATE links 
-                SET protection_level = ?, ddos_detected_at = ?
+                SET protection_level = ?, ddos_detected_at = ?, protection_reason = ?
                 WHERE id = ?
-            """, [protection_level, datetime.utcnow().isoformat(), link_id])
+            """, [protection_level, datetime.utcnow().isoformat(), reason, link_id])
             
             self._log_ddos_event(link_id, 'temporary_disable', 4)
             return 'temporary_disabled'
@@ -239,11 +227,11 @@ class DDoSProtection:
             # Level 3: Captcha required
             execute_db("""
                 UPDATE links 
-                SET protection_level = ?
+                SET protection_level = ?, ddos_detected_at = ?, protection_reason = ?
                 WHERE id = ?
-            """, [protection_level, link_id])
+            """, [protection_level, datetime.utcnow().isoformat(), reason, link_id])
             
-            self._log_ddos_event(link_id, 'captcha_required', 3)
+            self._log_ddos_event(link_id, reason if reason in ANOMALY_REASONS else 'captcha_required', 3)
             return 'captcha_required'
         
         return 'normal'
@@ -251,7 +239,7 @@ class DDoSProtection:
     def is_link_protected(self, link_id):
         """Check if link has active protection"""
         link = query_db("""
-            SELECT protection_level, auto_disabled, ddos_detected_at
+            SELECT protection_level, auto_disabled, ddos_detected_at, protection_reason
             FROM links WHERE id = ?
         """, [link_id], one=True)
         
@@ -264,51 +252,69 @@ class DDoSProtection:
             # Check if temporary disable has expired
             if link['ddos_detected_at']:
                 detected_time = datetime.fromisoformat(link['ddos_detected_at'])
-                if datetime.utcnow() - detected_time > timedelta(hours=1):
+                if datetime.utcnow() - detected_time > timedelta(seconds=TEMPORARY_DISABLE_SECONDS):
                     # Reset protection level
                     self._reset_protection(link_id)
                     return False, 'normal'
             return True, 'temporary_disabled'
         elif link['protection_level'] >= 3:
+            if link['protection_reason'] in ANOMALY_REASONS and self._anomaly_protection_expired(link_id, link['ddos_detected_at']):
+                self._reset_protection(link_id)
+                return False, 'normal'
             return True, 'captcha_required'
         
         return False, 'normal'
     
-    def _cleanup_cache(self, now):
-        """Clean old entries from request cache"""
-        cutoff = now - timedelta(hours=1)
-        for key in list(self.request_cache.keys()):
-            self.request_cache[key] = [
-                req for req in self.request_cache[key] 
-                if req > cutoff
-            ]
-            if not self.request_cache[key]:
-                del self.request_cache[key]
+    def _anomaly_protection_expired(self, link_id, detected_at):
+        """Anomaly protection lifts ANOMALY_PROTECTION_SECONDS after detection once no anomaly was seen for a sample"""
+        try:
+            detected = datetime.fromisoformat(detected_at) if detected_at else None
+        except ValueError:
+            detected = None
+        if detected and datetime.utcnow() - detected < timedelta(seconds=ANOMALY_PROTECTION_SECONDS):
+            return False
+        return not anomaly_detector.anomalous_since(link_id, time.time() - ANOMALY_SAMPLE_SECONDS)
+    
+    def temporary_disable_remaining(self, detected_at):
+        """Seconds until a level 4 temporary disable detected at detected_at (ISO string) lifts"""
+        if not detected_at:
+            return TEMPORARY_DISABLE_SECONDS
+        try:
+            elapsed = (datetime.utcnow() - datetime.fromisoformat(detected_at)).total_seconds()
+        except ValueError:
+            return TEMPORARY_DISABLE_SECONDS
+        remaining = TEMPORARY_DISABLE_SECONDS - elapsed
+        return remaining if remaining > 0 else TEMPORARY_DISABLE_SECONDS
+    
+    def auto_block_ip(self, link, ip_address, reason):
+        """Temporarily block an attacking IP on every link of the owner (an ip_rules entry)"""
+        try:
+            ip_rules.add(link["user_id"], ip_address, "block", reason=f"{reason} on /r/{link['code']}",
+                         seconds=IP_AUTO_BLOCK_SECONDS, source="auto")
+        except ValueError:
+            return  # Not an IP address (e.g. "unknown")
+        self._log_ddos_event(link["id"], 'ip_auto_blocked', 4, ip_address)
     
     def _log_ddos_event(self, link_id, event_type, severity, ip_address=None):
-        """Log DDoS event to database"""
-        execute_db("""
-            INSERT INTO ddos_events 
-            (link_id, event_type, severity, ip_address, detected_at, protection_level)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, [link_id, event_type, severity, ip_address, 
-              datetime.utcnow().isoformat(), severity])
+        """Log DDoS event (coalesced per link, type and IP, written in batches)"""
+        event_aggregator.log(link_id, event_type, severity, ip_address)
     
     def _reset_protection(self, link_id):
         """Reset protection level for a link"""
         execute_db("""
             UPDATE links 
-            SET protection_level = 0, ddos_detected_at = NULL
+            SET protection_level = 0, ddos_detected_at = NULL, protection_reason = NULL
             WHERE id = ?
         """, [link_id])
+        invalidate_link(link_id)
     
     def get_protection_stats(self, link_id):
         """Get protection statistics for a link"""
         stats = query_db("""
             SELECT 
                 event_type,
-                COUNT(*) as count,
-                MAX(detected_at) as last_event
+                SUM(event_count) as count,
+                MAX(COALESCE(last_detected_at, detected_at)) as last_event
             FROM ddos_events 
             WHERE link_id = ?
             GROUP BY event_type
@@ -320,6 +326,9 @@ class DDoSProtection:
             
         return [dict(row) for row in stats]
 
+# Process-wide engine: request counters have to persist across requests
+ddos_protection = DDoSProtection(DATABASE)
+
 # DDoS Protection Routes
 @ddos_bp.route('/')
 @ddos_required
@@ -337,8 +346,8 @@ def ddos_protection_dashboard():
         FROM links l
         LEFT JOIN (
             SELECT link_id, 
-                   COUNT(*) as event_count,
-                   MAX(detected_at) as last_event
+                   SUM(event_count) as event_count,
+                   MAX(COALESCE(last_detected_at, detected_at)) as last_event
             FROM ddos_events 
             GROUP BY link_id
         ) de ON l.id = de.link_id
@@ -355,7 +364,7 @@ def ddos_protection_dashboard():
         FROM ddos_events de
         JOIN links l ON de.link_id = l.id
         WHERE l.user_id = ?
-        ORDER BY de.detected_at DESC
+        ORDER BY de.ts_ms DESC
         LIMIT 20
         """,
         [g.user["id"]]
@@ -390,20 +399,23 @@ def recover_link(link_id):
     execute_db(
         """
         UPDATE links 
-        SET protection_level = 0, auto_disabled = 0, ddos_detected_at = NULL
+        SET protection_level = 0, auto_disabled = 0, ddos_detected_at = NULL, protection_reason = NULL
         WHERE id = ?
         """,
         [link_id]
     )
+    invalidate_link(link_id, link["code"])
+    ddos_protection.limiter.reset(link_id)
     
     # Log recovery event
+    now = datetime.utcnow()
     execute_db(
         """
         INSERT INTO ddos_events 
-        (link_id, event_type, severity, detected_at, protection_level)
-        VALUES (?, ?, ?, ?, ?)
+        (link_id, event_type, severity, detected_at, ts_ms, last_detected_at, protection_level)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
-        [link_id, 'manual_recovery', 1, datetime.utcnow().isoformat(), 0]
+        [link_id, 'manual_recovery', 1, now.isoformat(), epoch_ms(now), now.isoformat(), 0]
     )
     
     track_user_activity(g.user["id"], "recover_link", f"Manually recovered link: {link['code']}")
@@ -428,15 +440,15 @@ def ddos_link_stats(link_id):
         abort(404)
     
     # Get protection statistics
-    ddos_protection = DDoSProtection("smart_links.db")  # Use relative path
     stats = ddos_protection.get_protection_stats(link_id)
+    baseline = anomaly_detector.describe(link_id)
     
     # Get detailed events
     events = query_db(
         """
         SELECT * FROM ddos_events 
         WHERE link_id = ?
-        ORDER BY detected_at DESC
+        ORDER BY ts_ms DESC
         LIMIT 50
         """,
         [link_id]
@@ -447,7 +459,8 @@ def ddos_link_stats(link_id):
     return render_template("ddos_link_stats.html", 
                          link=link, 
                          stats=stats, 
-                         events=events)
+                         events=events,
+                         baseline=baseline)
 
 
 @ddos_bp.route('/security-profiles')
@@ -515,6 +528,7 @@ def create_security_profile():
         """,
         [g.user["id"], profile_name, ip_min, ip_hour, link_min, burst, suspicious, ddos, rapid, kill, window]
     )
+    invalidate_user(g.user["id"])
     
     track_user_activity(g.user["id"], "create_security_profile", f"Created security profile: {profile_name}")
     flash(f"Security profile '{profile_name}' created successfully", "success")
@@ -562,6 +576,7 @@ def update_security_profile(profile_id):
         """,
         [profile_name, ip_min, ip_hour, link_min, burst, suspicious, ddos, rapid, kill, window, profile_id]
     )
+    invalidate_user(g.user["id"])
     
     track_user_activity(g.user["id"], "update_security_profile", f"Updated security profile: {profile_name}")
     flash(f"Security profile '{profile_name}' updated successfully", "success")
@@ -588,6 +603,7 @@ def delete_security_profile(profile_id):
             execute_db("UPDATE links SET security_profile_id = ? WHERE security_profile_id = ?", [default_profile['id'], profile_id])
             
         execute_db("DELETE FROM security_profiles WHERE id = ?", [profile_id])
+        invalidate_user(g.user["id"])
         track_user_activity(g.user["id"], "delete_security_profile", f"Deleted security profile: {profile['profile_name']}")
         flash(f"Security profile '{profile['profile_name']}' deleted", "info")
         
@@ -610,7 +626,77 @@ def set_default_security_profile(profile_id):
         execute_db("UPDATE security_profiles SET is_default = 0 WHERE user_id = ?", [g.user["id"]])
         # Set new default
         execute_db("UPDATE security_profiles SET is_default = 1 WHERE id = ?", [profile_id])
+        invalidate_user(g.user["id"])
         track_user_activity(g.user["id"], "set_default_security_profile", f"Set default security profile: {profile['profile_name']}")
         flash(f"Security profile '{profile['profile_name']}' is now the default", "success")
         
-    return redirect(url_for("ddos.security_profiles"))
\ No newline at end of file
+    return redirect(url_for("ddos.security_profiles"))
+
+
+@ddos_bp.route('/ip-rules')
+@ddos_required
+def ip_rules_list():
+    """Manage CIDR block and allow rules"""
+    # Import here to avoid circular imports
+    from admin_panel import track_user_activity
+    
+    rules = query_db(
+        """
+        SELECT * FROM ip_rules
+        WHERE user_id = ? AND (expires_at IS NULL OR expires_at > ?)
+        ORDER BY created_at DESC
+        """,
+        [g.user["id"], datetime.utcnow().isoformat()]
+    )
+    
+    track_user_activity(g.user["id"], "view_ip_rules", "Viewed IP rules")
+    return render_template("ddos_ip_rules.html", rules=rules, max_rules=IP_RULES_MAX_PER_USER)
+
+
+@ddos_bp.route('/ip-rules/create', methods=["POST"])
+@ddos_required
+def create_ip_rule():
+    """Block or allow an IP address or CIDR range on all of the user's links"""
+    # Import here to avoid circular imports
+    from admin_panel import track_user_activity
+    
+    cidr = request.form.get("cidr", "").strip()
+    action = request.form.get("action", "block")
+    reason = request.form.get("reason", "").strip()[:200] or None
+    duration_hours = int(request.form.get("duration_hours", 0) or 0)
+    
+    if not cidr:
+        flash("IP address or CIDR range is required", "danger")
+        return redirect(url_for("ddos.ip_rules_list"))
+    
+    count = query_db("SELECT COUNT(*) as count FROM ip_rules WHERE user_id = ?", [g.user["id"]], one=True)["count"]
+    if count >= IP_RULES_MAX_PER_USER:
+        flash(f"You can only have up to {IP_RULES_MAX_PER_USER} IP rules", "warning")
+        return redirect(url_for("ddos.ip_rules_list"))
+    
+    try:
+        rule = ip_rules.add(g.user["id"], cidr, action, reason=reason,
+                            seconds=duration_hours * 3600 if duration_hours > 0 else None)
+    except ValueError as e:
+        flash(f"Invalid IP rule: {e}", "danger")
+        return redirect(url_for("ddos.ip_rules_list"))
+    
+    track_user_activity(g.user["id"], "create_ip_rule", f"{action.title()} {rule.cidr}")
+    flash(f"{rule.cidr} will be {'blocked' if action == 'block' else 'allowed'} on all your links", "success")
+    return redirect(url_for("ddos.ip_rules_list"))
+
+
+@ddos_bp.route('/ip-rules/delete/<int:rule_id>', methods=["POST"])
+@ddos_required
+def delete_ip_rule(rule_id):
+    """Delete a CIDR rule"""
+    # Import here to avoid circular imports
+    from admin_panel import track_user_activity
+    
+    if ip_rules.remove(rule_id, g.user["id"]):
+        track_user_activity(g.user["id"], "delete_ip_rule", f"Deleted IP rule {rule_id}")
+        flash("IP rule deleted", "info")
+    else:
+        flash("IP rule not found", "danger")
+        
+    return redirect(url_for("ddos.ip_rules_list"))
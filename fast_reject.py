@@ -0,0 +1,175 @@
+"""
+Smart Link Intelligence - Fast Reject Path
+In-memory blocklist of protected links (code -> protection state + expiry) and rate-limited IPs
+((code, ip) -> blocked until), checked before sessions, users or the database are touched and
+answered with a pre-rendered 429/503 page or, at protection level 3, a proof-of-work challenge
+"""
+
+import math
+import threading
+import time
+from flask import Response, current_app, g, render_template, request, url_for
+from cache import LRUCache
+from pow_challenge import proof_of_work, PASS_COOKIE
+from config import (
+    REDIRECT_PLAN_CACHE_SIZE,
+    FAST_REJECT_LINK_SECONDS, FAST_REJECT_IP_SECONDS, FAST_REJECT_BLOCK_SECONDS, FAST_REJECT_MAX_IPS
+)
+
+# status -> (HTTP status, page title, description)
+REJECT_PAGES = {
+    "link_disabled": (503, "Link Protected",
+                      "This link has been automatically protected due to detected attacks."),
+    "disabled": (503, "Link Disabled",
+                 "This link has been automatically disabled due to detected DDoS attacks."),
+    "temporary_disabled": (503, "Temporarily Unavailable",
+                           "This link is temporarily disabled due to unusual traffic patterns. Please try again later."),
+    "rate_limited": (429, "Rate Limited",
+                     "You're making requests too quickly. Please wait a moment and try again."),
+    "hourly_rate_limited": (429, "Rate Limited",
+                            "You've made too many requests to this link. Please try again later."),
+    "burst_attack": (429, "Blocked",
+                     "Suspicious activity detected from your connection."),
+    "ip_blocked": (403, "Access Blocked",
+                   "Access to this link from your network has been blocked by its owner."),
+}
+
+# Filled into the challenge page rendered once with these markers
+CHALLENGE_MARKERS = {"action": "__POW_ACTION__", "challenge": "__POW_CHALLENGE__", "bits": "__POW_BITS__"}
+
+# How long an IP stays in the fast path per limiter status
+IP_BLOCK_SECONDS = {
+    "rate_limited": FAST_REJECT_IP_SECONDS,
+    "hourly_rate_limited": FAST_REJECT_BLOCK_SECONDS,
+    "burst_attack": FAST_REJECT_BLOCK_SECONDS,
+}
+
+
+class FastRejectList:
+    """
+    Per-process blocklist consulted at the top of every /r/<code> request.
+
+    Entries are added by the full redirect path when it rejects a request and
+    expire on their own; a hit costs two dict lookups and returns a cached body.
+    """
+
+    def __init__(self, link_seconds: float = FAST_REJECT_LINK_SECONDS, max_links: int = REDIRECT_PLAN_CACHE_SIZE,
+                 max_ips: int = FAST_REJECT_MAX_IPS):
+        self.link_seconds = link_seconds
+        # code -> (link_id, status, retry_at)
+        self.links = LRUCache(maxsize=max_links)
+        # (code, ip) -> (link_id, status, retry_at)
+        self.ips = LRUCache(maxsize=max_ips)
+        # code -> (link_id, protection_level) of links that require a proof-of-work pass
+        self.challenges = LRUCache(maxsize=max_links)
+        self._pages = {}
+        self._lock = threading.Lock()
+        self.stats = {"rejected": 0, "challenged": 0, "link_blocks": 0, "ip_blocks": 0}
+
+    def check(self, code: str, ip_address: str, pass_token: str = None):
+        """Return the reject or challenge response for a blocked link or IP, None to take the full path"""
+        if not (self.links or self.ips or self.challenges):
+            return None
+        entry = self.links.get(code) or self.ips.get((code, ip_address))
+        if entry is None:
+            challenge = self.challenges.get(code)
+            if challenge is None or proof_of_work.verify_pass(pass_token, challenge[0], ip_address):
+                return None
+            with self._lock:
+                self.stats["challenged"] += 1
+            return self.challenge_response(challenge[0], code, challenge[1], ip_address)
+        with self._lock:
+            self.stats["rejected"] += 1
+        return self.response(entry[1], entry[2] - time.monotonic())
+
+    def reject_link(self, link_id: int, code: str, status: str, retry_after: float = None):
+        """Block a protected link in the fast path and return its reject response"""
+        retry_after = self.link_seconds if retry_after is None else retry_after
+        self.links.set(code, (link_id, status, time.monotonic() + retry_after),
+                       ttl=max(1, min(retry_after, self.link_seconds)))
+        with self._lock:
+            self.stats["link_blocks"] += 1
+        return self.response(status, retry_after)
+
+    def reject_ip(self, link_id: int, code: str, ip_address: str, status: str):
+        """Block a rate-limited IP on a link in the fast path and return its reject response"""
+        seconds = IP_BLOCK_SECONDS.get(status, FAST_REJECT_IP_SECONDS)
+        self.ips.set((code, ip_address), (link_id, status, time.monotonic() + seconds), ttl=seconds)
+        with self._lock:
+            self.stats["ip_blocks"] += 1
+        return self.response(status, seconds)
+
+    def challenge_link(self, link_id: int, code: str, protection_level: int, ip_address: str):
+        """Require a proof-of-work pass for a link in the fast path and return a challenge for this client"""
+        self.challenges.set(code, (link_id, protection_level), ttl=self.link_seconds)
+        with self._lock:
+            self.stats["challenged"] += 1
+        return self.challenge_response(link_id, code, protection_level, ip_address)
+
+    def unblock_link(self, link_id: int = None, code: str = None):
+        """Drop the link, challenge and IP blocks of a link (its protection or limits changed)"""
+        if code is not None:
+            self.links.pop(code)
+            self.challenges.pop(code)
+            self.ips.discard_where(lambda key, _entry: key[0] == code)
+        if link_id is not None:
+            link_id = int(link_id)
+            self.links.discard_where(lambda _code, entry: entry[0] == link_id)
+            self.challenges.discard_where(lambda _code, entry: entry[0] == link_id)
+            self.ips.discard_where(lambda _key, entry: entry[0] == link_id)
+
+    def clear(self):
+        """Drop every block"""
+        self.links.clear()
+        self.ips.clear()
+        self.challenges.clear()
+
+    def response(self, status: str, retry_after: float) -> Response:
+        """The cached reject page for a status with a Retry-After header"""
+        http_status, message, description = REJECT_PAGES[status]
+        body = self._pages.get(status)
+        if body is None:
+            # Rendered once per process as an anonymous visitor, so it holds nothing user-specific
+            with current_app.test_request_context("/"):
+                g.user = None
+                body = render_template("ddos_blocked.html", message=message, description=description).encode()
+            self._pages[status] = body
+        return Response(body, http_status, mimetype="text/html", headers={
+            "Retry-After": str(max(1, math.ceil(retry_after))),
+            "Cache-Control": "no-store",
+        })
+
+    def challenge_response(self, link_id: int, code: str, protection_level: int, ip_address: str) -> Response:
+        """The cached challenge page filled with a fresh challenge signed for this client"""
+        page = self._pages.get("challenge")
+        if page is None:
+            with current_app.test_request_context("/"):
+                g.user = None
+                page = render_template("pow_challenge.html", **CHALLENGE_MARKERS)
+            self._pages["challenge"] = page
+        challenge, bits = proof_of_work.new_challenge(link_id, protection_level, ip_address)
+        body = (page.replace(CHALLENGE_MARKERS["action"], url_for("links.verify_challenge", code=code))
+                .replace(CHALLENGE_MARKERS["challenge"], challenge)
+                .replace(CHALLENGE_MARKERS["bits"], str(bits)))
+        return Response(body, 403, mimetype="text/html", headers={"Cache-Control": "no-store"})
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["links"] = self.links.stats()
+        stats["ips"] = self.ips.stats()
+        stats["challenges"] = self.challenges.stats()
+        return stats
+
+
+fast_reject = FastRejectList()
+
+
+def fast_reject_request():
+    """before_request hook: answer blocked /r/<code> requests before the session, user or database"""
+    if request.endpoint != "links.redirect_link" or not (fast_reject.links or fast_reject.ips or fast_reject.challenges):
+        return None
+    from utils import get_client_ip
+
+    return fast_reject.check(request.view_args["code"], get_client_ip(), request.cookies.get(PASS_COOKIE))
@@ -0,0 +1,84 @@
+"""
+Smart Link Intelligence - Geolocation Cache
+Two-tier IP geolocation cache: in-memory LRU with TTL in front of the geo_cache SQLite table
+"""
+
+import json
+import threading
+import time
+from cache import LRUCache
+from database import connect_db
+from config import GEO_CACHE_MEMORY_SIZE, GEO_CACHE_TTL_SECONDS, GEO_CACHE_NEGATIVE_TTL_SECONDS
+
+# Remove expired rows from the table after this many writes
+PURGE_EVERY_WRITES = 1000
+
+
+class GeoCache:
+    """IP -> lookup result cache; failed lookups are negatively cached for a shorter TTL"""
+
+    def __init__(self, maxsize: int = GEO_CACHE_MEMORY_SIZE, ttl: int = GEO_CACHE_TTL_SECONDS,
+                 negative_ttl: int = GEO_CACHE_NEGATIVE_TTL_SECONDS):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _conn(self):
+        # Lookups run in request threads and enrichment workers, so keep one connection per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_db()
+        return conn
+
+    def get(self, ip: str):
+        """Return the cached result for ip (memory first, then SQLite) or None"""
+        data = self.memory.get(ip)
+        if data is not None:
+            return data
+
+        now = time.time()
+        try:
+            row = self._conn().execute(
+                "SELECT data, expires_at FROM geo_cache WHERE ip = ? AND expires_at > ?", [ip, now]
+            ).fetchone()
+        except Exception as e:
+            print(f"Geo cache read error for {ip}: {e}")
+            return None
+        if not row:
+            return None
+
+        data = json.loads(row["data"])
+        self.memory.set(ip, data, ttl=row["expires_at"] - now)
+        return data
+
+    def set(self, ip: str, data: dict):
+        """Cache a lookup result in both tiers"""
+        ttl = self.ttl if data.get("status") == "success" else self.negative_ttl
+        self.memory.set(ip, data, ttl=ttl)
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO geo_cache (ip, data, status, expires_at) VALUES (?, ?, ?, ?)",
+                [ip, json.dumps(data), data.get("status", "fail"), time.time() + ttl],
+            )
+            conn.commit()
+            with self._lock:
+                self._writes += 1
+                purge = self._writes % PURGE_EVERY_WRITES == 0
+            if purge:
+                self.purge_expired()
+        except Exception as e:
+            print(f"Geo cache write error for {ip}: {e}")
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the persistent tier"""
+        conn = self._conn()
+        cur = conn.execute("DELETE FROM geo_cache WHERE expires_at <= ?", [time.time()])
+        conn.commit()
+        return cur.rowcount
+
+
+geo_cache = GeoCache()
@@ -0,0 +1,208 @@
+"""
+Smart Link Intelligence - IP Rules
+Per-owner IPv4/IPv6 CIDR block and allow rules, persisted in ip_rules and loaded into a
+longest-prefix-match trie so a visitor IP is matched in O(prefix length)
+"""
+
+import ipaddress
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from database import connect_db, get_db, query_db, execute_db, epoch_ms
+from config import IP_RULES_REFRESH_SECONDS
+
+IPRule = namedtuple("IPRule", "id action cidr expires")  # expires: epoch seconds or None
+
+ACTIONS = ("block", "allow")
+
+# Shortest prefix a rule may cover (a /8 of IPv4, a /32 allocation of IPv6)
+MIN_PREFIX = {4: 8, 6: 32}
+
+LOAD_SQL = """
+    SELECT id, user_id, cidr, action, expires_at FROM ip_rules
+    WHERE expires_at IS NULL OR expires_at > ?
+"""
+
+
+def parse_network(cidr: str):
+    """Normalise an address or CIDR string to an ip_network; raises ValueError if invalid or too broad"""
+    network = ipaddress.ip_network(cidr.strip(), strict=False)
+    if network.version == 6 and network.prefixlen >= 96 and network.network_address.ipv4_mapped is not None:
+        # ::ffff:a.b.c.d/n is the IPv4 range a.b.c.d/(n-96)
+        network = ipaddress.ip_network(f"{network.network_address.ipv4_mapped}/{network.prefixlen - 96}")
+    if network.prefixlen < MIN_PREFIX[network.version]:
+        raise ValueError(f"Prefix /{network.prefixlen} is too broad (minimum /{MIN_PREFIX[network.version]})")
+    return network
+
+
+def _parse_address(ip_address: str):
+    try:
+        address = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return None
+    if address.version == 6 and address.ipv4_mapped is not None:
+        return address.ipv4_mapped
+    return address
+
+
+class PrefixTrie:
+    """Binary trie over address bits; a node is [child0, child1, {user_id: IPRule}]"""
+
+    def __init__(self):
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        self.users = set()
+        self.size = 0
+
+    def insert(self, network, user_id: int, rule: IPRule):
+        bits = network.max_prefixlen
+        value = int(network.network_address)
+        node = self.roots[network.version]
+        for i in range(network.prefixlen):
+            bit = (value >> (bits - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            node[2] = {}
+        if user_id not in node[2]:
+            self.size += 1
+        node[2][user_id] = rule
+        self.users.add(user_id)
+
+    def match(self, address, user_id: int, now: float):
+        """The longest unexpired rule of user_id covering address, or None"""
+        bits = address.max_prefixlen
+        value = int(address)
+        node = self.roots[address.version]
+        best = None
+        depth = 0
+        while node is not None:
+            if node[2]:
+                rule = node[2].get(user_id)
+                if rule is not None and (rule.expires is None or rule.expires > now):
+                    best = rule
+            if depth == bits:
+                break
+            node = node[(value >> (bits - 1 - depth)) & 1]
+            depth += 1
+        return best
+
+
+class IPRuleList:
+    """
+    In-memory view of the ip_rules table.
+
+    Reloaded from the database every refresh_interval seconds so rules added by
+    other workers apply too; rules added in this process are inserted directly.
+    """
+
+    def __init__(self, refresh_interval: float = IP_RULES_REFRESH_SECONDS):
+        self.refresh_interval = refresh_interval
+        self.trie = PrefixTrie()
+        self.loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.stats = {"checks": 0, "blocked": 0, "allowed": 0, "loads": 0, "errors": 0}
+
+    def load(self, now: float = None) -> int:
+        """Rebuild the trie from unexpired rules (dropping expired rows); returns the number loaded"""
+        now = time.time() if now is None else now
+        cutoff = datetime.utcfromtimestamp(now).isoformat()
+        trie = PrefixTrie()
+        try:
+            conn = connect_db(check_same_thread=False)
+            try:
+                conn.execute("DELETE FROM ip_rules WHERE expires_at <= ?", [cutoff])
+                conn.commit()
+                for row in conn.execute(LOAD_SQL, [cutoff]):
+                    try:
+                        network = parse_network(row["cidr"])
+                    except ValueError:
+                        continue
+                    expires = datetime.fromisoformat(row["expires_at"]) if row["expires_at"] else None
+                    trie.insert(network, row["user_id"], IPRule(
+                        row["id"], row["action"], str(network),
+                        epoch_ms(expires) / 1000 if expires else None,
+                    ))
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"IP rules load failed: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+                # Try again on the next interval rather than on every request
+                self.loaded_at = now
+            return 0
+        with self._lock:
+            self.trie = trie
+            self.loaded_at = now
+            self.stats["loads"] += 1
+        return trie.size
+
+    def check(self, user_id: int, ip_address: str, now: float = None):
+        """The rule of a link owner that applies to ip_address (longest prefix wins), or None"""
+        now = time.time() if now is None else now
+        if self.refresh_interval > 0 and now - self.loaded_at >= self.refresh_interval:
+            if self._reload_lock.acquire(blocking=False):
+                try:
+                    self.load(now)
+                finally:
+                    self._reload_lock.release()
+        trie = self.trie
+        if user_id not in trie.users:
+            return None
+        address = _parse_address(ip_address)
+        rule = trie.match(address, user_id, now) if address is not None else None
+        with self._lock:
+            self.stats["checks"] += 1
+            if rule is not None:
+                self.stats["blocked" if rule.action == "block" else "allowed"] += 1
+        return rule
+
+    def add(self, user_id: int, cidr: str, action: str = "block", reason: str = None,
+            seconds: float = None, source: str = "manual") -> IPRule:
+        """Create or replace the rule of a user for a CIDR (expiring after seconds, if given)"""
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        network = parse_network(cidr)
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=seconds) if seconds else None
+        db = get_db()
+        rule_id = db.execute(
+            """
+            INSERT INTO ip_rules (user_id, cidr, action, reason, source, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, cidr) DO UPDATE SET
+                action = excluded.action, reason = excluded.reason, source = excluded.source,
+                created_at = excluded.created_at, expires_at = excluded.expires_at
+            RETURNING id
+            """,
+            [user_id, str(network), action, reason, source, now.isoformat(),
+             expires_at.isoformat() if expires_at else None],
+        ).fetchone()[0]
+        db.commit()
+        rule = IPRule(rule_id, action, str(network),
+                      epoch_ms(expires_at) / 1000 if expires_at else None)
+        with self._lock:
+            self.trie.insert(network, user_id, rule)
+        return rule
+
+    def remove(self, rule_id: int, user_id: int) -> bool:
+        """Delete a rule of a user; returns False if it does not exist"""
+        if not query_db("SELECT id FROM ip_rules WHERE id = ? AND user_id = ?", [rule_id, user_id], one=True):
+            return False
+        execute_db("DELETE FROM ip_rules WHERE id = ?", [rule_id])
+        # Wait for a refresh in progress (it may have read the rule before the delete), then reload
+        with self._reload_lock:
+            self.load()
+        return True
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        with self._lock:
+            return dict(self.stats, rules=self.trie.size, users=len(self.trie.users),
+                        refresh_interval=self.refresh_interval)
+
+
+ip_rules = IPRuleList()
@@ -0,0 +1,186 @@
+"""
+Smart Link Intelligence - Link State Machine
+Incremental per-link health counters (last visit, rolling suspicious window, recent volume),
+O(1) state transitions on each visit and a periodic decay sweep for idle links
+"""
+
+import atexit
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from cache import LRUCache, WriteBehindBuffer
+from database import connect_db
+from config import (
+    ATTENTION_DECAY_DAYS, STATE_DECAY_DAYS,
+    LINK_STATE_CACHE_SIZE, LINK_STATE_TTL_SECONDS, LINK_STATE_FLUSH_SECONDS, LINK_STATE_SWEEP_SECONDS
+)
+
+# Rolling window of the most recent visits that state is computed over
+STATE_WINDOW_VISITS = 30
+HIGH_INTEREST_VISITS = 10
+DEFAULT_KILL_SWITCH = 5
+
+
+class LinkHealth:
+    """Health counters of one link; suspicious flags of the last STATE_WINDOW_VISITS visits"""
+
+    __slots__ = ("last_visit", "window", "suspicious")
+
+    def __init__(self):
+        self.last_visit = None
+        self.window = deque(maxlen=STATE_WINDOW_VISITS)
+        self.suspicious = 0
+
+    def add(self, ts: datetime, suspicious: bool):
+        if len(self.window) == self.window.maxlen and self.window[0]:
+            self.suspicious -= 1
+        self.window.append(bool(suspicious))
+        if suspicious:
+            self.suspicious += 1
+        if self.last_visit is None or ts > self.last_visit:
+            self.last_visit = ts
+
+    def state(self, now: datetime, kill_threshold: int) -> str:
+        if self.last_visit is None:
+            return "Active"
+        if self.suspicious >= kill_threshold:
+            return "Inactive"
+        return state_for_idle_days((now - self.last_visit).days) or (
+            "High Interest" if len(self.window) >= HIGH_INTEREST_VISITS else "Active"
+        )
+
+
+def state_for_idle_days(days_since: int):
+    """Decay state for a link idle for days_since days, None if it has not decayed"""
+    if days_since > STATE_DECAY_DAYS:
+        return "Inactive"
+    if days_since > ATTENTION_DECAY_DAYS:
+        return "Decaying"
+    return None
+
+
+class LinkStateTracker(WriteBehindBuffer):
+    """In-memory link health, seeded lazily from the visits of a link and kept up to date per visit"""
+
+    name = "Link state"
+    thread_name = "link-state"
+
+    def __init__(self, maxsize: int = LINK_STATE_CACHE_SIZE, flush_interval: float = LINK_STATE_FLUSH_SECONDS,
+                 sweep_interval: float = LINK_STATE_SWEEP_SECONDS, ttl: float = LINK_STATE_TTL_SECONDS):
+        # _pending: link_id -> last visit ISO timestamp, not yet persisted
+        super().__init__(flush_interval)
+        self.sweep_interval = sweep_interval
+        # Entries expire so a worker re-seeds from visits other workers recorded meanwhile
+        self.links = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._seed_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self.stats.update(visits=0, seeded=0, sweeps=0, decayed=0)
+
+    def _seed(self, link_id: int) -> LinkHealth:
+        from visit_pipeline import recent_visits
+
+        health = LinkHealth()
+        # Newest first; includes rows still in the group-commit buffer
+        for v in reversed(recent_visits(link_id, STATE_WINDOW_VISITS, "ts_ms, is_suspicious")):
+            health.add(datetime.utcfromtimestamp(v["ts_ms"] / 1000), v["is_suspicious"])
+        self.links.set(link_id, health)
+        self.stats["seeded"] += 1
+        return health
+
+    def record_visit(self, link_id: int, now: datetime, suspicious: bool, rules: dict = None) -> str:
+        """Account for a visit that was just recorded and return the link's new state"""
+        kill_threshold = (rules or {}).get("health_kill_switch", DEFAULT_KILL_SWITCH)
+        health = self.links.get(link_id)
+        if health is None:
+            with self._seed_lock:
+                health = self.links.get(link_id)
+                if health is None:
+                    # The seed already contains the visit being recorded
+                    health = self._seed(link_id)
+                    seeded = True
+                else:
+                    seeded = False
+        else:
+            seeded = False
+
+        with self._lock:
+            if not seeded:
+                health.add(now, suspicious)
+            self.stats["visits"] += 1
+            self._pending[link_id] = health.last_visit.isoformat()
+            state = health.state(now, kill_threshold)
+        self.start()
+        return state
+
+    def write(self, conn, batch: dict):
+        """Persist the last visit time of links visited since the previous flush"""
+        conn.executemany(
+            "UPDATE links SET last_visit_at = MAX(COALESCE(last_visit_at, ''), ?) WHERE id = ?",
+            [[ts, link_id] for link_id, ts in batch.items()],
+        )
+
+    def merge(self, batch: dict):
+        for link_id, ts in batch.items():
+            self._pending[link_id] = max(ts, self._pending.get(link_id, ts))
+
+    def sweep(self, now: datetime = None) -> int:
+        """Move idle links to Decaying / Inactive; returns the number of links whose state changed"""
+        from redirect_plan import invalidate_link
+
+        now = now or datetime.utcnow()
+        # Persist pending visit times first so recently clicked links are not decayed
+        self.flush()
+        decaying_before = (now - timedelta(days=ATTENTION_DECAY_DAYS + 1)).isoformat()
+        inactive_before = (now - timedelta(days=STATE_DECAY_DAYS + 1)).isoformat()
+        changed = []
+        try:
+            conn = connect_db(check_same_thread=False)
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for state, cutoff, from_states in (
+                    ("Inactive", inactive_before, ("Active", "High Interest", "Decaying")),
+                    ("Decaying", decaying_before, ("Active", "High Interest")),
+                ):
+                    placeholders = ", ".join("?" for _ in from_states)
+                    # A link that was never visited has been idle since it was created
+                    rows = conn.execute(
+                        f"SELECT id, code FROM links WHERE COALESCE(last_visit_at, created_at) < ? "
+                        f"AND state IN ({placeholders})",
+                        [cutoff, *from_states],
+                    ).fetchall()
+                    conn.executemany("UPDATE links SET state = ? WHERE id = ?", [[state, r["id"]] for r in rows])
+                    changed.extend(rows)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Link state sweep failed: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            return 0
+
+        for row in changed:
+            self.links.pop(row["id"])
+            invalidate_link(row["id"], row["code"])
+        with self._lock:
+            self.stats["sweeps"] += 1
+            self.stats["decayed"] += len(changed)
+        return len(changed)
+
+    def tick(self):
+        if self.sweep_interval > 0 and time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = time.monotonic()
+            self.sweep()
+        else:
+            self.flush()
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        stats = super().get_stats()
+        stats["cache"] = self.links.stats()
+        return stats
+
+
+link_states = LinkStateTracker()
+atexit.register(link_states.shutdown)
@@ -0,0 +1,155 @@
+"""
+Smart Link Intelligence - Link Traffic Counters
+Rolling per-link counts of total and suspicious requests in fixed-width buckets, fed by the visit
+pipeline, so DDoS detection reads a few integers instead of counting visits in SQL
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from cache import LRUCache
+from database import connect_db
+from rate_limiter import SlidingWindow
+from config import (
+    TRAFFIC_BUCKET_SECONDS, TRAFFIC_HORIZON_MINUTES, TRAFFIC_CACHE_LINKS, TRAFFIC_RESYNC_SECONDS
+)
+
+SEED_SQL = """
+    SELECT ts_ms / ? AS slot, COUNT(*) AS total, SUM(is_suspicious) AS suspicious
+    FROM visits WHERE link_id = ? AND ts_ms >= ?
+    GROUP BY slot ORDER BY slot
+"""
+
+
+class LinkTraffic:
+    """Total and suspicious request counts of one link over the last TRAFFIC_HORIZON_MINUTES"""
+
+    __slots__ = ("total", "suspicious", "synced_at")
+
+    def __init__(self, buckets: int, width: int):
+        self.total = SlidingWindow(buckets, width)
+        self.suspicious = SlidingWindow(buckets, width)
+        self.synced_at = 0.0
+
+
+class LinkTrafficCounters:
+    """
+    Per-link traffic windows, seeded from the visits table and incremented by every recorded visit.
+
+    Entries are re-seeded from the database (plus the write buffer) every
+    resync_interval seconds so visits recorded by other worker processes are
+    counted too; between re-seeds a read is O(buckets) with no SQL.
+    """
+
+    def __init__(self, bucket_seconds: int = TRAFFIC_BUCKET_SECONDS, horizon_minutes: int = TRAFFIC_HORIZON_MINUTES,
+                 max_links: int = TRAFFIC_CACHE_LINKS, resync_interval: float = TRAFFIC_RESYNC_SECONDS):
+        self.width = bucket_seconds
+        self.buckets = horizon_minutes * 60 // bucket_seconds
+        self.resync_interval = resync_interval
+        self.links = LRUCache(maxsize=max_links)
+        # link_id -> SlidingWindow of bot/preview requests, which never reach the visits table
+        # and so are kept apart from the re-seeded windows (counted by this process only)
+        self.bots = LRUCache(maxsize=max_links)
+        self._lock = threading.Lock()
+        self.stats = {"visits": 0, "bot_hits": 0, "seeded": 0, "reads": 0, "errors": 0}
+
+    def _seed_rows(self, conn, link_id: int, now: float) -> LinkTraffic:
+        from visit_pipeline import writer
+
+        traffic = LinkTraffic(self.buckets, self.width)
+        cutoff_ms = int((now - self.buckets * self.width) * 1000)
+        for row in conn.execute(SEED_SQL, [self.width * 1000, link_id, cutoff_ms]):
+            slot_start = row[0] * self.width
+            traffic.total.add(slot_start, row[1])
+            traffic.suspicious.add(slot_start, row[2] or 0)
+        # Visits still in the group-commit buffer are not in the table yet
+        for values in writer.buffered(link_id):
+            if values["ts_ms"] >= cutoff_ms:
+                traffic.total.add(values["ts_ms"] / 1000.0)
+                if values["is_suspicious"]:
+                    traffic.suspicious.add(values["ts_ms"] / 1000.0)
+        traffic.synced_at = now
+        return traffic
+
+    def _seed(self, link_id: int, now: float) -> LinkTraffic:
+        conn = connect_db(check_same_thread=False)
+        try:
+            traffic = self._seed_rows(conn, link_id, now)
+        finally:
+            conn.close()
+        # Replaces the old entry: visits added to it meanwhile are in the table or the buffer
+        self.links.set(link_id, traffic)
+        with self._lock:
+            self.stats["seeded"] += 1
+        return traffic
+
+    def rebuild(self, now: float = None) -> int:
+        """Seed every link visited within the horizon (at startup); returns the number of links loaded"""
+        now = time.time() if now is None else now
+        since = (datetime.utcfromtimestamp(now) - timedelta(seconds=self.buckets * self.width)).isoformat()
+        try:
+            conn = connect_db(check_same_thread=False)
+            try:
+                link_ids = [r[0] for r in conn.execute("SELECT id FROM links WHERE last_visit_at >= ?", [since])]
+                for link_id in link_ids:
+                    self.links.set(link_id, self._seed_rows(conn, link_id, now))
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Link traffic rebuild failed: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+            return 0
+        with self._lock:
+            self.stats["seeded"] += len(link_ids)
+        return len(link_ids)
+
+    def add(self, link_id: int, epoch: float, suspicious: bool):
+        """Count a just-recorded visit (links not being tracked are seeded on their next read)"""
+        traffic = self.links.get(link_id)
+        with self._lock:
+            self.stats["visits"] += 1
+            if traffic is None or epoch <= traffic.total.head * self.width - self.buckets * self.width:
+                return
+            traffic.total.add(epoch)
+            if suspicious:
+                traffic.suspicious.add(epoch)
+
+    def add_bot(self, link_id: int, epoch: float = None):
+        """Count a bot/preview request, which is redirected without recording a visit"""
+        epoch = time.time() if epoch is None else epoch
+        window = self.bots.get(link_id)
+        if window is None:
+            # Only the last minute of bot traffic is ever read
+            window = SlidingWindow(max(1, 60 // self.width), self.width)
+            self.bots.set(link_id, window)
+        with self._lock:
+            self.stats["bot_hits"] += 1
+            window.add(epoch)
+
+    def counts(self, link_id: int, window_minutes: float, now: float = None) -> tuple:
+        """(requests in the last minute, suspicious requests in the last window_minutes) of a link"""
+        now = time.time() if now is None else now
+        traffic = self.links.get(link_id)
+        if traffic is None or (self.resync_interval > 0 and now - traffic.synced_at >= self.resync_interval):
+            traffic = self._seed(link_id, now)
+        window_buckets = max(1, min(self.buckets, int(round(window_minutes * 60 / self.width))))
+        bots = self.bots.get(link_id)
+        with self._lock:
+            self.stats["reads"] += 1
+            minute_buckets = max(1, 60 // self.width)
+            total = traffic.total.recent(now, minute_buckets)
+            if bots is not None:
+                total += bots.recent(now, minute_buckets)
+            return total, traffic.suspicious.recent(now, window_buckets)
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        with self._lock:
+            stats = dict(self.stats, bucket_seconds=self.width, horizon_buckets=self.buckets)
+        stats["cache"] = self.links.stats()
+        stats["bot_links"] = self.bots.stats()
+        return stats
+
+
+link_traffic = LinkTrafficCounters()
@@ -0,0 +1,327 @@
+"""
+Smart Link Intelligence - Schema Migrations
+Versioned, run-once schema changes tracked in the schema_version table, with batched backfills
+
+Run:   python migrations.py          (apply pending migrations)
+Check: python migrations.py check    (EXPLAIN QUERY PLAN of the hot queries; exits 1 on a full scan)
+"""
+
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from config import DATABASE, MIGRATION_BATCH_SIZE
+
+# (version, name, fn(conn)) in version order; see @migration below
+MIGRATIONS = []
+
+
+def migration(version: int, name: str):
+    """Register fn(conn) as schema migration `version`"""
+    def register(fn):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise ValueError(f"Duplicate migration version {version}")
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def has_column(conn, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def add_column(conn, table: str, column: str, definition: str) -> bool:
+    """Add a column unless it already exists; returns True if it was added"""
+    if has_column(conn, table, column):
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    print(f"Added column {column} to {table}")
+    return True
+
+
+def create_index(conn, name: str, table: str, columns: str):
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def backfill_in_batches(conn, table: str, set_clause: str, where: str = "1", params=(),
+                        batch_size: int = MIGRATION_BATCH_SIZE) -> int:
+    """
+    UPDATE a large table in rowid ranges, one short transaction per batch.
+
+    The write lock is only held for one batch at a time, so request threads and
+    other workers can interleave their writes during a long backfill. `where`
+    must make the update idempotent (e.g. "ts_ms IS NULL") so an interrupted
+    migration can simply be re-run.
+    """
+    bounds = conn.execute(f"SELECT MIN(rowid), MAX(rowid) FROM {table}").fetchone()
+    if bounds[0] is None:
+        return 0
+    updated = 0
+    for start in range(bounds[0], bounds[1] + 1, batch_size):
+        cur = conn.execute(
+            f"UPDATE {table} SET {set_clause} WHERE rowid >= ? AND rowid < ? AND ({where})",
+            [start, start + batch_size, *params],
+        )
+        conn.commit()
+        updated += cur.rowcount
+        # Yield so waiting writers get the lock between batches
+        time.sleep(0)
+    return updated
+
+
+def _applied_versions(conn) -> set:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    conn.commit()
+    return {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+
+
+def run_migrations(db_path: str = DATABASE) -> list:
+    """Apply pending migrations in order; returns the versions applied"""
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    applied = []
+    try:
+        done = _applied_versions(conn)
+        for version, name, fn in MIGRATIONS:
+            if version in done:
+                continue
+            started = time.perf_counter()
+            try:
+                fn(conn)
+                # Another worker may have finished the same (idempotent) migration meanwhile
+                conn.execute(
+                    "INSERT OR IGNORE INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    [version, name, datetime.utcnow().isoformat()],
+                )
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"Migration {version} ({name}) failed: {e}")
+                break
+            applied.append(version)
+            print(f"Applied migration {version}: {name} ({time.perf_counter() - started:.2f}s)")
+    finally:
+        conn.close()
+    return applied
+
+
+def schema_version(conn) -> int:
+    """Highest applied migration version (0 if none)"""
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+# ---------------------------------------------------------------------------
+# Migrations
+# ---------------------------------------------------------------------------
+
+@migration(1, "baseline columns")
+def _baseline_columns(conn):
+    # Columns added to existing tables over time (previously re-ALTERed on every boot)
+    add_column(conn, "links", "protection_level", "INTEGER DEFAULT 0")
+    add_column(conn, "links", "auto_disabled", "INTEGER DEFAULT 0")
+    add_column(conn, "links", "ddos_detected_at", "TEXT")
+    add_column(conn, "links", "password_hash", "TEXT")
+    add_column(conn, "links", "expires_at", "TEXT")
+    add_column(conn, "users", "membership_tier", "TEXT DEFAULT 'free'")
+    add_column(conn, "users", "premium_expires_at", "TEXT")
+    add_column(conn, "behavior_rules", "requests_per_ip_per_minute", "INTEGER DEFAULT 60")
+    add_column(conn, "behavior_rules", "requests_per_ip_per_hour", "INTEGER DEFAULT 1000")
+    add_column(conn, "behavior_rules", "requests_per_link_per_minute", "INTEGER DEFAULT 500")
+    add_column(conn, "behavior_rules", "burst_threshold", "INTEGER DEFAULT 100")
+    add_column(conn, "behavior_rules", "suspicious_threshold", "INTEGER DEFAULT 10")
+    add_column(conn, "behavior_rules", "ddos_threshold", "INTEGER DEFAULT 50")
+
+
+@migration(2, "hot query indexes")
+def _hot_query_indexes(conn):
+    create_index(conn, "idx_visits_link_ts", "visits", "link_id, ts")
+    create_index(conn, "idx_visits_link_session", "visits", "link_id, session_id")
+    create_index(conn, "idx_visits_link_ip_hash", "visits", "link_id, ip_hash")
+    create_index(conn, "idx_visits_link_suspicious_ts", "visits", "link_id, is_suspicious, ts")
+    create_index(conn, "idx_ddos_events_link_detected", "ddos_events", "link_id, detected_at")
+    create_index(conn, "idx_ad_impressions_timestamp", "ad_impressions", "timestamp")
+    create_index(conn, "idx_user_activity_timestamp", "user_activity", "timestamp")
+
+
+@migration(3, "session_stats backfill")
+def _session_stats_backfill(conn):
+    # Only sessions with no row yet: rows written by the visit writer already count every visit
+    link_ids = [row[0] for row in conn.execute("SELECT DISTINCT link_id FROM visits ORDER BY link_id")]
+    batch = max(1, MIGRATION_BATCH_SIZE // 100)
+    for i in range(0, len(link_ids), batch):
+        chunk = link_ids[i:i + batch]
+        conn.execute(f"""
+            INSERT OR IGNORE INTO session_stats (link_id, session_id, visit_count, first_ts, last_ts)
+            SELECT link_id, session_id, COUNT(*), MIN(ts), MAX(ts) FROM visits
+            WHERE link_id IN ({', '.join('?' for _ in chunk)})
+            GROUP BY link_id, session_id
+        """, chunk)
+        conn.commit()
+
+
+@migration(4, "links.last_visit_at")
+def _links_last_visit_at(conn):
+    add_column(conn, "links", "last_visit_at", "TEXT")
+    conn.commit()
+    backfill_in_batches(
+        conn, "links",
+        "last_visit_at = (SELECT MAX(ts) FROM visits WHERE visits.link_id = links.id)",
+        "last_visit_at IS NULL",
+    )
+
+
+# Integer epoch milliseconds of a stored naive-UTC timestamp (ISO 'T' or 'YYYY-MM-DD HH:MM:SS' form)
+def _epoch_ms_sql(column: str) -> str:
+    return (f"CAST(strftime('%s', {column}) AS INTEGER) * 1000"
+            f" + CAST(substr(strftime('%f', {column}), 4) AS INTEGER)")
+
+
+@migration(5, "integer ts_ms timestamps")
+def _ts_ms_columns(conn):
+    # Time windows become plain integer range scans instead of datetime() calls on every row
+    for table, column in (("visits", "ts"), ("ddos_events", "detected_at"), ("ad_impressions", "timestamp")):
+        add_column(conn, table, "ts_ms", "INTEGER")
+        conn.commit()
+        backfill_in_batches(conn, table, f"ts_ms = {_epoch_ms_sql(column)}", f"ts_ms IS NULL AND {column} IS NOT NULL")
+    create_index(conn, "idx_visits_link_ts_ms", "visits", "link_id, ts_ms")
+    create_index(conn, "idx_visits_link_suspicious_ts_ms", "visits", "link_id, is_suspicious, ts_ms")
+    create_index(conn, "idx_ddos_events_link_ts_ms", "ddos_events", "link_id, ts_ms")
+    create_index(conn, "idx_ad_impressions_ts_ms", "ad_impressions", "ts_ms")
+    # Superseded by the ts_ms indexes above; every query that used them now orders/filters on ts_ms
+    for name in ("idx_visits_link_ts", "idx_visits_link_suspicious_ts",
+                 "idx_ddos_events_link_detected", "idx_ad_impressions_timestamp"):
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+@migration(6, "rate_limits shared counters")
+def _rate_limits_table(conn):
+    # Present in older databases but never used; the sqlite rate limiter backend UPSERTs into it
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ip_hash TEXT NOT NULL,
+            link_id INTEGER,
+            request_count INTEGER DEFAULT 1,
+            window_start TEXT NOT NULL,
+            window_type TEXT NOT NULL,
+            blocked_until TEXT,
+            ip_address TEXT,
+            FOREIGN KEY(link_id) REFERENCES links(id)
+        )
+    """)
+    add_column(conn, "rate_limits", "ip_address", "TEXT")
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_rate_limits_window
+        ON rate_limits (ip_hash, link_id, window_type, window_start)
+    """)
+    create_index(conn, "idx_rate_limits_window_start", "rate_limits", "window_start")
+
+
+@migration(7, "coalesced ddos_events")
+def _ddos_event_counts(conn):
+    # One row now stands for event_count occurrences between detected_at and last_detected_at
+    add_column(conn, "ddos_events", "ip_hash", "TEXT")
+    add_column(conn, "ddos_events", "event_count", "INTEGER DEFAULT 1")
+    add_column(conn, "ddos_events", "last_detected_at", "TEXT")
+    conn.commit()
+    backfill_in_batches(conn, "ddos_events", "last_detected_at = detected_at", "last_detected_at IS NULL")
+
+
+
+@migration(8, "ip_rules CIDR block/allow lists")
+def _ip_rules_table(conn):
+    # cidr is stored normalised (ipaddress.ip_network); expires_at NULL = permanent
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ip_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            cidr TEXT NOT NULL,
+            action TEXT NOT NULL DEFAULT 'block',
+            reason TEXT,
+            source TEXT DEFAULT 'manual',
+            created_at TEXT NOT NULL,
+            expires_at TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_ip_rules_user_cidr ON ip_rules (user_id, cidr)")
+    create_index(conn, "idx_ip_rules_expires_at", "ip_rules", "expires_at")
+
+
+@migration(9, "link_baselines anomaly detector state")
+def _link_baselines_table(conn):
+    # One row per link, written behind by anomaly.AnomalyDetector; updated_at is epoch seconds
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS link_baselines (
+            link_id INTEGER PRIMARY KEY,
+            rate_mean REAL NOT NULL DEFAULT 0,
+            rate_var REAL NOT NULL DEFAULT 0,
+            ratio_mean REAL NOT NULL DEFAULT 0,
+            ratio_var REAL NOT NULL DEFAULT 0,
+            samples INTEGER NOT NULL DEFAULT 0,
+            updated_at INTEGER NOT NULL,
+            FOREIGN KEY(link_id) REFERENCES links(id)
+        )
+    """)
+
+
+@migration(10, "links.protection_reason")
+def _links_protection_reason(conn):
+    # Detection reason behind the current protection_level, so anomaly-triggered protection can expire
+    add_column(conn, "links", "protection_reason", "TEXT")
+
+# ---------------------------------------------------------------------------
+# Query plan checks
+# ---------------------------------------------------------------------------
+
+# Hot queries that must be served by an index (name, sql, params)
+HOT_QUERIES = [
+    ("recent visits of a link",
+     "SELECT ts, ip_hash FROM visits WHERE link_id = ? ORDER BY ts_ms DESC LIMIT 20", [1]),
+    ("visits of a link in a window",
+     "SELECT COUNT(*) FROM visits WHERE link_id = ? AND ts_ms > ?", [1, 0]),
+    ("visits of a session",
+     "SELECT COUNT(*) FROM visits WHERE link_id = ? AND session_id = ?", [1, "s"]),
+    ("unique visitors of a link",
+     "SELECT DISTINCT ip_hash FROM visits WHERE link_id = ?", [1]),
+    ("suspicious visits in a window",
+     "SELECT COUNT(*) FROM visits WHERE link_id = ? AND is_suspicious = 1 AND ts_ms > ?", [1, 0]),
+    ("DDoS events of a link",
+     "SELECT * FROM ddos_events WHERE link_id = ? ORDER BY ts_ms DESC LIMIT 50", [1]),
+    ("ad impressions since",
+     "SELECT COUNT(*) FROM ad_impressions WHERE ts_ms >= ?", [0]),
+    ("IP rules of a user",
+     "SELECT * FROM ip_rules WHERE user_id = ? ORDER BY created_at DESC", [1]),
+    ("user activity since",
+     "SELECT COUNT(*) FROM user_activity WHERE timestamp >= ?", ["2024-01-01"]),
+]
+
+
+def check_query_plans(conn) -> list:
+    """EXPLAIN QUERY PLAN every hot query; returns (name, plan, uses_index) tuples"""
+    results = []
+    for name, sql, params in HOT_QUERIES:
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        # A bare "SCAN <table>" (no index) is a full table scan
+        full_scan = any(step.startswith("SCAN ") and "USING" not in step for step in plan)
+        results.append((name, plan, not full_scan))
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        conn = sqlite3.connect(DATABASE)
+        ok = True
+        for name, plan, uses_index in check_query_plans(conn):
+            ok = ok and uses_index
+            print(f"{'OK  ' if uses_index else 'SCAN'} {name}: {' | '.join(plan)}")
+        sys.exit(0 if ok else 1)
+    print(f"Applied: {run_migrations() or 'nothing (up to date)'}")
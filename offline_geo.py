@@ -0,0 +1,238 @@
+"""
+Smart Link Intelligence - Offline IP Geolocation
+Compiles an IP-range CSV into a compact sorted binary index and serves lookups from a
+read-only memory map, so every worker process shares the same pages
+
+CSV columns: start, end, country, region, city, lat, lon, tz, isp
+(start/end are IPv4 or IPv6 addresses; ranges must not overlap)
+
+Build:  python offline_geo.py build data/ip_ranges.csv data/ip_ranges.bin
+Lookup: python offline_geo.py lookup data/ip_ranges.bin 192.0.2.10
+"""
+
+import csv
+import ipaddress
+import mmap
+import os
+import struct
+import sys
+import threading
+
+MAGIC = b"SLGEO001"
+# magic, IPv4 range count, IPv6 range count, string table size
+HEADER = struct.Struct("<8sIII4x")
+# country, region, city, timezone, isp (string table offsets), lat, lon
+RECORD = struct.Struct("<5I2f")
+STRING_LEN = struct.Struct("<H")
+MASK64 = (1 << 64) - 1
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+def build_index(csv_path: str, out_path: str) -> dict:
+    """Compile an IP-range CSV into the binary index format; returns range counts"""
+    v4, v6 = [], []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            start = ipaddress.ip_address(row["start"].strip())
+            end = ipaddress.ip_address(row["end"].strip())
+            if start.version != end.version or int(end) < int(start):
+                raise ValueError(f"Invalid range {row['start']} - {row['end']}")
+            entry = (int(start), int(end), row)
+            (v4 if start.version == 4 else v6).append(entry)
+    v4.sort(key=lambda e: e[0])
+    v6.sort(key=lambda e: e[0])
+
+    strings = bytearray()
+    string_offsets = {}
+
+    def intern(value):
+        value = (value or "").strip()
+        if value not in string_offsets:
+            encoded = value.encode("utf-8")[:0xFFFF]
+            string_offsets[value] = len(strings)
+            strings.extend(STRING_LEN.pack(len(encoded)))
+            strings.extend(encoded)
+        return string_offsets[value]
+
+    def to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return float("nan")
+
+    records = bytearray()
+    for _, _, row in v4 + v6:
+        records.extend(RECORD.pack(
+            intern(row.get("country")), intern(row.get("region")), intern(row.get("city")),
+            intern(row.get("tz")), intern(row.get("isp")),
+            to_float(row.get("lat")), to_float(row.get("lon")),
+        ))
+
+    tmp_path = out_path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, len(v4), len(v6), len(strings)))
+        # IPv4: starts[], ends[] as uint32
+        out.write(struct.pack(f"<{len(v4)}I", *(e[0] for e in v4)))
+        out.write(struct.pack(f"<{len(v4)}I", *(e[1] for e in v4)))
+        out.write(b"\0" * (_align8(out.tell()) - out.tell()))
+        # IPv6: start_hi[], start_lo[], end_hi[], end_lo[] as uint64
+        out.write(struct.pack(f"<{len(v6)}Q", *(e[0] >> 64 for e in v6)))
+        out.write(struct.pack(f"<{len(v6)}Q", *(e[0] & MASK64 for e in v6)))
+        out.write(struct.pack(f"<{len(v6)}Q", *(e[1] >> 64 for e in v6)))
+        out.write(struct.pack(f"<{len(v6)}Q", *(e[1] & MASK64 for e in v6)))
+        out.write(records)
+        out.write(strings)
+    os.replace(tmp_path, out_path)
+    return {"ipv4_ranges": len(v4), "ipv6_ranges": len(v6), "strings": len(string_offsets)}
+
+
+class OfflineGeoIndex:
+    """Read-only, memory-mapped interval index with binary-search lookups"""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise RuntimeError("Offline geo index requires a little-endian host")
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n4, self.n6, strings_size = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not an offline geo index")
+
+        # Zero-copy typed views over the mapped file; indexing them does no parsing
+        view = memoryview(self._mm)
+        offset = HEADER.size
+        self._v4_start = view[offset:offset + 4 * self.n4].cast("I")
+        offset += 4 * self.n4
+        self._v4_end = view[offset:offset + 4 * self.n4].cast("I")
+        offset = _align8(offset + 4 * self.n4)
+        size6 = 8 * self.n6
+        self._v6_start_hi = view[offset:offset + size6].cast("Q")
+        self._v6_start_lo = view[offset + size6:offset + 2 * size6].cast("Q")
+        self._v6_end_hi = view[offset + 2 * size6:offset + 3 * size6].cast("Q")
+        self._v6_end_lo = view[offset + 3 * size6:offset + 4 * size6].cast("Q")
+        self._records = offset + 4 * size6
+        self._strings = self._records + RECORD.size * (self.n4 + self.n6)
+
+    def _find_v4(self, key: int) -> int:
+        starts = self._v4_start
+        lo, hi = 0, self.n4
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if starts[mid] <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo - 1
+        if i >= 0 and key <= self._v4_end[i]:
+            return i
+        return -1
+
+    def _find_v6(self, key_hi: int, key_lo: int) -> int:
+        s_hi, s_lo = self._v6_start_hi, self._v6_start_lo
+        lo, hi = 0, self.n6
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            if s_hi[mid] < key_hi or (s_hi[mid] == key_hi and s_lo[mid] <= key_lo):
+                lo = mid + 1
+            else:
+                hi = mid
+        i = lo - 1
+        if i >= 0:
+            e_hi = self._v6_end_hi[i]
+            if key_hi < e_hi or (key_hi == e_hi and key_lo <= self._v6_end_lo[i]):
+                return self.n4 + i
+        return -1
+
+    def _string(self, offset: int) -> str:
+        start = self._strings + offset
+        (length,) = STRING_LEN.unpack_from(self._mm, start)
+        return self._mm[start + 2:start + 2 + length].decode("utf-8")
+
+    def find(self, ip: str) -> int:
+        """Return the record number covering ip, or -1"""
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return -1
+        if addr.version == 4:
+            return self._find_v4(int(addr))
+        if addr.ipv4_mapped:
+            return self._find_v4(int(addr.ipv4_mapped))
+        key = int(addr)
+        return self._find_v6(key >> 64, key & MASK64)
+
+    def lookup(self, ip: str):
+        """Return location data in the get_api_location format, or None if ip is not covered"""
+        record = self.find(ip)
+        if record < 0:
+            return None
+        country, region, city, tz, isp, lat, lon = RECORD.unpack_from(self._mm, self._records + record * RECORD.size)
+        return {
+            'status': 'success',
+            'country': self._string(country),
+            'regionName': self._string(region),
+            'city': self._string(city),
+            'lat': None if lat != lat else round(lat, 4),
+            'lon': None if lon != lon else round(lon, 4),
+            'timezone': self._string(tz) or None,
+            'isp': self._string(isp) or None,
+            'org': None,
+            'source': 'offline',
+        }
+
+    def close(self):
+        for view in (self._v4_start, self._v4_end, self._v6_start_hi, self._v6_start_lo,
+                     self._v6_end_hi, self._v6_end_lo):
+            view.release()
+        self._mm.close()
+        self._file.close()
+
+
+_index = None
+_index_lock = threading.Lock()
+_index_loaded = False
+
+
+def get_offline_index():
+    """Return the configured offline index (building it from the CSV if needed), or None"""
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+    with _index_lock:
+        if _index_loaded:
+            return _index
+        from config import OFFLINE_GEO_INDEX, OFFLINE_GEO_CSV
+        try:
+            if OFFLINE_GEO_CSV and os.path.exists(OFFLINE_GEO_CSV) and (
+                not os.path.exists(OFFLINE_GEO_INDEX)
+                or os.path.getmtime(OFFLINE_GEO_CSV) > os.path.getmtime(OFFLINE_GEO_INDEX)
+            ):
+                counts = build_index(OFFLINE_GEO_CSV, OFFLINE_GEO_INDEX)
+                print(f"Built offline geo index {OFFLINE_GEO_INDEX}: {counts}")
+            if OFFLINE_GEO_INDEX and os.path.exists(OFFLINE_GEO_INDEX):
+                _index = OfflineGeoIndex(OFFLINE_GEO_INDEX)
+        except Exception as e:
+            print(f"Offline geo index unavailable: {e}")
+            _index = None
+        _index_loaded = True
+    return _index
+
+
+def offline_lookup(ip: str):
+    """Look an IP up in the offline index; None if disabled or not covered"""
+    index = get_offline_index()
+    return index.lookup(ip) if index else None
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        print(build_index(sys.argv[2], sys.argv[3]))
+    elif len(sys.argv) == 4 and sys.argv[1] == "lookup":
+        print(OfflineGeoIndex(sys.argv[2]).lookup(sys.argv[3]))
+    else:
+        print(__doc__)
+        sys.exit(1)
@@ -0,0 +1,105 @@
+"""
+Smart Link Intelligence - Proof-of-Work Challenge
+Stateless client puzzles for links at protection level 3: HMAC-signed challenges whose difficulty
+grows with the level, and HMAC-signed pass cookies checked in constant time without the database
+"""
+
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from config import (
+    FLASK_CONFIG, POW_BASE_BITS, POW_BITS_PER_LEVEL, POW_CHALLENGE_SECONDS, POW_PASS_SECONDS
+)
+
+PASS_COOKIE = "sl_pass"
+MAX_BITS = 32  # The browser solver compares the first 32-bit word of the digest
+MAX_NONCE_LENGTH = 16
+
+
+class ProofOfWork:
+    """
+    Challenge: "<link_id>:<bits>:<expires>:<salt>.<hmac>", bound to the client IP by the HMAC.
+    Solution: a nonce such that SHA-256("<challenge>:<nonce>") starts with <bits> zero bits.
+    Pass: "<link_id>:<expires>.<hmac>", bound to the client IP the same way.
+
+    Nothing is stored server-side: verifying a pass is one HMAC and a compare_digest,
+    verifying a solution one HMAC and one SHA-256.
+    """
+
+    def __init__(self, secret: str = FLASK_CONFIG["SECRET_KEY"]):
+        # Derived so pass tokens cannot be mistaken for any other signature made with SECRET_KEY
+        self._key = hashlib.sha256(b"smart-links-pow:" + secret.encode()).digest()
+        self._lock = threading.Lock()
+        self.stats = {"challenges": 0, "solved": 0, "invalid": 0, "passes_ok": 0, "passes_rejected": 0}
+
+    def _sign(self, payload: str) -> str:
+        return hmac.new(self._key, payload.encode(), hashlib.sha256).hexdigest()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    @staticmethod
+    def difficulty(protection_level: int) -> int:
+        """Leading zero bits a solution needs at a protection level"""
+        return min(MAX_BITS, POW_BASE_BITS + POW_BITS_PER_LEVEL * max(0, (protection_level or 3) - 3))
+
+    def new_challenge(self, link_id: int, protection_level: int, ip_address: str, now: float = None) -> tuple:
+        """A fresh signed challenge for a link and client: (challenge, bits)"""
+        now = time.time() if now is None else now
+        bits = self.difficulty(protection_level)
+        payload = f"{link_id}:{bits}:{int(now + POW_CHALLENGE_SECONDS)}:{secrets.token_hex(8)}"
+        self._count("challenges")
+        return f"{payload}.{self._sign(f'{payload}:{ip_address}')}", bits
+
+    def check_solution(self, challenge: str, nonce: str, link_id: int, ip_address: str, now: float = None) -> bool:
+        """True if challenge was issued by us to this client for this link, is unexpired and nonce solves it"""
+        now = time.time() if now is None else now
+        payload, _, signature = challenge.rpartition(".")
+        try:
+            challenge_link, bits, expires, _salt = payload.split(":")
+            valid = (int(challenge_link) == link_id and int(expires) >= now
+                     and 0 < len(nonce) <= MAX_NONCE_LENGTH and nonce.isdigit())
+            bits = int(bits)
+        except ValueError:
+            valid = False
+        if not valid or not hmac.compare_digest(self._sign(f"{payload}:{ip_address}"), signature):
+            self._count("invalid")
+            return False
+        digest = hashlib.sha256(f"{challenge}:{nonce}".encode()).digest()
+        if int.from_bytes(digest[:4], "big") >> (32 - bits):
+            self._count("invalid")
+            return False
+        self._count("solved")
+        return True
+
+    def issue_pass(self, link_id: int, ip_address: str, now: float = None) -> str:
+        """Signed pass token for a client that solved a challenge of a link"""
+        now = time.time() if now is None else now
+        payload = f"{link_id}:{int(now + POW_PASS_SECONDS)}"
+        return f"{payload}.{self._sign(f'pass:{payload}:{ip_address}')}"
+
+    def verify_pass(self, token: str, link_id: int, ip_address: str, now: float = None) -> bool:
+        """Constant-time check of a pass cookie; no database access"""
+        if not token:
+            return False
+        now = time.time() if now is None else now
+        payload, _, signature = token.rpartition(".")
+        try:
+            token_link, expires = payload.split(":")
+            valid = int(token_link) == link_id and int(expires) >= now
+        except ValueError:
+            valid = False
+        valid = hmac.compare_digest(self._sign(f"pass:{payload}:{ip_address}"), signature) and valid
+        self._count("passes_ok" if valid else "passes_rejected")
+        return valid
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        with self._lock:
+            return dict(self.stats, base_bits=POW_BASE_BITS)
+
+
+proof_of_work = ProofOfWork()
@@ -0,0 +1,486 @@
+"""
+Smart Link Intelligence - Rate Limiter
+Sliding-window request counters per (ip, link): per process in fixed-size bucket arrays,
+or shared by every worker on the node through shared memory or the rate_limits table
+"""
+
+import atexit
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from multiprocessing import resource_tracker, shared_memory
+from cache import WriteBehindBuffer
+from database import connect_db
+from config import (
+    RATE_LIMIT_IDLE_SECONDS, RATE_LIMIT_MAX_KEYS, RATE_LIMIT_BACKEND,
+    RATE_LIMIT_SHM_NAME, RATE_LIMIT_SHM_SLOTS, RATE_LIMIT_SYNC_SECONDS
+)
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; the shm backend needs it
+    fcntl = None
+
+BURST_WINDOW_SECONDS = 10
+
+# Limits in check order: (window name, length in seconds, rule, status when exceeded)
+WINDOWS = (
+    ("minute", 60, "requests_per_ip_per_minute", "rate_limited"),
+    ("hour", 3600, "requests_per_ip_per_hour", "hourly_rate_limited"),
+    ("burst", BURST_WINDOW_SECONDS, "burst_threshold", "burst_attack"),
+)
+STATUSES = ("allowed",) + tuple(w[3] for w in WINDOWS)
+
+
+class SlidingWindow:
+    """
+    Request counts over the last `size` buckets of `width` seconds each.
+
+    The buckets are a ring over a fixed array; moving the window forward zeroes
+    the buckets that fell out of it and keeps a running total, so add() and
+    count() are O(1) amortized (at most `size` buckets are cleared per call).
+    """
+
+    __slots__ = ("width", "buckets", "head", "total")
+
+    def __init__(self, size: int, width: int):
+        self.width = width
+        self.buckets = array("I", bytes(4 * size))
+        self.head = 0  # absolute index of the newest bucket
+        self.total = 0
+
+    def _advance(self, now: float) -> int:
+        slot = int(now // self.width)
+        gap = slot - self.head
+        if gap > 0:
+            size = len(self.buckets)
+            if gap >= size:
+                for i in range(size):
+                    self.buckets[i] = 0
+                self.total = 0
+            else:
+                for s in range(self.head + 1, slot + 1):
+                    i = s % size
+                    self.total -= self.buckets[i]
+                    self.buckets[i] = 0
+            self.head = slot
+        return slot
+
+    def count(self, now: float) -> int:
+        """Requests in the window ending at now"""
+        self._advance(now)
+        return self.total
+
+    def recent(self, now: float, buckets: int) -> int:
+        """Requests in the newest `buckets` buckets of the window"""
+        slot = self._advance(now)
+        size = len(self.buckets)
+        return sum(self.buckets[(slot - i) % size] for i in range(min(buckets, size)))
+
+    def add(self, now: float, n: int = 1):
+        slot = self._advance(now)
+        self.buckets[slot % len(self.buckets)] += n
+        self.total += n
+
+
+class RequestCounters:
+    """Minute (60 x 1s, also read for the 10s burst window) and hour (60 x 1min) windows of one key"""
+
+    __slots__ = ("seconds", "minutes", "last_seen")
+
+    def __init__(self):
+        self.seconds = SlidingWindow(60, 1)
+        self.minutes = SlidingWindow(60, 60)
+        self.last_seen = 0.0
+
+
+class RateLimiter:
+    """
+    Per-(ip, link) request limits shared by every request thread of the process.
+
+    Keys are kept in access order, which is also last-seen order: the front of
+    the queue is both the coldest key and the first one to go idle. Each check
+    pops the expired keys off the front, so expiry costs O(1) amortized per
+    request (a key is removed at most once per insertion) instead of a scan of
+    all tracked keys, and the same order gives LRU eviction at max_keys.
+    """
+
+    def __init__(self, idle_seconds: float = RATE_LIMIT_IDLE_SECONDS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.idle_seconds = idle_seconds
+        self.max_keys = max_keys
+        self._counters = OrderedDict()  # (ip, link_id) -> RequestCounters, least recently seen first
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(STATUSES, 0)
+        self.stats.update(expired=0, evictions=0)
+
+    def check(self, ip_address: str, link_id, rules: dict, now: float = None) -> str:
+        """
+        Count a request and return 'allowed', or the limit it exceeded without counting it:
+        'rate_limited' (per minute), 'hourly_rate_limited' or 'burst_attack' (10 seconds).
+        """
+        now = time.time() if now is None else now
+        key = (ip_address, link_id)
+        with self._lock:
+            self._expire(now)
+            counters = self._counters.get(key)
+            if counters is None:
+                counters = self._counters[key] = RequestCounters()
+                if len(self._counters) > self.max_keys:
+                    # Memory ceiling: drop the coldest IP
+                    self._counters.popitem(last=False)
+                    self.stats["evictions"] += 1
+            else:
+                self._counters.move_to_end(key)
+            counters.last_seen = max(counters.last_seen, now)
+
+            if counters.seconds.count(now) > rules['requests_per_ip_per_minute']:
+                status = 'rate_limited'
+            elif counters.minutes.count(now) > rules['requests_per_ip_per_hour']:
+                status = 'hourly_rate_limited'
+            elif counters.seconds.recent(now, BURST_WINDOW_SECONDS) > rules['burst_threshold']:
+                status = 'burst_attack'
+            else:
+                counters.seconds.add(now)
+                counters.minutes.add(now)
+                status = 'allowed'
+            self.stats[status] += 1
+        return status
+
+    def _expire(self, now: float):
+        """Drop keys idle for longer than the largest window from the front of the queue (caller holds the lock)"""
+        cutoff = now - self.idle_seconds
+        counters = self._counters
+        while counters:
+            key = next(iter(counters))
+            if counters[key].last_seen >= cutoff:
+                break
+            del counters[key]
+            self.stats["expired"] += 1
+
+    def reset(self, link_id=None):
+        """Forget counters (of one link, or all of them)"""
+        with self._lock:
+            if link_id is None:
+                self._counters.clear()
+            else:
+                for key in [k for k in self._counters if k[1] == link_id]:
+                    del self._counters[key]
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        with self._lock:
+            return dict(self.stats, backend="local", tracked_keys=len(self._counters), max_keys=self.max_keys)
+
+    def shutdown(self):
+        pass
+
+
+# ---------------------------------------------------------------------------
+# Node-wide state shared by all worker processes
+#
+# Both shared backends count fixed windows (current and previous) per limit and
+# estimate the sliding count as current + previous * (unexpired share of the
+# previous window), which keeps the shared state to a few integers per key.
+# ---------------------------------------------------------------------------
+
+def _sliding_estimate(previous: int, current: int, now: float, seconds: int) -> float:
+    return current + previous * (1.0 - (now % seconds) / seconds)
+
+
+def _key_tag(ip_address: str, link_id) -> int:
+    digest = hashlib.blake2b(f"{ip_address}|{link_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1  # 0 marks an empty slot
+
+
+# tag, link_id, last_seen, then (window index, current count, previous count) per WINDOWS entry
+SHM_SLOT = struct.Struct("<QII" + "III" * len(WINDOWS))
+SHM_SLOT_HEAD = struct.Struct("<QII")
+SHM_PROBES = 4
+
+
+def _attach_shared_memory(name: str, size: int):
+    """Create the named segment, or attach to the one another worker created"""
+    try:
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        shm = shared_memory.SharedMemory(name=name)
+    # The segment must outlive any single worker: keep this process's resource tracker from unlinking it
+    resource_tracker.unregister(shm._name, "shared_memory")
+    if shm.size < size:
+        shm.close()
+        raise ValueError(f"shared memory segment {name!r} is {shm.size} bytes, {size} needed (stale segment?)")
+    return shm
+
+
+class SharedMemoryRateLimiter:
+    """
+    Counters in a fixed-size open-addressing table in a named shared memory segment.
+
+    Every worker on the node reads and updates the same slots under an flock, so
+    the limits hold for the node as a whole. A key lives in one of SHM_PROBES slots
+    after its hash; when they are all taken, the least recently seen one is reused.
+    """
+
+    def __init__(self, name: str = RATE_LIMIT_SHM_NAME, slots: int = RATE_LIMIT_SHM_SLOTS,
+                 idle_seconds: float = RATE_LIMIT_IDLE_SECONDS):
+        if fcntl is None:
+            raise RuntimeError("fcntl is required for the shared memory rate limiter")
+        self.slots = slots
+        self.idle_seconds = idle_seconds
+        self._shm = _attach_shared_memory(name, slots * SHM_SLOT.size)
+        self._buf = self._shm.buf
+        # flock excludes other processes, the thread lock other threads of this one
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f"{name}.lock"), "a+b")
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(STATUSES, 0)
+        self.stats.update(evictions=0)
+
+    def _find_slot(self, tag: int, link_id: int, now_s: int) -> int:
+        """Byte offset of the key's slot, claiming a free or the stalest probed slot if it has none"""
+        home = tag % self.slots
+        claim = None
+        claim_seen = None
+        for i in range(SHM_PROBES):
+            offset = ((home + i) % self.slots) * SHM_SLOT.size
+            slot_tag, _, seen = SHM_SLOT_HEAD.unpack_from(self._buf, offset)
+            if slot_tag == tag:
+                return offset
+            if slot_tag == 0 or seen < now_s - self.idle_seconds:
+                seen = -1  # free or expired: reuse before evicting a live key
+            if claim is None or seen < claim_seen:
+                claim, claim_seen = offset, seen
+        if claim_seen >= 0:
+            self.stats["evictions"] += 1
+        SHM_SLOT.pack_into(self._buf, claim, tag, link_id, now_s, *([0] * (3 * len(WINDOWS))))
+        return claim
+
+    def check(self, ip_address: str, link_id, rules: dict, now: float = None) -> str:
+        """Same contract as RateLimiter.check, counted across all workers"""
+        now = time.time() if now is None else now
+        link_id = link_id or 0
+        tag = _key_tag(ip_address, link_id)
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                offset = self._find_slot(tag, link_id, int(now))
+                fields = list(SHM_SLOT.unpack_from(self._buf, offset))
+                status = "allowed"
+                for i, (_, seconds, rule, exceeded) in enumerate(WINDOWS):
+                    base = 3 + 3 * i
+                    window, current, previous = fields[base:base + 3]
+                    index = int(now // seconds)
+                    if window != index:
+                        previous = current if window == index - 1 else 0
+                        current = 0
+                        fields[base:base + 3] = index, current, previous
+                    if status == "allowed" and _sliding_estimate(previous, current, now, seconds) > rules[rule]:
+                        status = exceeded
+                if status == "allowed":
+                    for i in range(len(WINDOWS)):
+                        fields[4 + 3 * i] += 1
+                fields[2] = int(now)
+                SHM_SLOT.pack_into(self._buf, offset, *fields)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self.stats[status] += 1
+        return status
+
+    def reset(self, link_id=None):
+        """Forget counters (of one link, or all of them) for every worker"""
+        empty = bytes(SHM_SLOT.size)
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                for offset in range(0, self.slots * SHM_SLOT.size, SHM_SLOT.size):
+                    if link_id is None or SHM_SLOT_HEAD.unpack_from(self._buf, offset)[1] == link_id:
+                        self._buf[offset:offset + SHM_SLOT.size] = empty
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring (this worker's decisions, node-wide slot usage)"""
+        cutoff = time.time() - self.idle_seconds
+        used = 0
+        for offset in range(0, self.slots * SHM_SLOT.size, SHM_SLOT.size):
+            tag, _, seen = SHM_SLOT_HEAD.unpack_from(self._buf, offset)
+            if tag and seen >= cutoff:
+                used += 1
+        with self._lock:
+            return dict(self.stats, backend="shm", tracked_keys=used, slots=self.slots)
+
+    def shutdown(self):
+        self._lock_file.close()
+
+
+UPSERT_RATE_LIMIT_SQL = """
+    INSERT INTO rate_limits (ip_hash, link_id, request_count, window_start, window_type, ip_address)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(ip_hash, link_id, window_type, window_start) DO UPDATE SET
+        request_count = request_count + excluded.request_count
+    RETURNING request_count
+"""
+# rate_limits rows are kept this long after their window starts
+RATE_LIMIT_RETENTION_SECONDS = 2 * 3600
+RATE_LIMIT_PRUNE_SECONDS = 60
+
+
+class SqliteRateLimiter(WriteBehindBuffer):
+    """
+    Counters in the rate_limits table, one row per (ip, link, window type, window start).
+
+    Requests are checked against the node-wide counts as of the last sync plus
+    this worker's unsynced requests, and the increments are written behind every
+    RATE_LIMIT_SYNC_SECONDS with UPSERTs whose RETURNING values refresh the
+    shared counts. Other workers' traffic is seen after their sync and ours, so a
+    key can be over-admitted by up to two sync intervals of traffic per worker.
+
+    As in RateLimiter, at most max_keys (ip, link) pairs are tracked; beyond that
+    the least recently seen pair is evicted with its counts and unsynced requests.
+    """
+
+    name = "Rate limit sync"
+    thread_name = "rate-limit-sync"
+
+    def __init__(self, interval: float = RATE_LIMIT_SYNC_SECONDS, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        # _pending / _inflight: (ip, link_id, window name, window index) -> requests not written yet
+        super().__init__(interval)
+        self.max_keys = max_keys
+        self._shared = {}    # same key -> node-wide count at last sync
+        # (ip, link_id) -> its keys in _shared / _pending, least recently seen first
+        self._keys = OrderedDict()
+        self._last_prune = 0.0
+        self.stats.update(dict.fromkeys(STATUSES, 0))
+        self.stats.update(evictions=0)
+
+    def _count(self, key) -> int:
+        return self._shared.get(key, 0) + self._inflight.get(key, 0) + self._pending.get(key, 0)
+
+    def _track(self, pair) -> set:
+        """Keys of an (ip, link) pair, marking it most recently seen (caller holds the lock)"""
+        keys = self._keys.get(pair)
+        if keys is None:
+            keys = self._keys[pair] = set()
+            if len(self._keys) > self.max_keys:
+                # Memory ceiling: drop the coldest pair
+                _, evicted = self._keys.popitem(last=False)
+                for key in evicted:
+                    self._shared.pop(key, None)
+                    self._pending.pop(key, None)
+                self.stats["evictions"] += 1
+        else:
+            self._keys.move_to_end(pair)
+        return keys
+
+    def check(self, ip_address: str, link_id, rules: dict, now: float = None) -> str:
+        """Same contract as RateLimiter.check, counted across all workers"""
+        now = time.time() if now is None else now
+        with self._lock:
+            keys = self._track((ip_address, link_id))
+            status = "allowed"
+            for name, seconds, rule, exceeded in WINDOWS:
+                index = int(now // seconds)
+                current = self._count((ip_address, link_id, name, index))
+                previous = self._count((ip_address, link_id, name, index - 1))
+                if _sliding_estimate(previous, current, now, seconds) > rules[rule]:
+                    status = exceeded
+                    break
+            if status == "allowed":
+                for name, seconds, _, _ in WINDOWS:
+                    key = (ip_address, link_id, name, int(now // seconds))
+                    self._pending[key] = self._pending.get(key, 0) + 1
+                    keys.add(key)
+            self.stats[status] += 1
+        self.schedule()
+        return status
+
+    def write(self, conn, batch: dict):
+        """UPSERT the increments; returns the node-wide totals of the keys written"""
+        from utils import hash_value
+
+        now = time.time()
+        totals = {}
+        conn.execute("BEGIN IMMEDIATE")
+        for key, n in batch.items():
+            ip_address, link_id, name, index = key
+            seconds = next(w[1] for w in WINDOWS if w[0] == name)
+            window_start = datetime.utcfromtimestamp(index * seconds).isoformat()
+            totals[key] = conn.execute(
+                UPSERT_RATE_LIMIT_SQL,
+                [hash_value(ip_address), link_id, n, window_start, name, ip_address],
+            ).fetchone()[0]
+        if now - self._last_prune >= RATE_LIMIT_PRUNE_SECONDS:
+            cutoff = datetime.utcfromtimestamp(now - RATE_LIMIT_RETENTION_SECONDS).isoformat()
+            conn.execute("DELETE FROM rate_limits WHERE window_start < ?", [cutoff])
+        return totals
+
+    def merge(self, batch: dict):
+        for key, n in batch.items():
+            keys = self._keys.get(key[:2])
+            if keys is None:
+                continue  # evicted while being written
+            self._pending[key] = self._pending.get(key, 0) + n
+            keys.add(key)
+
+    def written(self, batch: dict, totals: dict):
+        for key, total in totals.items():
+            keys = self._keys.get(key[:2])
+            if keys is not None:
+                self._shared[key] = total
+                keys.add(key)
+        now = time.time()
+        if now - self._last_prune >= RATE_LIMIT_PRUNE_SECONDS:
+            self._last_prune = now
+            # Only the current and previous window of each limit are ever read
+            horizon = {name: int(now // seconds) - 1 for name, seconds, _, _ in WINDOWS}
+            self._shared = {k: v for k, v in self._shared.items() if k[3] >= horizon[k[2]]}
+            for pair in list(self._keys):
+                keys = {k for k in self._keys[pair] if k in self._shared or k in self._pending}
+                if keys:
+                    self._keys[pair] = keys
+                else:
+                    del self._keys[pair]
+
+    def reset(self, link_id=None):
+        """Forget counters (of one link, or all of them) for every worker"""
+        with self._lock:
+            for table in (self._shared, self._pending, self._keys):
+                for key in [k for k in table if link_id is None or k[1] == link_id]:
+                    del table[key]
+        conn = connect_db(check_same_thread=False)
+        try:
+            if link_id is None:
+                conn.execute("DELETE FROM rate_limits")
+            else:
+                conn.execute("DELETE FROM rate_limits WHERE link_id = ?", [link_id])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_stats(self) -> dict:
+        """Return counters for monitoring"""
+        stats = super().get_stats()
+        with self._lock:
+            return dict(stats, backend="sqlite", tracked_keys=len(self._keys), max_keys=self.max_keys,
+                        tracked_windows=len(self._shared))
+
+
+def create_rate_limiter(backend: str = RATE_LIMIT_BACKEND):
+    """Limiter for the configured backend ('local', 'shm' or 'sqlite'); per-process if shared state is unavailable"""
+    try:
+        if backend == "shm":
+            return SharedMemoryRateLimiter()
+        if backend == "sqlite":
+            return SqliteRateLimiter()
+    except Exception as e:
+        print(f"Rate limiter backend {backend!r} unavailable, using per-process counters: {e}")
+    return RateLimiter()
+
+
+rate_limiter = create_rate_limiter()
+atexit.register(rate_limiter.shutdown)
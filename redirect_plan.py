@@ -0,0 +1,91 @@
+"""
+Smart Link Intelligence - Redirect Plan Cache
+Resolves everything /r/<code> needs (link, owner tier, behavior rule, DDoS rules)
+once per code and keeps it in a size-bounded in-process cache
+"""
+
+from cache import LRUCache
+from fast_reject import fast_reject
+from config import MEMBERSHIP_TIERS, REDIRECT_PLAN_CACHE_SIZE, REDIRECT_PLAN_TTL_SECONDS
+from database import query_db
+
+# code -> plan dict. The TTL bounds staleness for writes made by other workers.
+_plans = LRUCache(maxsize=REDIRECT_PLAN_CACHE_SIZE, ttl=REDIRECT_PLAN_TTL_SECONDS)
+
+
+def _build_plan(code: str):
+    """Load and resolve the redirect plan for a code from the database"""
+    from ddos_protection import ddos_protection
+
+    row = query_db(
+        """
+        SELECT l.*, u.membership_tier AS owner_membership_tier, u.is_premium AS owner_is_premium
+        FROM links l
+        LEFT JOIN users u ON u.id = l.user_id
+        WHERE l.code = ?
+        """,
+        [code],
+        one=True,
+    )
+    if not row:
+        return None
+
+    link = dict(row)
+    tier_name = link.pop("owner_membership_tier", None) or "free"
+    is_premium = bool(link.pop("owner_is_premium", None))
+    tier_config = MEMBERSHIP_TIERS.get(tier_name, MEMBERSHIP_TIERS["free"])
+
+    # Effective behavior rule: the link's own rule, else the owner's default
+    behavior_rule = None
+    if link["behavior_rule_id"]:
+        behavior_rule = query_db("SELECT * FROM behavior_rules WHERE id = ?", [link["behavior_rule_id"]], one=True)
+    if not behavior_rule:
+        behavior_rule = query_db("SELECT * FROM behavior_rules WHERE user_id = ? AND is_default = 1", [link["user_id"]], one=True)
+
+    ddos_rules = ddos_protection.get_link_rules(link["id"], link)
+
+    return {
+        "link": link,
+        "owner": {"membership_tier": tier_name, "is_premium": is_premium},
+        "has_ddos_protection": tier_config["ddos_protection"],
+        "ad_free": tier_config["ad_free"],
+        "behavior_rule": dict(behavior_rule) if behavior_rule else None,
+        "ddos_rules": ddos_rules,
+    }
+
+
+def get_redirect_plan(code: str):
+    """Return the cached redirect plan for a code, building it on a miss"""
+    plan = _plans.get(code)
+    if plan is None:
+        plan = _build_plan(code)
+        if plan is not None:
+            _plans.set(code, plan)
+    return plan
+
+
+def invalidate_link(link_id: int = None, code: str = None):
+    """Drop the cached plan and fast-path blocks of a single link (by id and/or code)"""
+    fast_reject.unblock_link(link_id, code)
+    if code is not None:
+        _plans.pop(code)
+    if link_id is not None:
+        link_id = int(link_id)
+        _plans.discard_where(lambda _code, plan: plan["link"]["id"] == link_id)
+
+
+def invalidate_user(user_id: int):
+    """Drop every cached plan owned by a user (tier, rule or profile changed)"""
+    user_id = int(user_id)
+    _plans.discard_where(lambda _code, plan: plan["link"]["user_id"] == user_id)
+
+
+def clear_redirect_plans():
+    """Drop every cached plan and fast-path block"""
+    _plans.clear()
+    fast_reject.clear()
+
+
+def redirect_plan_stats() -> dict:
+    """Return cache counters for monitoring"""
+    return _plans.stats()
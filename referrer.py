@@ -0,0 +1,126 @@
+"""
+Smart Link Intelligence - Referrer Classification
+Table-driven traffic source detection: query-param rules, in-app browsers and a reverse-domain suffix trie
+"""
+
+from urllib.parse import urlsplit
+from cache import LRUCache
+
+# Query parameters that name the source explicitly (robust for mobile apps/PDFs), in priority order
+SOURCE_PARAMS = ("ref", "source", "utm_source")
+
+# Referrer domain -> source. A domain matches itself and all of its subdomains; the longest suffix wins.
+REFERRER_DOMAINS = [
+    ("whatsapp.com", "WhatsApp"),
+    ("whatsapp.net", "WhatsApp"),
+    ("wa.me", "WhatsApp"),
+    ("facebook.com", "Facebook"),
+    ("fb.com", "Facebook"),
+    ("fb.me", "Facebook"),
+    ("messenger.com", "Facebook"),
+    ("instagram.com", "Instagram"),
+    ("t.co", "Twitter"),
+    ("twitter.com", "Twitter"),
+    ("x.com", "Twitter"),
+    ("linkedin.com", "LinkedIn"),
+    ("lnkd.in", "LinkedIn"),
+    ("youtube.com", "YouTube"),
+    ("youtu.be", "YouTube"),
+    ("t.me", "Telegram"),
+    ("telegram.me", "Telegram"),
+    ("telegram.org", "Telegram"),
+    ("mail.google.com", "Gmail"),
+    ("google.com", "Google"),
+]
+
+# Brands matched on any country TLD (google.de, google.co.in, ...)
+REFERRER_BRANDS = {
+    "google": "Google",
+}
+_SECOND_LEVEL_LABELS = {"co", "com", "org", "net", "gov", "edu", "ac"}
+
+NO_REFERRER = "no referrer"
+_TERMINAL = "$"
+
+
+class DomainSuffixTrie:
+    """Reverse-label trie: lookups walk one node per domain label"""
+
+    def __init__(self, entries=()):
+        self._root = {}
+        for domain, value in entries:
+            self.add(domain, value)
+
+    def add(self, domain: str, value):
+        node = self._root
+        for label in reversed(domain.lower().strip(".").split(".")):
+            node = node.setdefault(label, {})
+        node[_TERMINAL] = value
+
+    def lookup(self, host: str):
+        """Value of the longest registered suffix of host, or None"""
+        node = self._root
+        found = None
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            found = node.get(_TERMINAL, found)
+        return found
+
+
+_domains = DomainSuffixTrie(REFERRER_DOMAINS)
+# host -> source (or "" for unknown hosts)
+_host_sources = LRUCache(maxsize=10000)
+
+
+def _brand_source(labels):
+    if len(labels) < 2:
+        return None
+    brand = labels[-2]
+    if brand in _SECOND_LEVEL_LABELS and len(labels) >= 3:
+        brand = labels[-3]
+    return REFERRER_BRANDS.get(brand)
+
+
+def source_for_host(host: str):
+    """Traffic source of a referrer host (e.g. 'l.facebook.com' -> 'Facebook'), None if unknown"""
+    host = (host or "").lower().rstrip(".")
+    if not host:
+        return None
+    source = _host_sources.get(host)
+    if source is None:
+        source = _domains.lookup(host) or _brand_source(host.split(".")) or ""
+        _host_sources.set(host, source)
+    return source or None
+
+
+def classify_referrer_url(referrer_url: str, own_host: str = None) -> str:
+    """Classify a Referer URL: known source name, the URL itself for other sites, or 'no referrer'.
+
+    Also used to re-classify stored visits.referrer values (own_host=None).
+    """
+    if not referrer_url or referrer_url == NO_REFERRER:
+        return NO_REFERRER
+    try:
+        host = (urlsplit(referrer_url).hostname or "").lower()
+    except ValueError:
+        # Unparseable: keep it only if it looks like a URL
+        return referrer_url if referrer_url.startswith(("http://", "https://")) else NO_REFERRER
+    if not host or (own_host and host == own_host):
+        # Internal referrer (from your own dashboard) - mark as no referrer
+        return NO_REFERRER
+    return source_for_host(host) or referrer_url
+
+
+def resolve_referrer(args, in_app: str, referrer_url: str, own_host: str) -> str:
+    """Traffic source of a click: explicit query param, then in-app browser, then the Referer header"""
+    for name in SOURCE_PARAMS:
+        value = args.get(name)
+        if value:
+            return value
+    # Social apps often strip the Referer, so their in-app browser takes priority over it
+    if in_app:
+        return in_app
+    own_host = (own_host or "").lower().split(":")[0]
+    return classify_referrer_url(referrer_url, own_host)
@@ -0,0 +1,109 @@
+"""
+Smart Link Intelligence - Reverse DNS
+PTR lookups on a dedicated thread pool with a hard per-lookup deadline and a positive/negative hostname cache
+"""
+
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from cache import LRUCache
+from config import (
+    RDNS_WORKERS, RDNS_TIMEOUT_SECONDS, RDNS_MAX_PENDING,
+    RDNS_CACHE_SIZE, RDNS_CACHE_TTL_SECONDS, RDNS_NEGATIVE_TTL_SECONDS,
+)
+
+# Cached marker for "no PTR record" (None means "not cached")
+_NO_HOSTNAME = ""
+
+
+def _gethostbyaddr(ip: str):
+    try:
+        return socket.gethostbyaddr(ip)[0]
+    except (socket.herror, socket.gaierror, socket.timeout, OSError, UnicodeError):
+        return None
+
+
+class ReverseDNSResolver:
+    """Bounded-latency reverse DNS: callers wait at most `timeout` seconds for a PTR answer"""
+
+    def __init__(self, workers: int = RDNS_WORKERS, timeout: float = RDNS_TIMEOUT_SECONDS,
+                 max_pending: int = RDNS_MAX_PENDING, cache_size: int = RDNS_CACHE_SIZE,
+                 ttl: int = RDNS_CACHE_TTL_SECONDS, negative_ttl: int = RDNS_NEGATIVE_TTL_SECONDS):
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.negative_ttl = negative_ttl
+        self.cache = LRUCache(maxsize=cache_size, ttl=ttl)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rdns")
+        self._lock = threading.Lock()
+        self._pending = {}  # ip -> Future, so repeated IPs share one in-flight lookup
+        self.lookups = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _store(self, ip: str, future):
+        with self._lock:
+            self._pending.pop(ip, None)
+        try:
+            hostname = future.result()
+        except Exception:
+            hostname = None
+        # A lookup that outlived its caller's deadline still fills the cache for the next visit
+        if hostname:
+            self.cache.set(ip, hostname)
+        else:
+            self.cache.set(ip, _NO_HOSTNAME, ttl=self.negative_ttl)
+
+    def resolve(self, ip: str):
+        """Return the PTR hostname of ip, or None (no record, timed out or resolver saturated)"""
+        if not ip:
+            return None
+        cached = self.cache.get(ip)
+        if cached is not None:
+            return cached or None
+
+        with self._lock:
+            future = self._pending.get(ip)
+            leader = future is None
+            if leader:
+                if len(self._pending) >= self.max_pending:
+                    # Every worker is stuck on slow PTRs; don't queue behind them
+                    self.rejected += 1
+                    return None
+                self.lookups += 1
+                future = self._pool.submit(_gethostbyaddr, ip)
+                self._pending[ip] = future
+        if leader:
+            # Outside the lock: the callback runs inline if the lookup already finished
+            future.add_done_callback(lambda f, ip=ip: self._store(ip, f))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            return None
+
+    def get_stats(self) -> dict:
+        """Return cache and lookup counters for monitoring"""
+        stats = self.cache.stats()
+        with self._lock:
+            stats.update({
+                "lookups": self.lookups,
+                "timeouts": self.timeouts,
+                "rejected": self.rejected,
+                "pending": len(self._pending),
+                "timeout_seconds": self.timeout,
+            })
+        return stats
+
+    def shutdown(self):
+        """Stop accepting lookups; in-flight PTR queries are abandoned"""
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+resolver = ReverseDNSResolver()
+
+
+def reverse_dns(ip: str):
+    """PTR hostname of ip within the configured deadline, None otherwise"""
+    return resolver.resolve(ip)
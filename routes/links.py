@@ -6,20 +6,25 @@ Link creation, redirection, password protection, and deletion
 import sqlite3
 import csv
 import io
+import time
 from datetime import datetime, timedelta, timezone
 from collections import Counter
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort, g, Response, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from decorators import login_required, login_or_admin_required
-from database import query_db, execute_db
-from config import MEMBERSHIP_TIERS, RETURNING_WINDOW_HOURS, MULTI_CLICK_THRESHOLD
+from database import query_db, execute_db, epoch_ms, row_epoch_ms
+from config import MEMBERSHIP_TIERS, RETURNING_WINDOW_HOURS, MULTI_CLICK_THRESHOLD, IP_AUTO_BLOCK_SECONDS, POW_PASS_SECONDS
 from utils import (
     generate_code, utcnow, get_link_password_hash, ensure_session, 
-    get_client_ip, hash_value, detect_region, detect_device, 
-    get_detailed_location, parse_browser, parse_os, get_isp_info,
+    get_client_ip, hash_value, classify_user_agent,
     classify_behavior, detect_suspicious, decide_target, evaluate_state,
     trust_score, attention_decay, country_to_continent, normalize_isp
 )
+from redirect_plan import get_redirect_plan, invalidate_link
+from visit_pipeline import record_visit, recent_visit_window
+from bot_counter import bot_counter
+from link_traffic import link_traffic
+from referrer import resolve_referrer
 
 links_bp = Blueprint('links', __name__)
 
@@ -143,11 +148,22 @@ def redirect_link(code):
     """Redirect to target URL based on link behavior"""
     # Import here to avoid circular imports
     from admin_panel import track_ad_impression
-    from ddos_protection import DDoSProtection
+    from ddos_protection import ddos_protection
+    from fast_reject import fast_reject
+    from ip_rules import ip_rules
+    from pow_challenge import proof_of_work, PASS_COOKIE
     
-    link = query_db("SELECT * FROM links WHERE code = ?", [code], one=True)
-    if not link:
+    plan = get_redirect_plan(code)
+    if not plan:
         abort(404)
+    link = plan["link"]
+
+    # Owner's CIDR block/allow rules (longest prefix match, in memory)
+    ip_address = get_client_ip()
+    ip_rule = ip_rules.check(link["user_id"], ip_address) if plan["has_ddos_protection"] else None
+    if ip_rule is not None and ip_rule.action == "block":
+        retry_after = ip_rule.expires - time.time() if ip_rule.expires else IP_AUTO_BLOCK_SECONDS
+        return fast_reject.response("ip_blocked", retry_after)
 
     # Check if link is password protected - ALWAYS require password
     password_hash = get_link_password_hash(link)
@@ -165,220 +181,93 @@ def redirect_link(code):
         except ValueError:
             pass  # Invalid date format, ignore
 
+    user_agent = request.headers.get("User-Agent", "unknown")[:255]
+    ua_info = classify_user_agent(user_agent)
+
+    # Bots and link previewers (WhatsApp, Slack, Discord...) get a cheap redirect straight to the
+    # primary target: no lookups, no visit queries, no writes - only in-memory counters.
+    # Links under active protection still take the full path below.
+    bot_shortcut = ua_info["is_bot"] and not link["auto_disabled"] and (link["protection_level"] or 0) < 3
+
     # DDoS Protection Check
-    link_owner = query_db("SELECT membership_tier, is_premium FROM users WHERE id = ?", [link["user_id"]], one=True)
-    tier_name = link_owner["membership_tier"] if link_owner and link_owner["membership_tier"] else "free"
-    
-    tier_config = MEMBERSHIP_TIERS.get(tier_name, MEMBERSHIP_TIERS["free"])
-    has_ddos_protection = tier_config["ddos_protection"]
+    has_ddos_protection = plan["has_ddos_protection"]
 
-    ip_address = get_client_ip()
     ip_hash = hash_value(ip_address)
 
     if has_ddos_protection:
-        ddos_protection = DDoSProtection("smart_links.db")
-        
+        if bot_shortcut:
+            # Bot requests still count towards the link's request rate (they never become visits)
+            link_traffic.add_bot(link["id"])
+
         # DDoS Detection - Run this BEFORE blocking to allow escalation to Level 5
-        is_ddos, ddos_reason, new_protection_level = ddos_protection.detect_ddos_attack(link["id"])
+        is_ddos, ddos_reason, new_protection_level = ddos_protection.detect_ddos_attack(link["id"], plan["ddos_rules"])
         if is_ddos:
             current_level = link['protection_level']
             # Only apply if new level is higher than current
             if new_protection_level > current_level:
-                protection_action = ddos_protection.apply_protection(link["id"], new_protection_level)
+                # An escalating link is protected for bots too
+                bot_shortcut = False
+                protection_action = ddos_protection.apply_protection(link["id"], new_protection_level, ddos_reason)
                 
-                if protection_action in ['link_disabled', 'temporary_disabled']:
-                    flash("This link has been automatically protected due to suspicious activity.", "warning")
-                    return render_template("ddos_blocked.html", 
-                                        message="Link Protected", 
-                                        description="This link has been automatically protected due to detected attacks.")
-
-        # Check if link is under protection
-        is_protected, protection_status = ddos_protection.is_link_protected(link["id"])
-        if is_protected:
-            if protection_status == 'disabled':
-                flash("This link has been temporarily disabled due to suspicious activity.", "warning")
-                return render_template("ddos_blocked.html", 
-                                    message="Link Disabled", 
-                                    description="This link has been automatically disabled due to detected DDoS attacks.")
-            elif protection_status == 'temporary_disabled':
-                flash("This link is temporarily unavailable due to high traffic.", "warning")
-                return render_template("ddos_blocked.html", 
-                                    message="Temporarily Unavailable", 
-                                    description="This link is temporarily disabled due to unusual traffic patterns. Please try again later.")
-            elif protection_status == 'captcha_required':
-                flash("Please verify you're human to continue.", "info")
-                return render_template("ddos_blocked.html", 
-                                    message="Verification Required", 
-                                    description="Please verify you're human to access this link.")
+                # Rejections are remembered in memory and answered before any DB access until they expire
+                if protection_action == 'link_disabled':
+                    return fast_reject.reject_link(link["id"], code, protection_action)
+                elif protection_action == 'temporary_disabled':
+                    return fast_reject.reject_link(link["id"], code, protection_action,
+                                                   ddos_protection.temporary_disable_remaining(None))
+
+        # Check if link is under protection (the plan already says a bot-shortcut link is not)
+        is_protected, protection_status = (False, 'normal') if bot_shortcut else ddos_protection.is_link_protected(link["id"])
+        if protection_status == 'captcha_required':
+            # Level 3: through with a proof-of-work pass, otherwise a new challenge (remembered in the fast path)
+            if not proof_of_work.verify_pass(request.cookies.get(PASS_COOKIE), link["id"], ip_address):
+                return fast_reject.challenge_link(link["id"], code, max(3, link["protection_level"] or 0), ip_address)
+        elif is_protected:
+            retry_after = None
+            if protection_status == 'temporary_disabled':
+                retry_after = ddos_protection.temporary_disable_remaining(link["ddos_detected_at"])
+            return fast_reject.reject_link(link["id"], code, protection_status, retry_after)
         
-        # Rate limiting check (Runs if link is not globally blocked)
-        rate_allowed, rate_status = ddos_protection.check_rate_limit(ip_address, link["id"])
-        if not rate_allowed:
-            if rate_status == 'rate_limited':
-                flash("Too many requests. Please slow down.", "warning")
-                return render_template("ddos_blocked.html", 
-                                    message="Rate Limited", 
-                                    description="You're making requests too quickly. Please wait a moment and try again.")
-            elif rate_status == 'burst_attack':
-                flash("Suspicious activity detected.", "danger")
-                return render_template("ddos_blocked.html", 
-                                    message="Blocked", 
-                                    description="Suspicious activity detected from your connection.")
+        # Rate limiting check (Runs if link is not globally blocked; allowlisted IPs are exempt)
+        if ip_rule is None:
+            rate_allowed, rate_status = ddos_protection.check_rate_limit(ip_address, link["id"], plan["ddos_rules"])
+            if not rate_allowed:
+                if rate_status == 'burst_attack':
+                    ddos_protection.auto_block_ip(link, ip_address, rate_status)
+                # The fast-path block lasts per status: short for the per-minute limit, longer for the
+                # hourly limit and bursts, so those clients do not come straight back to the limiter
+                return fast_reject.reject_ip(link["id"], code, ip_address, rate_status)
+
+    if bot_shortcut:
+        bot_counter.hit(link["id"])
+        return redirect(decide_target(link, "Curious", 0))
 
     sess_id = ensure_session()
-    user_agent = request.headers.get("User-Agent", "unknown")[:255]
-    
-    # Detect region and device
-    region = detect_region(ip_address)
-    device = detect_device(user_agent)
     
-    # Get detailed location information
-    location_info = get_detailed_location(ip_address)
-    
-    # Parse browser and OS from user agent
-    browser = parse_browser(user_agent)
-    os_name = parse_os(user_agent)
-    
-    # Get ISP info
-    isp_info = get_isp_info(ip_address)
-    
-    # Get referrer (Smart Tracking)
-    # 1. Check URL parameters first (robust for mobile apps/PDFs)
-    referrer = (
-        request.args.get("ref") or 
-        request.args.get("source") or 
-        request.args.get("utm_source")
-    )
+    # Device, browser and OS from the UA classification above
+    # (region, location and ISP are resolved by the visit pipeline)
+    device = ua_info["device"]
+    browser = ua_info["browser"]
+    os_name = ua_info["os"]
     
-    # 2. Check User-Agent for social media apps (they often strip referrer)
-    # This takes priority over HTTP Referer to detect WhatsApp, Instagram, etc.
-    if not referrer:
-        ua_lower = user_agent.lower()
-        
-        # WhatsApp detection - comprehensive patterns
-        # WhatsApp uses different User-Agents depending on platform:
-        # - Android: Contains "WhatsApp" or "wv)" (WebView)
-        # - iOS: Often just shows as Safari but with specific patterns
-        # - Desktop: May show as Chrome/Edge
-        if any(x in ua_lower for x in [
-            'whatsapp',           # Direct WhatsApp identifier
-            'wa/',                # WhatsApp short form
-            'wv)',                # Android WebView (commonly used by WhatsApp)
-        ]):
-            referrer = 'WhatsApp'
-        
-        # Instagram detection
-        elif 'instagram' in ua_lower:
-            referrer = 'Instagram'
-        
-        # Facebook detection - covers app and messenger
-        elif any(x in ua_lower for x in [
-            'fban',               # Facebook App
-            'fbav',               # Facebook App Version
-            'fb_iab',             # Facebook In-App Browser
-            'fbios',              # Facebook iOS
-            'messenger',          # Facebook Messenger
-            'fb4a',               # Facebook for Android
-        ]):
-            referrer = 'Facebook'
-        
-        # Twitter/X detection
-        elif any(x in ua_lower for x in ['twitter', 'twitterbot']):
-            referrer = 'Twitter'
-        
-        # LinkedIn detection
-        elif 'linkedin' in ua_lower:
-            referrer = 'LinkedIn'
-        
-        # Telegram detection
-        elif 'telegram' in ua_lower:
-            referrer = 'Telegram'
-    
-    # 3. Check HTTP Referer header
-    if not referrer:
-        http_referrer = request.headers.get("Referer", "")
-        
-        if http_referrer:
-            from urllib.parse import urlparse
-            try:
-                ref_domain = urlparse(http_referrer).netloc.lower()
-                current_domain = urlparse(request.host_url).netloc.lower()
-                
-                # Check if it's an external referrer
-                if ref_domain and ref_domain != current_domain:
-                    # Check for known social media domains
-                    if any(x in ref_domain for x in ['whatsapp.com', 'wa.me', 'chat.whatsapp.com']):
-                        referrer = 'WhatsApp'
-                    elif any(x in ref_domain for x in ['facebook.com', 'fb.com', 'messenger.com', 'fb.me', 'm.facebook.com', 'l.facebook.com', 'lm.facebook.com']):
-                        referrer = 'Facebook'
-                    elif any(x in ref_domain for x in ['instagram.com', 'l.instagram.com']):
-                        referrer = 'Instagram'
-                    elif any(x in ref_domain for x in ['t.co', 'twitter.com', 'x.com', 'mobile.twitter.com']):
-                        referrer = 'Twitter'
-                    elif any(x in ref_domain for x in ['linkedin.com', 'lnkd.in']):
-                        referrer = 'LinkedIn'
-                    elif any(x in ref_domain for x in ['youtube.com', 'youtu.be', 'm.youtube.com']):
-                        referrer = 'YouTube'
-                    elif any(x in ref_domain for x in ['t.me', 'telegram.me', 'telegram.org']):
-                        referrer = 'Telegram'
-                    elif any(x in ref_domain for x in ['google.com', 'google.', 'www.google.']):
-                        referrer = 'Google'
-                    elif 'mail.google.com' in ref_domain:
-                        referrer = 'Gmail'
-                    else:
-                        # External referrer - use the full URL
-                        referrer = http_referrer
-                else:
-                    # Internal referrer (from your own dashboard) - mark as no referrer
-                    referrer = "no referrer"
-            except:
-                # If parsing fails, use the referrer as-is if it looks like a URL
-                if http_referrer.startswith(('http://', 'https://')):
-                    referrer = http_referrer
-                else:
-                    referrer = "no referrer"
-        else:
-            referrer = "no referrer"
-            
+    # Get referrer (Smart Tracking): query params, then in-app browser, then the Referer header
+    referrer = resolve_referrer(request.args, ua_info["in_app"], request.headers.get("Referer", ""), request.host)
     referrer = referrer[:500]  # Truncate for DB safety
     
     now = utcnow()
 
-    visits = query_db(
-        """
-        SELECT ts, ip_hash FROM visits
-        WHERE link_id = ?
-        ORDER BY ts DESC
-        LIMIT 20
-        """,
-        [link["id"]],
-    )
-    
-    # DDoS Protection & Behavioral Rules
-    ddos_protection = DDoSProtection("smart_links.db")
-    ddos_rules = ddos_protection.get_link_rules(link["id"])
+    visits = recent_visit_window(link["id"])
     
-    # Get behavior rule settings (separate from security profile)
-    behavior_rule = None
-    if link["behavior_rule_id"]:
-        behavior_rule = query_db("SELECT * FROM behavior_rules WHERE id = ?", [link["behavior_rule_id"]], one=True)
+    # DDoS Protection & Behavioral Rules (resolved once per code in the redirect plan)
+    ddos_rules = plan["ddos_rules"]
+    behavior_rule = plan["behavior_rule"]
     
-    if not behavior_rule:
-        # Fallback to user's default behavioral rule
-        behavior_rule = query_db("SELECT * FROM behavior_rules WHERE user_id = ? AND is_default = 1", [link["user_id"]], one=True)
-    
-    behavior, per_session_count = classify_behavior(link["id"], sess_id, visits, now, dict(behavior_rule) if behavior_rule else None)
+    behavior, per_session_count = classify_behavior(link["id"], sess_id, visits, now, behavior_rule)
     suspicious = detect_suspicious(visits, now, ip_hash, ddos_rules)
     target_url = decide_target(link, behavior, per_session_count)
 
     # Bot Detection - Filter out preview bots to prevent double counting
-    # Case-insensitive and broader matching
-    ua_lower = user_agent.lower()
-    bot_keywords = [
-        'whatsapp', 'telegram', 'facebook', 'twitter', 'linkedin', 
-        'discord', 'skype', 'slack', 'bot', 'crawl', 'spider', 'preview'
-    ]
-    is_bot = any(keyword in ua_lower for keyword in bot_keywords)
+    is_bot = ua_info["is_bot"]
     
     # DEBUG: Print to console to verify (will show in server logs)
     if is_bot:
@@ -387,41 +276,15 @@ def redirect_link(code):
         print(f"DEBUG: Real User? UA='{user_agent}' -> LOGGING visit.")
 
     if not is_bot:
-        execute_db(
-            """
-            INSERT INTO visits
-                (link_id, session_id, ip_hash, user_agent, ts, behavior, is_suspicious, target_url, region, device, country, city, latitude, longitude, timezone, browser, os, isp, hostname, org, referrer, ip_address)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            [
-                link["id"],
-                sess_id,
-                ip_hash,
-                user_agent,
-                now.isoformat(),
-                behavior,
-                1 if suspicious else 0,
-                target_url,
-                region,
-                device,
-                location_info['country'],
-                location_info['city'],
-                location_info['latitude'],
-                location_info['longitude'],
-                location_info['timezone'],
-                browser,
-                os_name,
-                isp_info['isp'],
-                isp_info['hostname'],
-                isp_info['org'],
-                referrer,
-                ip_address,
-            ],
+        record_visit(
+            link["id"], sess_id, ip_hash, user_agent, now.isoformat(), behavior, suspicious,
+            target_url, device, browser, os_name, referrer, ip_address,
         )
 
-        new_state = evaluate_state(link["id"], now, ddos_rules)
+        new_state = evaluate_state(link["id"], now, ddos_rules, suspicious)
         if new_state != link["state"]:
             execute_db("UPDATE links SET state = ? WHERE id = ?", [new_state, link["id"]])
+            invalidate_link(link["id"], code)
     else:
         # It's a bot/preview, just ensure state doesn't change
         new_state = link["state"]
@@ -434,12 +297,10 @@ def redirect_link(code):
     skip_ads = request.args.get('direct', '').lower() == 'true'
     
     # Check if the link owner has ad-free experience
-    link_owner_tier = link_owner["membership_tier"] if link_owner and link_owner["membership_tier"] else "free"
-    link_owner_config = MEMBERSHIP_TIERS.get(link_owner_tier, MEMBERSHIP_TIERS["free"])
-    has_ad_free_experience = link_owner_config["ad_free"]
+    has_ad_free_experience = plan["ad_free"]
     
     # Also check legacy premium status for backward compatibility
-    is_premium_link = link_owner and link_owner["is_premium"]
+    is_premium_link = plan["owner"]["is_premium"]
     
     # Skip ads if: direct parameter, premium user, or Elite Pro user
     if skip_ads or is_premium_link or has_ad_free_experience:
@@ -449,6 +310,25 @@ def redirect_link(code):
     return redirect(url_for("links.show_ads", code=code, target=target_url))
 
 
+@links_bp.route("/r/<code>/verify", methods=["POST"])
+def verify_challenge(code):
+    """Check a proof-of-work solution and hand out a pass cookie for the link"""
+    from pow_challenge import proof_of_work, PASS_COOKIE
+    
+    plan = get_redirect_plan(code)
+    if not plan:
+        abort(404)
+    link_id = plan["link"]["id"]
+    ip_address = get_client_ip()
+    
+    # A wrong or expired solution just lands on a fresh challenge
+    response = redirect(url_for("links.redirect_link", code=code), 303)
+    if proof_of_work.check_solution(request.form.get("challenge", ""), request.form.get("nonce", ""), link_id, ip_address):
+        response.set_cookie(PASS_COOKIE, proof_of_work.issue_pass(link_id, ip_address), max_age=POW_PASS_SECONDS,
+                            path=url_for("links.redirect_link", code=code), httponly=True, samesite="Lax")
+    return response
+
+
 @links_bp.route("/ads/<code>")
 def show_ads(code):
     """Show ads page before redirecting to target"""
@@ -460,10 +340,11 @@ def show_ads(code):
         flash("Invalid redirect target", "danger")
         return redirect(url_for("main.index"))
     
-    link = query_db("SELECT * FROM links WHERE code = ?", [code], one=True)
-    if not link:
+    plan = get_redirect_plan(code)
+    if not plan:
         flash("Link not found", "danger")
         return redirect(url_for("main.index"))
+    link = plan["link"]
     
     # Get active ads
     ads_data = query_db(
@@ -532,9 +413,10 @@ def show_ads(code):
 def password_protected(code):
     """Handle password-protected links"""
     try:
-        link = query_db("SELECT * FROM links WHERE code = ?", [code], one=True)
-        if not link:
+        plan = get_redirect_plan(code)
+        if not plan:
             abort(404)
+        link = plan["link"]
         
         # If link is not password protected, redirect to normal flow
         password_hash = get_link_password_hash(link)
@@ -552,73 +434,22 @@ def password_protected(code):
                 sess_id = ensure_session()
                 user_agent = request.headers.get("User-Agent", "unknown")[:255]
                 ip_address = get_client_ip()
-                region = detect_region(ip_address)
-                device = detect_device(user_agent)
-                location_info = get_detailed_location(ip_address)
-                browser = parse_browser(user_agent)
-                os_name = parse_os(user_agent)
-                isp_info = get_isp_info(ip_address)
-                
-                # Get referrer (Smart Tracking) - same logic as redirect_link
-                # 1. Check URL parameters first
-                referrer = (
-                    request.args.get("ref") or 
-                    request.args.get("source") or 
-                    request.args.get("utm_source")
-                )
-                
-                # 2. Check User-Agent for social media apps
-                if not referrer:
-                    ua_lower = user_agent.lower()
-                    if 'whatsapp' in ua_lower:
-                        referrer = 'WhatsApp'
-                    elif 'instagram' in ua_lower:
-                        referrer = 'Instagram'
-                    elif any(x in ua_lower for x in ['fban', 'fbav']):
-                        referrer = 'Facebook'
+                ua_info = classify_user_agent(user_agent)
+                device = ua_info["device"]
+                browser = ua_info["browser"]
+                os_name = ua_info["os"]
                 
-                # 3. Fallback to HTTP Header (filter internal referrers)
-                if not referrer:
-                    http_referrer = request.headers.get("Referer", "no referrer")
-                    
-                    if http_referrer and http_referrer != 'no referrer':
-                        from urllib.parse import urlparse
-                        try:
-                            ref_domain = urlparse(http_referrer).netloc
-                            current_domain = urlparse(request.host_url).netloc
-                            
-                            if ref_domain and ref_domain != current_domain:
-                                referrer = http_referrer
-                            else:
-                                referrer = "no referrer"
-                        except:
-                            referrer = http_referrer
-                    else:
-                        referrer = "no referrer"
-                        
+                # Get referrer (Smart Tracking) - same classifier as redirect_link
+                referrer = resolve_referrer(request.args, ua_info["in_app"], request.headers.get("Referer", ""), request.host)
                 referrer = referrer[:500]
                 now = utcnow()
                 ip_hash = hash_value(ip_address)
                 
                 # Get visits for behavior classification
-                visits = query_db(
-                    """
-                    SELECT ts, ip_hash FROM visits
-                    WHERE link_id = ?
-                    ORDER BY ts DESC
-                    LIMIT 20
-                    """,
-                    [link["id"]],
-                )
+                visits = recent_visit_window(link["id"])
                 
-                # Get the link owner's default behavior rule
-                behavior_rule = query_db(
-                    """
-                    SELECT * FROM behavior_rules 
-                    WHERE user_id = ? AND is_default = 1
-                    """,
-                    [link["user_id"]], one=True
-                )
+                # Effective behavior rule (link rule, else owner's default) from the redirect plan
+                behavior_rule = plan["behavior_rule"]
                 
                 behavior, per_session_count = classify_behavior(link["id"], sess_id, visits, now, behavior_rule)
                 suspicious = detect_suspicious(visits, now, ip_hash)
@@ -627,12 +458,7 @@ def password_protected(code):
 
                 
                 # Bot Detection
-                ua_lower = user_agent.lower()
-                bot_keywords = [
-                    'whatsapp', 'telegram', 'facebook', 'twitter', 'linkedin', 
-                    'discord', 'skype', 'slack', 'bot', 'crawl', 'spider', 'preview'
-                ]
-                is_bot = any(keyword in ua_lower for keyword in bot_keywords)
+                is_bot = ua_info["is_bot"]
 
                 if is_bot:
                     print(f"DEBUG: Bot detected (Password)! UA='{user_agent}' -> IGNORING visit.")
@@ -641,49 +467,19 @@ def password_protected(code):
 
                 if not is_bot:
                     # Log the visit
-                    execute_db(
-                        """
-                        INSERT INTO visits
-                            (link_id, session_id, ip_hash, user_agent, ts, behavior, is_suspicious, target_url, region, device, country, city, latitude, longitude, timezone, browser, os, isp, hostname, org, referrer, ip_address)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                        [
-                            link["id"],
-                            sess_id,
-                            ip_hash,
-                            user_agent,
-                            now.isoformat(),
-                            behavior,
-                            1 if suspicious else 0,
-                            target_url,
-                            region,
-                            device,
-                            location_info['country'],
-                            location_info['city'],
-                            location_info['latitude'],
-                            location_info['longitude'],
-                            location_info['timezone'],
-                            browser,
-                            os_name,
-                            isp_info['isp'],
-                            isp_info['hostname'],
-                            isp_info['org'],
-                            referrer,
-                            ip_address,
-                        ],
+                    record_visit(
+                        link["id"], sess_id, ip_hash, user_agent, now.isoformat(), behavior, suspicious,
+                        target_url, device, browser, os_name, referrer, ip_address,
                     )
                 
                 # Check if user wants to skip ads or if link owner has ad-free experience
                 skip_ads = request.args.get('direct', '').lower() == 'true'
-                link_owner = query_db("SELECT membership_tier, is_premium FROM users WHERE id = ?", [link["user_id"]], one=True)
                 
                 # Check for Elite Pro ad-free experience
-                link_owner_tier = link_owner["membership_tier"] if link_owner and link_owner["membership_tier"] else "free"
-                link_owner_config = MEMBERSHIP_TIERS.get(link_owner_tier, MEMBERSHIP_TIERS["free"])
-                has_ad_free_experience = link_owner_config["ad_free"]
+                has_ad_free_experience = plan["ad_free"]
                 
                 # Also check legacy premium status for backward compatibility
-                is_premium_link = link_owner and link_owner["is_premium"]
+                is_premium_link = plan["owner"]["is_premium"]
                 
                 # Skip ads if: direct parameter, premium user, or Elite Pro user
                 if skip_ads or is_premium_link or has_ad_free_experience:
@@ -720,10 +516,15 @@ def delete_link(link_id):
     try:
         # Delete visits first (foreign key constraint)
         execute_db("DELETE FROM visits WHERE link_id = ?", [link_id])
+        execute_db("DELETE FROM session_stats WHERE link_id = ?", [link_id])
+        execute_db("DELETE FROM rate_limits WHERE link_id = ?", [link_id])
+        execute_db("DELETE FROM link_baselines WHERE link_id = ?", [link_id])
+        execute_db("DELETE FROM bot_hits WHERE link_id = ?", [link_id])
         # Delete DDoS events
         execute_db("DELETE FROM ddos_events WHERE link_id = ?", [link_id])
         # Delete the link
         execute_db("DELETE FROM links WHERE id = ?", [link_id])
+        invalidate_link(link_id, link["code"])
         
         track_user_activity(g.user["id"], "delete_link", f"Deleted link: {link['code']}")
         return jsonify({"success": True, "message": f"Link '{link['code']}' has been deleted successfully"})
@@ -788,6 +589,7 @@ def update_link():
             f"UPDATE links SET {', '.join(update_fields)} WHERE id = ?",
             update_values
         )
+        invalidate_link(link_id)
         
         # Track activity
         from admin_panel import track_user_activity
@@ -847,17 +649,17 @@ def analytics(code):
 
         visits = query_db(
             """
-            SELECT ts, behavior, is_suspicious, region, device, country, city, latitude, longitude, timezone, browser, os, isp, hostname, org, referrer, user_agent, ip_hash, ip_address
+            SELECT ts, ts_ms, session_id, behavior, is_suspicious, region, device, country, city, latitude, longitude, timezone, browser, os, isp, hostname, org, referrer, user_agent, ip_hash, ip_address
             FROM visits
             WHERE link_id = ?
-            ORDER BY ts DESC
+            ORDER BY ts_ms DESC
             LIMIT 200
             """,
             [link["id"]],
         )
 
         # Recalculate behavior classifications with custom rules
-        now = utcnow()
+        now_ms = epoch_ms(utcnow())
         
         # Initialize rules before loop to ensure they exist even if visits is empty
         if behavior_rule:
@@ -871,15 +673,15 @@ def analytics(code):
 
         recalculated_visits = []
         for visit in visits:
-            visit_time = datetime.fromisoformat(visit["ts"])
             # Get session visits for this specific visit
             session_visits = query_db(
-                "SELECT ts FROM visits WHERE link_id = ? AND session_id = (SELECT session_id FROM visits WHERE id = (SELECT id FROM visits WHERE link_id = ? AND ts = ? LIMIT 1))",
-                [link["id"], link["id"], visit["ts"]]
+                "SELECT ts, ts_ms FROM visits WHERE link_id = ? AND session_id = ?",
+                [link["id"], visit["session_id"]]
             )
             
-            # Count recent visits and session visits
-            recent_visits = [v for v in session_visits if (now - datetime.fromisoformat(v["ts"])).total_seconds() < returning_window_hours * 3600]
+            # Count recent visits and session visits (rows without a usable timestamp are not recent)
+            session_ms = [row_epoch_ms(v) for v in session_visits]
+            recent_visits = [ms for ms in session_ms if ms is not None and now_ms - ms < returning_window_hours * 3600000]
             session_count = len(session_visits)
             
             # Reclassify
@@ -902,12 +704,12 @@ def analytics(code):
             SELECT 
                 ip_hash,
                 COUNT(*) as total_visits,
-                SUM(CASE WHEN ts >= datetime('now', '-' || ? || ' hours') THEN 1 ELSE 0 END) as recent_visits
+                SUM(CASE WHEN ts_ms >= ? THEN 1 ELSE 0 END) as recent_visits
             FROM visits 
             WHERE link_id = ? 
             GROUP BY ip_hash
             """,
-            [returning_window_hours if behavior_rule else RETURNING_WINDOW_HOURS, link["id"]]
+            [now_ms - (returning_window_hours if behavior_rule else RETURNING_WINDOW_HOURS) * 3600000, link["id"]]
         )
 
         curious_users = 0
@@ -928,7 +730,7 @@ def analytics(code):
         # Get daily and hourly engagement trends using visitor's local timezone
         # FETCH ALL VISITS (No Limit) to match graph data
         visits_raw = query_db(
-            "SELECT ts, timezone FROM visits WHERE link_id = ?",
+            "SELECT ts_ms FROM visits WHERE link_id = ? AND ts_ms IS NOT NULL",
             [link["id"]]
         )
         # Fix: Process visits first to match graph data exactly
@@ -936,16 +738,10 @@ def analytics(code):
         local_hours = []
         
         for row in visits_raw:
-            try:
-                # Parse timestamp as UTC
-                dt_utc = datetime.fromisoformat(row["ts"]).replace(tzinfo=timezone.utc)
-                
-                # Bin as UTC for absolute baseline (frontend will localize for the viewer)
-                local_days.append(dt_utc.weekday())
-                local_hours.append(dt_utc.hour)
-            except Exception as e:
-                print(f"Error processing timestamp: {e}")
-                pass
+            # Bin as UTC for absolute baseline (frontend will localize for the viewer);
+            # integer arithmetic on epoch ms, no timestamp parsing. 1970-01-01 was a Thursday (Mon=0).
+            local_days.append((row["ts_ms"] // 86400000 + 3) % 7)
+            local_hours.append(row["ts_ms"] // 3600000 % 24)
         
         # Process daily distribution (Mon=0...Sun=6)
         day_names_sun = ['Sun', 'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat']
@@ -967,6 +763,10 @@ def analytics(code):
 
         suspicious_count = query_db("SELECT COUNT(*) as count FROM visits WHERE link_id = ? AND is_suspicious = 1", [link["id"]], one=True)["count"]
         
+        # Bot and link-preview hits are not visits: flushed counts plus this worker's unflushed ones
+        bot_hits_row = query_db("SELECT hits FROM bot_hits WHERE link_id = ?", [link["id"]], one=True)
+        bot_hits = (bot_hits_row["hits"] if bot_hits_row else 0) + bot_counter.pending(link["id"])
+        
         # Use ip_hash for unique visitors instead of session_id for better persistence
         unique_visitors_query = query_db("SELECT DISTINCT ip_hash FROM visits WHERE link_id = ?", [link["id"]])
         unique_visitors = len(unique_visitors_query)
@@ -980,6 +780,7 @@ def analytics(code):
             "total": total_visits,
             "unique_visitors": unique_visitors,
             "suspicious": suspicious_count,
+            "bot_hits": bot_hits,
             "curious": curious_count,
             "interested": interested_count,
             "engaged": engaged_count
@@ -1084,7 +885,7 @@ def analytics(code):
         trust = trust_score(link["id"])
         
         # Get ALL timestamps for attention decay (no limit)
-        all_visits_timestamps = query_db("SELECT ts FROM visits WHERE link_id = ? ORDER BY ts ASC", [link["id"]])
+        all_visits_timestamps = query_db("SELECT ts_ms FROM visits WHERE link_id = ? AND ts_ms IS NOT NULL", [link["id"]])
         attention = attention_decay(all_visits_timestamps)
 
         # Get country data explicitly for the Country Chart - using COUNT(*) for total clicks
@@ -1329,12 +1130,12 @@ def export_csv(code_id):
     device_data = query_db("SELECT device, COUNT(*) as count FROM visits WHERE link_id = ? GROUP BY device", [link["id"]])
     
     # 4. Hourly distribution using visitor's local timezone
-    hourly_raw = query_db("SELECT ts, timezone FROM visits WHERE link_id = ?", [link["id"]])
+    hourly_raw = query_db("SELECT ts, ts_ms, timezone FROM visits WHERE link_id = ?", [link["id"]])
     from zoneinfo import ZoneInfo
     local_hours = []
     for row in hourly_raw:
         try:
-            dt_utc = datetime.fromisoformat(row["ts"]).replace(tzinfo=timezone.utc)
+            dt_utc = datetime.fromtimestamp(row_epoch_ms(row) / 1000, tz=timezone.utc)
             tz_name = row["timezone"] or "UTC"
             try:
                 visitor_tz = ZoneInfo(tz_name)
@@ -1415,7 +1216,7 @@ def export_link_analytics_excel(code_id):
             SELECT ts, ip_address, country, city, browser, isp, hostname, org, timezone, device, behavior, is_suspicious, latitude, longitude, user_agent, referrer
             FROM visits
             WHERE link_id = ?
-            ORDER BY ts DESC
+            ORDER BY ts_ms DESC
             """,
             [link["id"]],
         )
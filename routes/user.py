@@ -9,6 +9,7 @@ from werkzeug.security import check_password_hash, generate_password_hash
 from decorators import login_required
 from database import query_db, execute_db
 from config import MEMBERSHIP_TIERS
+from redirect_plan import invalidate_user
 
 user_bp = Blueprint('user', __name__)
 
@@ -92,9 +93,15 @@ def delete_account():
     
     # Delete user data
     execute_db("DELETE FROM visits WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [g.user["id"]])
+    execute_db("DELETE FROM session_stats WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [g.user["id"]])
+    execute_db("DELETE FROM rate_limits WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [g.user["id"]])
+    execute_db("DELETE FROM link_baselines WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [g.user["id"]])
+    execute_db("DELETE FROM bot_hits WHERE link_id IN (SELECT id FROM links WHERE user_id = ?)", [g.user["id"]])
     execute_db("DELETE FROM links WHERE user_id = ?", [g.user["id"]])
     execute_db("DELETE FROM personalized_ads WHERE user_id = ?", [g.user["id"]])
+    execute_db("DELETE FROM ip_rules WHERE user_id = ?", [g.user["id"]])
     execute_db("DELETE FROM users WHERE id = ?", [g.user["id"]])
+    invalidate_user(g.user["id"])
     
     from flask import session
     from config import USER_SESSION_KEY
@@ -201,6 +208,7 @@ def process_upgrade():
         "UPDATE users SET is_premium = 1, membership_tier = ?, premium_expires_at = ? WHERE id = ?",
         [target_tier, expires_at, g.user["id"]]
     )
+    invalidate_user(g.user["id"])
     
     track_user_activity(g.user["id"], "upgrade", f"Upgraded account to {target_tier}")
     tier_name = MEMBERSHIP_TIERS[target_tier]["name"]
@@ -234,6 +242,7 @@ def behavior_rules():
             """,
             [g.user["id"], "Default Rule", 48, 2, 3, 60, 1000, 500, 100, 10, 50, 0.3, 5, 5, 1]
         )
+        invalidate_user(g.user["id"])
         user_rules = query_db(
             "SELECT * FROM behavior_rules WHERE user_id = ? ORDER BY is_default DESC, rule_name ASC",
             [g.user["id"]]
@@ -275,6 +284,7 @@ def create_behavior_rule():
         """,
         [g.user["id"], rule_name, returning_window_hours, interested_threshold, engaged_threshold]
     )
+    invalidate_user(g.user["id"])
     
     track_user_activity(g.user["id"], "create_rule", f"Created behavior rule: {rule_name}")
     flash(f"Behavior rule '{rule_name}' created successfully", "success")
@@ -322,6 +332,7 @@ def update_behavior_rule(rule_id):
         """,
         [rule_name, returning_window_hours, interested_threshold, engaged_threshold, rule_id]
     )
+    invalidate_user(g.user["id"])
     
     track_user_activity(g.user["id"], "update_rule", f"Updated behavior rule: {rule_name}")
     flash(f"Behavior rule '{rule_name}' updated successfully", "success")
@@ -353,6 +364,7 @@ def delete_behavior_rule(rule_id):
             return redirect(url_for("user.behavior_rules"))
     
     execute_db("DELETE FROM behavior_rules WHERE id = ?", [rule_id])
+    invalidate_user(g.user["id"])
     track_user_activity(g.user["id"], "delete_rule", f"Deleted behavior rule: {rule['rule_name']}")
     flash("Behavior rule deleted successfully", "success")
     return redirect(url_for("user.behavior_rules"))
@@ -380,6 +392,7 @@ def set_default_behavior_rule(rule_id):
     
     # Set this rule as default
     execute_db("UPDATE behavior_rules SET is_default = 1 WHERE id = ?", [rule_id])
+    invalidate_user(g.user["id"])
     
     track_user_activity(g.user["id"], "set_default_rule", f"Set default behavior rule: {rule['rule_name']}")
     flash(f"'{rule['rule_name']}' is now your default behavior rule", "success")
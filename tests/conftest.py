@@ -0,0 +1,81 @@
+"""
+Shared fixtures: every test session runs against a throwaway database, never smart_links.db
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+
+# Must be set before config is imported anywhere
+_tmpdir = tempfile.mkdtemp(prefix="smart_links_test_")
+os.environ["DATABASE"] = os.path.join(_tmpdir, "test.db")
+os.environ.setdefault("PUBLIC_IP_FALLBACK", "0")
+os.environ.setdefault("GEO_ONLINE_FALLBACK", "0")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app import appl
+
+    appl.config["TESTING"] = True
+    return appl
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def make_link(app):
+    """Create an owner of the given tier and a link of theirs; returns the link row as a dict"""
+    from database import connect_db
+    from utils import utcnow
+
+    def make(tier="elite_pro", primary_url="https://example.com/"):
+        suffix = uuid.uuid4().hex[:10]
+        conn = connect_db()
+        try:
+            user_id = conn.execute(
+                "INSERT INTO users (username, password_hash, membership_tier) VALUES (?, ?, ?)",
+                [f"user_{suffix}", "x", tier],
+            ).lastrowid
+            conn.execute(
+                "INSERT INTO links (code, primary_url, created_at, state, user_id) VALUES (?, ?, ?, 'Active', ?)",
+                [f"t{suffix}", primary_url, utcnow().isoformat(), user_id],
+            )
+            conn.commit()
+            return dict(conn.execute("SELECT * FROM links WHERE code = ?", [f"t{suffix}"]).fetchone())
+        finally:
+            conn.close()
+
+    return make
+
+
+GEO_CSV_HEADER = "start,end,country,region,city,lat,lon,tz,isp\n"
+
+
+@pytest.fixture
+def offline_geo_csv(tmp_path, monkeypatch):
+    """Point the offline geo index at a CSV written by the test; returns a function writing its rows"""
+    import config
+    import offline_geo
+
+    csv_path = tmp_path / "ranges.csv"
+    monkeypatch.setattr(config, "OFFLINE_GEO_CSV", str(csv_path))
+    monkeypatch.setattr(config, "OFFLINE_GEO_INDEX", str(tmp_path / "ranges.bin"))
+    monkeypatch.setattr(offline_geo, "_index", None)
+    monkeypatch.setattr(offline_geo, "_index_loaded", False)
+
+    def write(*rows):
+        csv_path.write_text(GEO_CSV_HEADER + "".join(row + "\n" for row in rows), encoding="utf-8")
+        return str(csv_path)
+
+    yield write
+    if offline_geo._index is not None:
+        offline_geo._index.close()
@@ -0,0 +1,174 @@
+"""
+Learned traffic baselines: streaming updates persisted across restarts, adding triggers to the static DDoS
+thresholds and never replacing them
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from anomaly import AnomalyDetector, LinkBaseline, anomaly_detector
+from database import connect_db
+from ddos_protection import ddos_protection
+from link_traffic import link_traffic
+
+
+def _detector(**kwargs):
+    return AnomalyDetector(sample_seconds=60, half_life_minutes=60, warmup=5, min_rate=10,
+                           flush_interval=3600, **kwargs)
+
+
+def test_baseline_takes_one_sample_per_interval(app, make_link):
+    link = make_link()
+    detector = _detector()
+    for i in range(6):
+        detector.observe(link["id"], 20, 0, now=1000.0 + i * 10)
+
+    assert detector.describe(link["id"])["samples"] == 1
+    detector.observe(link["id"], 20, 0, now=1060.0)
+    assert detector.describe(link["id"])["samples"] == 2
+    detector.shutdown()
+
+
+def test_idle_decay_matches_zero_samples():
+    stepped = LinkBaseline(rate_mean=40.0, rate_var=9.0, samples=10)
+    decayed = LinkBaseline(rate_mean=40.0, rate_var=9.0, samples=10)
+    for _ in range(7):
+        stepped.update(0, None, 0.1)
+    decayed.decay(0.1, 7)
+
+    assert decayed.rate_mean == pytest.approx(stepped.rate_mean)
+    assert decayed.rate_var == pytest.approx(stepped.rate_var)
+    assert decayed.samples == stepped.samples
+
+
+def test_flood_is_scored_anomalous_only_when_warmed(app, make_link):
+    link = make_link()
+    detector = _detector()
+    now = 1000.0
+    for i in range(4):
+        detector.observe(link["id"], 20 + i % 2, 0, now=now + i * 60)
+    # Still warming up (and within the last sample's interval, so the baseline is unchanged)
+    score = detector.observe(link["id"], 500, 0, now=now + 3 * 60 + 30)
+    assert not score.warmed and not score.rate_anomaly
+
+    for i in range(4, 10):
+        detector.observe(link["id"], 20 + i % 2, 0, now=now + i * 60)
+    mean = detector.describe(link["id"])["rate_mean"]
+    score = detector.observe(link["id"], 500, 0, now=now + 10 * 60)
+
+    assert score.warmed and score.rate_anomaly
+    # The anomalous sample moves the baseline at a tenth of the normal weight
+    assert detector.describe(link["id"])["rate_mean"] - mean < (500 - mean) * detector.alpha * 0.2
+    assert detector.anomalous_since(link["id"], now + 10 * 60)
+    detector.shutdown()
+
+
+def test_baseline_survives_restart(app, make_link):
+    link = make_link()
+    detector = _detector()
+    for i in range(8):
+        detector.observe(link["id"], 30, 3, now=1000.0 + i * 60)
+    learned = detector.describe(link["id"])
+    detector.shutdown()
+
+    restarted = _detector()
+    assert restarted.describe(link["id"]) == learned
+    assert restarted.get_stats()["loaded"] == 1
+    restarted.shutdown()
+
+
+def test_failed_flush_keeps_newer_baseline(app, make_link):
+    link = make_link()
+    detector = _detector()
+    detector.observe(link["id"], 30, 0, now=1000.0)
+    batch = dict(detector._pending)
+    detector._pending.clear()
+    detector.observe(link["id"], 40, 0, now=1060.0)
+
+    detector.merge(batch)
+
+    assert detector._pending[link["id"]][5] == 2
+    detector.shutdown()
+
+
+def _warm_baseline(link_id, rate_mean, rate_var):
+    baseline = LinkBaseline(rate_mean=rate_mean, rate_var=rate_var, samples=anomaly_detector.warmup * 2,
+                            updated_at=time.time())
+    anomaly_detector.links.set(link_id, baseline)
+    return baseline
+
+
+def _link_row(link_id):
+    conn = connect_db()
+    try:
+        return dict(conn.execute("SELECT * FROM links WHERE id = ?", [link_id]).fetchone())
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def request_context(app):
+    with app.test_request_context("/", headers={"User-Agent": "Mozilla/5.0"}):
+        yield
+
+
+def test_static_link_limit_applies_to_warmed_baseline(request_context, make_link, monkeypatch):
+    link = make_link()
+    # A link that normally runs above its configured limit: the baseline calls 600/min normal
+    _warm_baseline(link["id"], rate_mean=600, rate_var=400)
+    monkeypatch.setattr(link_traffic, "counts", lambda link_id, window, now=None: (600, 0))
+
+    is_ddos, reason, level = ddos_protection.detect_ddos_attack(link["id"], dict(ddos_protection.rate_limits))
+
+    assert (is_ddos, reason, level) == (True, "high_request_rate", 4)
+
+
+def test_rate_anomaly_below_static_limit(request_context, make_link, monkeypatch):
+    link = make_link()
+    _warm_baseline(link["id"], rate_mean=10, rate_var=4)
+    monkeypatch.setattr(link_traffic, "counts", lambda link_id, window, now=None: (200, 0))
+
+    is_ddos, reason, level = ddos_protection.detect_ddos_attack(link["id"], dict(ddos_protection.rate_limits))
+
+    assert (is_ddos, reason, level) == (True, "traffic_anomaly", 3)
+
+
+def _age_detection(link_id, seconds):
+    conn = connect_db()
+    try:
+        conn.execute("UPDATE links SET ddos_detected_at = ? WHERE id = ?",
+                     [(datetime.utcnow() - timedelta(seconds=seconds)).isoformat(), link_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_anomaly_protection_expires(request_context, make_link):
+    link = make_link()
+    _warm_baseline(link["id"], rate_mean=10, rate_var=4)
+    ddos_protection.apply_protection(link["id"], 3, "traffic_anomaly")
+    assert ddos_protection.is_link_protected(link["id"]) == (True, "captcha_required")
+
+    _age_detection(link["id"], 3600)
+    assert ddos_protection.is_link_protected(link["id"]) == (False, "normal")
+    assert _link_row(link["id"])["protection_level"] == 0
+
+
+def test_anomaly_protection_held_while_anomalous(request_context, make_link):
+    link = make_link()
+    baseline = _warm_baseline(link["id"], rate_mean=10, rate_var=4)
+    ddos_protection.apply_protection(link["id"], 3, "traffic_anomaly")
+    _age_detection(link["id"], 3600)
+    baseline.anomalous_at = time.time()
+
+    assert ddos_protection.is_link_protected(link["id"]) == (True, "captcha_required")
+
+
+def test_threshold_protection_does_not_expire(request_context, make_link):
+    link = make_link()
+    ddos_protection.apply_protection(link["id"], 3, "moderate_suspicious_activity")
+    _age_detection(link["id"], 3600)
+
+    assert ddos_protection.is_link_protected(link["id"]) == (True, "captcha_required")
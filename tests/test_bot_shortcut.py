@@ -0,0 +1,53 @@
+"""
+Bots and link previewers take the cheap redirect, but their traffic still counts for DDoS protection
+"""
+
+from database import connect_db
+
+BOT_UA = "ExampleBot/1.0 (+https://example.com/bot)"
+
+
+def _protection_level(link_id):
+    conn = connect_db()
+    try:
+        return conn.execute("SELECT protection_level FROM links WHERE id = ?", [link_id]).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_bot_gets_primary_target(client, make_link):
+    link = make_link()
+    response = client.get(f"/r/{link['code']}", headers={"User-Agent": BOT_UA, "X-Forwarded-For": "198.51.100.1"})
+    assert response.status_code == 302
+    assert response.location == link["primary_url"]
+
+
+def test_bot_flood_escalates_link(client, make_link, monkeypatch):
+    from ddos_protection import ddos_protection
+
+    monkeypatch.setitem(ddos_protection.rate_limits, "requests_per_link_per_minute", 20)
+    link = make_link()
+    statuses = []
+    for i in range(40):
+        # A different address per request, so only the per-link rate can catch the flood
+        response = client.get(f"/r/{link['code']}",
+                              headers={"User-Agent": BOT_UA, "X-Forwarded-For": f"198.51.100.{i + 10}"})
+        statuses.append(response.status_code)
+
+    assert statuses[:20] == [302] * 20
+    assert _protection_level(link["id"]) >= 4
+    assert statuses[-1] == 503
+
+
+def test_bot_flood_from_one_ip_is_rate_limited(client, make_link, monkeypatch):
+    from ddos_protection import ddos_protection
+
+    monkeypatch.setitem(ddos_protection.rate_limits, "requests_per_ip_per_minute", 5)
+    link = make_link()
+    statuses = [
+        client.get(f"/r/{link['code']}", headers={"User-Agent": BOT_UA, "X-Forwarded-For": "203.0.113.7"}).status_code
+        for _ in range(10)
+    ]
+
+    assert statuses[:5] == [302] * 5
+    assert statuses[-1] == 429
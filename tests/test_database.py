@@ -0,0 +1,22 @@
+"""
+Visit timestamps: rows missing ts_ms fall back to their ISO ts
+"""
+
+from datetime import datetime
+
+from database import epoch_ms, row_epoch_ms
+
+
+def test_row_epoch_ms_prefers_ts_ms():
+    assert row_epoch_ms({"ts": "2024-01-01T00:00:00", "ts_ms": 123}) == 123
+
+
+def test_row_epoch_ms_parses_ts_when_ts_ms_is_null():
+    expected = epoch_ms(datetime(2024, 1, 1, 12, 30))
+    assert row_epoch_ms({"ts": "2024-01-01T12:30:00", "ts_ms": None}) == expected
+    assert row_epoch_ms({"ts": "2024-01-01 12:30:00", "ts_ms": None}) == expected
+
+
+def test_row_epoch_ms_without_usable_timestamp():
+    assert row_epoch_ms({"ts": None, "ts_ms": None}) is None
+    assert row_epoch_ms({"ts": "yesterday", "ts_ms": None}) is None
@@ -0,0 +1,123 @@
+"""
+Fast reject path: pre-rendered reject pages, per-status IP block lifetimes, and the before_request hook
+"""
+
+import time
+
+import pytest
+
+from fast_reject import FastRejectList, IP_BLOCK_SECONDS, REJECT_PAGES, fast_reject
+from config import FAST_REJECT_BLOCK_SECONDS, FAST_REJECT_IP_SECONDS
+
+BROWSER_UA = "Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0"
+
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield
+
+
+@pytest.fixture(autouse=True)
+def clear_fast_reject():
+    yield
+    fast_reject.clear()
+
+
+@pytest.mark.parametrize("status", sorted(REJECT_PAGES))
+def test_reject_page_status_codes(app_context, status):
+    response = FastRejectList().response(status, 2.5)
+
+    assert response.status_code == REJECT_PAGES[status][0]
+    assert response.headers["Retry-After"] == "3"
+    assert response.headers["Cache-Control"] == "no-store"
+    assert REJECT_PAGES[status][1].encode() in response.data
+
+
+def test_reject_page_is_rendered_once(app_context):
+    rejects = FastRejectList()
+    first = rejects.response("rate_limited", 1)
+    second = rejects.response("rate_limited", 1)
+
+    assert first.data == second.data
+    assert list(rejects._pages) == ["rate_limited"]
+
+
+@pytest.mark.parametrize("status, seconds", [
+    ("rate_limited", FAST_REJECT_IP_SECONDS),
+    ("hourly_rate_limited", FAST_REJECT_BLOCK_SECONDS),
+    ("burst_attack", FAST_REJECT_BLOCK_SECONDS),
+])
+def test_ip_block_lifetime_per_status(app_context, status, seconds):
+    rejects = FastRejectList()
+    response = rejects.reject_ip(1, "code", "198.51.100.1", status)
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(int(seconds))
+    _, blocked_status, retry_at = rejects.ips.get(("code", "198.51.100.1"))
+    assert blocked_status == status
+    assert retry_at - time.monotonic() == pytest.approx(seconds, abs=1)
+
+
+def test_ip_block_is_per_link_and_ip(app_context):
+    rejects = FastRejectList()
+    rejects.reject_ip(1, "code", "198.51.100.1", "rate_limited")
+
+    assert rejects.check("code", "198.51.100.1").status_code == 429
+    assert rejects.check("code", "198.51.100.2") is None
+    assert rejects.check("other", "198.51.100.1") is None
+    assert rejects.get_stats()["rejected"] == 1
+
+
+def test_ip_block_expires(app_context, monkeypatch):
+    monkeypatch.setitem(IP_BLOCK_SECONDS, "rate_limited", 0.05)
+    rejects = FastRejectList()
+    rejects.reject_ip(1, "code", "198.51.100.1", "rate_limited")
+    time.sleep(0.1)
+
+    assert rejects.check("code", "198.51.100.1") is None
+
+
+def test_link_block_and_unblock(app_context):
+    rejects = FastRejectList()
+    rejects.reject_link(7, "code", "temporary_disabled", retry_after=120)
+    response = rejects.check("code", "198.51.100.1")
+
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) == 120
+
+    rejects.unblock_link(link_id=7)
+    assert rejects.check("code", "198.51.100.1") is None
+
+
+def test_hourly_limit_gets_the_long_block(client, make_link, monkeypatch):
+    from ddos_protection import ddos_protection
+
+    monkeypatch.setitem(ddos_protection.rate_limits, "requests_per_ip_per_hour", 3)
+    link = make_link()
+    headers = {"User-Agent": BROWSER_UA, "X-Forwarded-For": "203.0.113.77"}
+    statuses = [client.get(f"/r/{link['code']}", headers=headers).status_code for _ in range(5)]
+
+    assert statuses[:4] == [302] * 4
+    assert statuses[4] == 429
+    _, status, retry_at = fast_reject.ips.get((link["code"], "203.0.113.77"))
+    assert status == "hourly_rate_limited"
+    assert retry_at - time.monotonic() == pytest.approx(FAST_REJECT_BLOCK_SECONDS, abs=1)
+
+
+def test_before_request_hook_answers_blocked_ip(client, make_link, monkeypatch):
+    import routes.links
+
+    link = make_link()
+    with client.application.app_context():
+        fast_reject.reject_ip(link["id"], link["code"], "203.0.113.78", "hourly_rate_limited")
+    other = client.get(f"/r/{link['code']}", headers={"User-Agent": BROWSER_UA, "X-Forwarded-For": "203.0.113.79"})
+    assert other.status_code == 302
+
+    # The blocked client is answered before the redirect view (and its plan lookup) runs
+    monkeypatch.setattr(routes.links, "get_redirect_plan", lambda code: pytest.fail("full redirect path ran"))
+    response = client.get(f"/r/{link['code']}", headers={"User-Agent": BROWSER_UA, "X-Forwarded-For": "203.0.113.78"})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) == FAST_REJECT_BLOCK_SECONDS
+    assert b"too many requests to this link" in response.data
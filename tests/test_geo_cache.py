@@ -0,0 +1,90 @@
+"""
+Geolocation cache: memory LRU in front of the geo_cache table, with a shorter TTL for failed lookups
+"""
+
+import threading
+import time
+import uuid
+
+import pytest
+
+import geo_cache as geo_cache_module
+from database import connect_db
+from geo_cache import GeoCache
+
+FOUND = {"status": "success", "country": "Australia", "city": "Sydney"}
+
+
+@pytest.fixture
+def ip():
+    return f"2001:db8:{uuid.uuid4().hex[:4]}::{uuid.uuid4().hex[:4]}"
+
+
+def _row(ip):
+    conn = connect_db()
+    try:
+        return conn.execute("SELECT status, expires_at FROM geo_cache WHERE ip = ?", [ip]).fetchone()
+    finally:
+        conn.close()
+
+
+def test_miss(app, ip):
+    assert GeoCache().get(ip) is None
+
+
+def test_hit_from_memory_then_from_table(app, ip):
+    cache = GeoCache()
+    cache.set(ip, FOUND)
+    assert cache.get(ip) == FOUND
+    assert cache.memory.stats()["hits"] == 1
+
+    # Another worker (empty memory tier) reads it from the table and keeps it in memory
+    other = GeoCache()
+    assert other.get(ip) == FOUND
+    assert ip in other.memory
+
+
+def test_failed_lookup_is_negatively_cached(app, ip):
+    cache = GeoCache(ttl=3600, negative_ttl=60)
+    cache.set(ip, {"status": "fail"})
+
+    assert cache.get(ip) == {"status": "fail"}
+    status, expires_at = _row(ip)
+    assert status == "fail"
+    assert expires_at - time.time() == pytest.approx(60, abs=5)
+
+
+def test_entries_expire_in_both_tiers(app, ip):
+    cache = GeoCache(ttl=0.05, negative_ttl=0.05)
+    cache.set(ip, FOUND)
+    time.sleep(0.1)
+
+    assert cache.get(ip) is None
+    assert GeoCache().get(ip) is None
+
+
+def test_expired_rows_are_purged(app, ip, monkeypatch):
+    monkeypatch.setattr(geo_cache_module, "PURGE_EVERY_WRITES", 2)
+    cache = GeoCache(ttl=0.05, negative_ttl=0.05)
+    cache.set(ip, FOUND)
+    time.sleep(0.1)
+    cache.set(ip + "1", FOUND)
+
+    assert _row(ip) is None
+
+
+def test_concurrent_writes_are_counted(app):
+    cache = GeoCache()
+    prefix = uuid.uuid4().hex[:4]
+
+    def write(worker):
+        for i in range(25):
+            cache.set(f"2001:db8:{prefix}:{worker}::{i}", FOUND)
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert cache._writes == 200
@@ -0,0 +1,99 @@
+"""
+Client IP handling: which addresses count as private, the memoized public-IP fallback, and offline-first geolocation
+"""
+
+import time
+
+import pytest
+
+import utils
+from utils import get_api_location, is_private_ip
+
+
+@pytest.mark.parametrize("ip", [
+    "10.1.2.3", "172.16.0.1", "192.168.1.1", "100.64.0.1", "127.0.0.1", "169.254.1.1", "0.0.0.0",
+    "224.0.0.1", "::1", "fe80::1", "fc00::1", "fd12:3456::1", "::ffff:192.168.1.1", "", "unknown", "not-an-ip",
+])
+def test_local_addresses_are_private(ip):
+    assert is_private_ip(ip)
+
+
+@pytest.mark.parametrize("ip", [
+    "8.8.8.8", "2606:4700::1111", "::ffff:8.8.8.8",
+    # Documentation ranges are routable as far as geolocation is concerned
+    "192.0.2.10", "198.51.100.7", "203.0.113.200", "2001:db8::1",
+])
+def test_routable_addresses_are_not_private(ip):
+    assert not is_private_ip(ip)
+
+
+def test_documentation_ranges_resolve_from_offline_index(offline_geo_csv, monkeypatch):
+    offline_geo_csv(
+        "192.0.2.0,192.0.2.255,India,Gujarat,Ahmedabad,23.0225,72.5714,Asia/Kolkata,Reliance Jio",
+        "2001:db8::,2001:db8:ffff:ffff:ffff:ffff:ffff:ffff,Germany,Hesse,Frankfurt am Main,50.1109,8.6821,"
+        "Europe/Berlin,Deutsche Telekom AG",
+    )
+    monkeypatch.setattr(utils.requests, "get", lambda *a, **k: pytest.fail("offline hit went online"))
+
+    v4 = get_api_location("192.0.2.10")
+    v6 = get_api_location("2001:db8::1")
+
+    assert (v4["status"], v4["city"], v4["source"]) == ("success", "Ahmedabad", "offline")
+    assert (v6["status"], v6["city"], v6["source"]) == ("success", "Frankfurt am Main", "offline")
+
+
+class _Response:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+@pytest.fixture
+def ipify(monkeypatch):
+    """Fake ipify: returns the queued responses (or raises queued exceptions) and counts calls"""
+    monkeypatch.setattr(utils, "PUBLIC_IP_OVERRIDE", None)
+    monkeypatch.setattr(utils, "PUBLIC_IP_FALLBACK", True)
+    monkeypatch.setitem(utils._public_ip, "ip", None)
+    monkeypatch.setitem(utils._public_ip, "checked_at", 0.0)
+    responses = []
+    calls = []
+
+    def get(url, timeout=None):
+        calls.append(url)
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(utils.requests, "get", get)
+    return responses, calls
+
+
+def test_public_ip_is_memoized(ipify):
+    responses, calls = ipify
+    responses.append(_Response(200, "203.0.113.50\n"))
+
+    assert utils.get_public_ip_fallback() == "203.0.113.50"
+    assert utils.get_public_ip_fallback() == "203.0.113.50"
+    assert utils.resolve_lookup_ip("192.168.0.10") == "203.0.113.50"
+    assert len(calls) == 1
+
+
+def test_public_ip_failed_refresh_keeps_last_known(ipify, monkeypatch):
+    responses, calls = ipify
+    responses.extend([_Response(200, "203.0.113.50"), OSError("network down")])
+    assert utils.get_public_ip_fallback() == "203.0.113.50"
+
+    # Past the refresh interval the fetch fails; the previous address keeps being served
+    monkeypatch.setitem(utils._public_ip, "checked_at", time.monotonic() - utils.PUBLIC_IP_REFRESH_SECONDS - 1)
+    assert utils.get_public_ip_fallback() == "203.0.113.50"
+    assert len(calls) == 2
+
+
+def test_public_ip_failure_is_not_retried_every_call(ipify):
+    responses, calls = ipify
+    responses.append(OSError("network down"))
+
+    assert utils.get_public_ip_fallback() is None
+    assert utils.get_public_ip_fallback() is None
+    assert len(calls) == 1
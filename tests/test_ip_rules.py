@@ -0,0 +1,154 @@
+"""
+IP rules: CIDR normalisation, longest-prefix precedence, expiry and per-owner isolation
+"""
+
+import ipaddress
+import threading
+import time
+
+import pytest
+
+from ip_rules import IPRule, IPRuleList, PrefixTrie, _parse_address, parse_network
+
+
+@pytest.mark.parametrize("cidr, expected", [
+    ("198.51.100.7", "198.51.100.7/32"),
+    ("198.51.100.7/24", "198.51.100.0/24"),
+    ("::ffff:198.51.100.7", "198.51.100.7/32"),
+    ("::ffff:198.51.100.0/120", "198.51.100.0/24"),
+    ("2001:db8:1::/48", "2001:db8:1::/48"),
+])
+def test_parse_network_normalises(cidr, expected):
+    assert str(parse_network(cidr)) == expected
+
+
+@pytest.mark.parametrize("cidr", ["10.0.0.0/7", "0.0.0.0/0", "2001:db8::/31", "::/0", "::ffff:10.0.0.0/100"])
+def test_parse_network_rejects_broad_prefixes(cidr):
+    with pytest.raises(ValueError, match="too broad"):
+        parse_network(cidr)
+
+
+def test_parse_address_unwraps_ipv4_mapped():
+    assert _parse_address("::ffff:198.51.100.7") == ipaddress.ip_address("198.51.100.7")
+    assert _parse_address("2001:db8::1") == ipaddress.ip_address("2001:db8::1")
+    assert _parse_address("unknown") is None
+
+
+def _trie(*rules):
+    trie = PrefixTrie()
+    for user_id, cidr, action, expires in rules:
+        trie.insert(parse_network(cidr), user_id, IPRule(len(cidr), action, cidr, expires))
+    return trie
+
+
+def _match(trie, ip, user_id=1, now=1000.0):
+    rule = trie.match(_parse_address(ip), user_id, now)
+    return rule.action if rule else None
+
+
+def test_longest_prefix_wins():
+    trie = _trie((1, "198.51.100.0/24", "block", None), (1, "198.51.100.7/32", "allow", None))
+
+    assert _match(trie, "198.51.100.7") == "allow"
+    assert _match(trie, "198.51.100.8") == "block"
+    assert _match(trie, "198.51.101.7") is None
+
+
+def test_ipv6_and_mapped_addresses():
+    trie = _trie((1, "2001:db8:1::/48", "block", None), (1, "::ffff:203.0.113.0/120", "block", None))
+
+    assert _match(trie, "2001:db8:1:2::1") == "block"
+    assert _match(trie, "2001:db8:2::1") is None
+    assert _match(trie, "::ffff:203.0.113.9") == "block"
+    assert _match(trie, "203.0.113.9") == "block"
+
+
+def test_expired_rule_falls_back_to_shorter_prefix():
+    trie = _trie((1, "198.51.100.0/24", "block", None), (1, "198.51.100.7/32", "allow", 999.0))
+
+    assert _match(trie, "198.51.100.7", now=998.0) == "allow"
+    assert _match(trie, "198.51.100.7", now=1000.0) == "block"
+
+
+def test_rules_are_per_owner():
+    trie = _trie((1, "198.51.100.0/24", "block", None), (2, "198.51.100.0/24", "allow", None))
+
+    assert _match(trie, "198.51.100.7", user_id=1) == "block"
+    assert _match(trie, "198.51.100.7", user_id=2) == "allow"
+    assert _match(trie, "198.51.100.7", user_id=3) is None
+    assert trie.size == 2
+
+
+@pytest.fixture
+def rules(app):
+    with app.app_context():
+        yield IPRuleList(refresh_interval=0)
+
+
+def test_add_check_remove(rules, make_link):
+    owner = make_link()["user_id"]
+    other = make_link()["user_id"]
+    block = rules.add(owner, "198.51.100.0/24", "block")
+    allow = rules.add(owner, "198.51.100.7", "allow")
+
+    assert rules.check(owner, "198.51.100.8").action == "block"
+    assert rules.check(owner, "198.51.100.7").action == "allow"
+    assert rules.check(other, "198.51.100.8") is None
+    assert not rules.remove(block.id, other)
+
+    assert rules.remove(allow.id, owner)
+    assert rules.check(owner, "198.51.100.7").action == "block"
+    assert rules.remove(block.id, owner)
+    assert rules.check(owner, "198.51.100.8") is None
+
+
+def test_rules_reload_from_database(rules, make_link):
+    owner = make_link()["user_id"]
+    rules.add(owner, "2001:db8:5::/48", "block")
+
+    fresh = IPRuleList(refresh_interval=0)
+    fresh.load()
+
+    assert fresh.check(owner, "2001:db8:5::1").action == "block"
+
+
+def test_expiring_rule(rules, make_link):
+    owner = make_link()["user_id"]
+    rules.add(owner, "203.0.113.0/24", "block", seconds=60)
+
+    assert rules.check(owner, "203.0.113.1").action == "block"
+    later = time.time() + 120
+    assert rules.check(owner, "203.0.113.1", now=later) is None
+    # Reloading drops the expired row
+    rules.load(now=later)
+    assert rules.trie.users.isdisjoint({owner})
+
+
+def test_remove_waits_for_a_refresh_in_progress(rules, make_link, monkeypatch):
+    owner = make_link()["user_id"]
+    rule = rules.add(owner, "198.51.100.0/24", "block")
+    stale = rules.trie
+    loading = threading.Event()
+    original_load = IPRuleList.load
+
+    def load(self, now=None):
+        if threading.current_thread() is threading.main_thread():
+            return original_load(self, now)
+        # A refresh that read the rules before the delete and installs its trie late
+        loading.set()
+        time.sleep(0.2)
+        with self._lock:
+            self.trie = stale
+        return stale.size
+
+    monkeypatch.setattr(IPRuleList, "load", load)
+    refresher = threading.Thread(target=rules.check, args=(owner, "198.51.100.1", time.time() + 1))
+    rules.refresh_interval = 1
+    refresher.start()
+    loading.wait(5)
+
+    assert rules.remove(rule.id, owner)
+    refresher.join(5)
+
+    rules.refresh_interval = 0
+    assert rules.check(owner, "198.51.100.1") is None
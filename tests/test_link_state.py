@@ -0,0 +1,63 @@
+"""
+Link state: the decay sweep covers never-visited links, and cached health does not outlive a state change
+"""
+
+import time
+from datetime import datetime, timedelta
+
+from database import connect_db
+from link_state import LinkHealth, LinkStateTracker
+
+
+def _set_link(link_id, **columns):
+    conn = connect_db()
+    try:
+        conn.execute(f"UPDATE links SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ?",
+                     [*columns.values(), link_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _state(link_id):
+    conn = connect_db()
+    try:
+        return conn.execute("SELECT state FROM links WHERE id = ?", [link_id]).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_sweep_decays_never_visited_links(app, make_link):
+    now = datetime.utcnow()
+    stale, decaying, fresh = make_link(), make_link(), make_link()
+    _set_link(stale["id"], created_at=(now - timedelta(days=60)).isoformat(), last_visit_at=None)
+    _set_link(decaying["id"], created_at=(now - timedelta(days=18)).isoformat(), last_visit_at=None)
+    tracker = LinkStateTracker(flush_interval=3600, sweep_interval=0)
+
+    assert tracker.sweep(now) >= 2
+
+    assert _state(stale["id"]) == "Inactive"
+    assert _state(decaying["id"]) == "Decaying"
+    assert _state(fresh["id"]) == "Active"
+
+
+def test_sweep_drops_cached_health(app, make_link):
+    now = datetime.utcnow()
+    link = make_link()
+    _set_link(link["id"], last_visit_at=(now - timedelta(days=60)).isoformat())
+    tracker = LinkStateTracker(flush_interval=3600, sweep_interval=0)
+    tracker.links.set(link["id"], LinkHealth())
+
+    tracker.sweep(now)
+
+    assert tracker.links.get(link["id"]) is None
+
+
+def test_cached_health_expires():
+    tracker = LinkStateTracker(flush_interval=3600, sweep_interval=0, ttl=0.05)
+    tracker.links.set(1, LinkHealth())
+    assert tracker.links.get(1) is not None
+
+    time.sleep(0.1)
+
+    assert tracker.links.get(1) is None
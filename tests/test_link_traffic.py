@@ -0,0 +1,110 @@
+"""
+Link traffic counters: ring-buffer windows seeded from visits, incremented in memory and re-seeded for other workers' visits
+"""
+
+import time
+from datetime import datetime
+
+import pytest
+
+from database import connect_db
+from link_traffic import LinkTrafficCounters
+from rate_limiter import SlidingWindow
+
+
+def test_sliding_window_drops_old_buckets():
+    window = SlidingWindow(6, 10)
+    window.add(1000.0)
+    window.add(1005.0, 2)
+    window.add(1031.0)
+
+    assert window.count(1031.0) == 4
+    assert window.recent(1031.0, 1) == 1
+    assert window.recent(1031.0, 3) == 1
+    assert window.recent(1031.0, 4) == 4
+    # 1000-1009 falls out of the 60 s window at 1060
+    assert window.count(1059.0) == 4
+    assert window.count(1060.0) == 1
+    # A gap longer than the window clears everything
+    assert window.count(2000.0) == 0
+
+
+def _insert_visits(link_id, *visits):
+    """visits: (epoch seconds, suspicious) pairs"""
+    conn = connect_db()
+    try:
+        for epoch, suspicious in visits:
+            conn.execute(
+                "INSERT INTO visits (link_id, session_id, ip_hash, user_agent, ts, ts_ms, behavior, target_url, "
+                "is_suspicious) VALUES (?, 's', 'h', 'Mozilla/5.0', ?, ?, 'Curious', 'https://example.com/', ?)",
+                [link_id, datetime.utcfromtimestamp(epoch).isoformat(), int(epoch * 1000), int(suspicious)],
+            )
+        conn.execute("UPDATE links SET last_visit_at = ? WHERE id = ?",
+                     [datetime.utcfromtimestamp(max(epoch for epoch, _ in visits)).isoformat(), link_id])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def traffic(app):
+    return LinkTrafficCounters(bucket_seconds=10, horizon_minutes=10, max_links=100, resync_interval=30)
+
+
+def test_counts_are_seeded_from_visits(traffic, make_link):
+    link = make_link()
+    now = time.time()
+    _insert_visits(link["id"], (now - 5, False), (now - 20, True), (now - 120, True), (now - 3600, True))
+
+    # Last minute: 2 requests; last 5 minutes: 2 suspicious (the hour-old visit is past the horizon)
+    assert traffic.counts(link["id"], 5, now) == (2, 2)
+    assert traffic.counts(link["id"], 1, now) == (2, 1)
+    assert traffic.get_stats()["seeded"] == 1
+
+
+def test_recorded_visits_are_counted_without_sql(traffic, make_link):
+    link = make_link()
+    now = time.time()
+    traffic.counts(link["id"], 5, now)
+
+    traffic.add(link["id"], now, suspicious=True)
+    traffic.add(link["id"], now, suspicious=False)
+    traffic.add_bot(link["id"], now)
+
+    assert traffic.counts(link["id"], 5, now) == (3, 1)
+    assert traffic.get_stats()["seeded"] == 1
+
+
+def test_untracked_link_is_seeded_on_read(traffic, make_link):
+    link = make_link()
+    now = time.time()
+    traffic.add(link["id"], now, suspicious=True)
+    _insert_visits(link["id"], (now, True))
+
+    # The add was dropped; the visit is counted once, from the table
+    assert traffic.counts(link["id"], 5, now) == (1, 1)
+
+
+def test_resync_picks_up_other_workers_visits(traffic, make_link):
+    link = make_link()
+    now = time.time()
+    _insert_visits(link["id"], (now - 5, False))
+    assert traffic.counts(link["id"], 5, now) == (1, 0)
+
+    # Recorded by another process: invisible until the entry is re-seeded
+    _insert_visits(link["id"], (now - 1, True))
+    assert traffic.counts(link["id"], 5, now + 10) == (1, 0)
+    assert traffic.counts(link["id"], 5, now + 30) == (2, 1)
+    assert traffic.get_stats()["seeded"] == 2
+
+
+def test_rebuild_loads_recently_visited_links(traffic, make_link):
+    recent, idle = make_link(), make_link()
+    now = time.time()
+    _insert_visits(recent["id"], (now - 30, True))
+    _insert_visits(idle["id"], (now - 3600, True))
+
+    assert traffic.rebuild(now) >= 1
+    assert recent["id"] in traffic.links
+    assert idle["id"] not in traffic.links
+    assert traffic.counts(recent["id"], 5, now) == (1, 1)
@@ -0,0 +1,117 @@
+"""
+IP lookups: concurrent requests for one IP share a single provider fetch, and every visit field comes from it
+"""
+
+import threading
+import time
+
+import pytest
+
+import utils
+from cache import SingleFlight
+
+IP = "203.0.113.40"
+FOUND = {"status": "success", "country": "India", "city": "Ahmedabad", "regionName": "Gujarat",
+         "lat": 23.0225, "lon": 72.5714, "timezone": "Asia/Kolkata", "isp": "Reliance Jio Infocomm Ltd",
+         "org": "Jio"}
+
+
+def _concurrently(fn, n=8):
+    results = [None] * n
+    start = threading.Barrier(n)
+
+    def run(i):
+        start.wait()
+        results[i] = fn()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        time.sleep(0.2)
+        return object()
+
+    results = _concurrently(lambda: flight.do("key", fetch))
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.coalesced == 7
+    # Once finished the key is free again
+    flight.do("key", fetch)
+    assert len(calls) == 2
+
+
+def test_single_flight_shares_the_error():
+    flight = SingleFlight()
+
+    def fetch():
+        time.sleep(0.2)
+        raise RuntimeError("provider down")
+
+    def call():
+        try:
+            flight.do("key", fetch)
+        except RuntimeError as e:
+            return str(e)
+
+    assert _concurrently(call, n=4) == ["provider down"] * 4
+    assert flight.coalesced == 3
+
+
+def test_single_flight_keys_are_independent():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.coalesced == 0
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    calls = []
+
+    def get_api_location(ip):
+        calls.append(ip)
+        time.sleep(0.2)
+        return FOUND
+
+    monkeypatch.setattr(utils, "get_api_location", get_api_location)
+    monkeypatch.setattr(utils, "reverse_dns", lambda ip: "host.example.net")
+    monkeypatch.setattr(utils, "_ip_lookups", SingleFlight())
+    return calls
+
+
+def test_concurrent_lookups_fetch_once(provider):
+    results = _concurrently(lambda: utils.lookup_ip(IP))
+
+    assert provider == [IP]
+    assert all(result is results[0] for result in results)
+    assert utils._ip_lookups.coalesced == 7
+
+
+def test_enrich_ip_reads_one_lookup(provider):
+    fields = utils.enrich_ip(IP)
+
+    assert provider == [IP]
+    assert fields == {
+        "region": "Ahmedabad, India", "country": "India", "city": "Ahmedabad",
+        "latitude": 23.0225, "longitude": 72.5714, "timezone": "Asia/Kolkata",
+        "isp": "Reliance Jio", "hostname": "host.example.net", "org": "Jio",
+    }
+
+
+def test_private_address_skips_the_provider(provider):
+    intel = utils.lookup_ip("10.1.2.3")
+
+    assert provider == []
+    assert intel.region == "Local/Private"
+    assert intel.isp_info == {"isp": "Local Network", "hostname": "localhost", "org": "Unknown"}
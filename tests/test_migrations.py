@@ -0,0 +1,93 @@
+"""
+Migrations: a fresh database reaches the latest schema, the hot queries use an index, and backfills run in batches
+"""
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from config import DATABASE
+from database import epoch_ms
+from migrations import HOT_QUERIES, MIGRATIONS, _epoch_ms_sql, backfill_in_batches, check_query_plans, run_migrations, schema_version
+
+
+def test_fresh_database_reaches_latest_version(app):
+    # App startup already migrated the throwaway database; a second run has nothing left to do
+    assert run_migrations(DATABASE) == []
+
+    conn = sqlite3.connect(DATABASE)
+    try:
+        assert schema_version(conn) == MIGRATIONS[-1][0]
+    finally:
+        conn.close()
+
+
+def test_hot_queries_use_an_index(app):
+    conn = sqlite3.connect(DATABASE)
+    try:
+        results = check_query_plans(conn)
+    finally:
+        conn.close()
+
+    assert [name for name, _, _ in results] == [name for name, _, _ in HOT_QUERIES]
+    scans = {name: plan for name, plan, uses_index in results if not uses_index}
+    assert scans == {}
+
+
+def test_backfill_in_batches_covers_every_row(tmp_path):
+    conn = sqlite3.connect(tmp_path / "backfill.db")
+    try:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER, doubled INTEGER)")
+        conn.executemany("INSERT INTO items (value) VALUES (?)", [(i,) for i in range(30)])
+        # Gaps in the rowid range must not cost any rows
+        conn.execute("DELETE FROM items WHERE id IN (3, 8, 9, 15, 16)")
+        conn.commit()
+
+        updated = backfill_in_batches(conn, "items", "doubled = value * 2", where="doubled IS NULL", batch_size=7)
+
+        assert updated == 25
+        assert conn.execute("SELECT COUNT(*) FROM items WHERE doubled IS NULL").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM items WHERE doubled != value * 2").fetchone()[0] == 0
+        # Idempotent: a re-run finds nothing left to update
+        assert backfill_in_batches(conn, "items", "doubled = value * 2", where="doubled IS NULL", batch_size=7) == 0
+    finally:
+        conn.close()
+
+
+def test_backfill_in_batches_empty_table(tmp_path):
+    conn = sqlite3.connect(tmp_path / "empty.db")
+    try:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)")
+        assert backfill_in_batches(conn, "items", "value = 1", batch_size=7) == 0
+    finally:
+        conn.close()
+
+
+def test_backfill_commits_between_batches(tmp_path):
+    conn = sqlite3.connect(tmp_path / "batches.db")
+    try:
+        conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, value INTEGER)")
+        conn.executemany("INSERT INTO items (value) VALUES (?)", [(i,) for i in range(30)])
+        conn.commit()
+        statements = []
+        conn.set_trace_callback(lambda statement: statements.append(statement.split()[0]))
+
+        backfill_in_batches(conn, "items", "value = value + 1", batch_size=7)
+
+        # One short transaction per rowid range, so the write lock is released between batches
+        assert [s for s in statements if s != "SELECT"] == ["BEGIN", "UPDATE", "COMMIT"] * 5
+        assert not conn.in_transaction
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("stored", ["2024-01-02T03:04:05.678901", "2024-01-02 03:04:05", "2024-01-02T03:04:05"])
+def test_ts_ms_backfill_matches_epoch_ms(stored):
+    conn = sqlite3.connect(":memory:")
+    try:
+        ts_ms = conn.execute(f"SELECT {_epoch_ms_sql(':ts')}", {"ts": stored}).fetchone()[0]
+    finally:
+        conn.close()
+
+    assert ts_ms == epoch_ms(datetime.fromisoformat(stored))
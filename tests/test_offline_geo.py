@@ -0,0 +1,113 @@
+"""
+Offline geolocation: CSV ranges compiled into the binary index and looked up by binary search over the memory map
+"""
+
+import os
+
+import pytest
+
+import config
+import utils
+from offline_geo import OfflineGeoIndex, build_index, get_offline_index, offline_lookup
+
+ROWS = (
+    "8.8.4.0,8.8.4.255,United States,California,Mountain View,37.386,-122.0838,America/Los_Angeles,Google LLC",
+    "1.1.1.0,1.1.1.255,Australia,Queensland,Brisbane,-27.4679,153.0281,Australia/Brisbane,Cloudflare",
+    "81.2.69.142,81.2.69.142,United Kingdom,England,London,51.5142,-0.0931,Europe/London,",
+    "2606:4700::,2606:4700:ffff:ffff:ffff:ffff:ffff:ffff,United States,California,San Francisco,37.7621,"
+    "-122.3971,America/Los_Angeles,Cloudflare",
+    "2a00:1450::,2a00:1450::ffff,Ireland,Leinster,Dublin,,,Europe/Dublin,Google LLC",
+)
+
+
+@pytest.fixture
+def index(tmp_path):
+    csv_path = tmp_path / "ranges.csv"
+    csv_path.write_text("start,end,country,region,city,lat,lon,tz,isp\n" + "\n".join(ROWS) + "\n", encoding="utf-8")
+    counts = build_index(str(csv_path), str(tmp_path / "ranges.bin"))
+    assert counts["ipv4_ranges"] == 3
+    assert counts["ipv6_ranges"] == 2
+    index = OfflineGeoIndex(str(tmp_path / "ranges.bin"))
+    yield index
+    index.close()
+
+
+def test_ipv4_hit(index):
+    location = index.lookup("8.8.4.4")
+
+    assert location["status"] == "success"
+    assert (location["country"], location["regionName"], location["city"]) == \
+        ("United States", "California", "Mountain View")
+    assert (location["lat"], location["lon"]) == (37.386, -122.0838)
+    assert location["timezone"] == "America/Los_Angeles"
+    assert location["isp"] == "Google LLC"
+
+
+def test_ipv6_hit(index):
+    assert index.lookup("2606:4700::1111")["city"] == "San Francisco"
+    assert index.lookup("2a00:1450::1")["city"] == "Dublin"
+
+
+def test_ipv4_mapped_ipv6_uses_ipv4_ranges(index):
+    assert index.lookup("::ffff:1.1.1.1")["city"] == "Brisbane"
+
+
+@pytest.mark.parametrize("ip", ["8.8.3.255", "8.8.5.0", "1.1.0.255", "9.9.9.9", "0.0.0.1", "255.255.255.255",
+                                "2606:46ff:ffff:ffff:ffff:ffff:ffff:ffff", "2a00:1450::1:0", "::1", "not-an-ip"])
+def test_miss(index, ip):
+    assert index.lookup(ip) is None
+
+
+@pytest.mark.parametrize("ip, city", [
+    ("8.8.4.0", "Mountain View"), ("8.8.4.255", "Mountain View"),
+    ("1.1.1.0", "Brisbane"), ("1.1.1.255", "Brisbane"),
+    ("81.2.69.142", "London"),
+    ("2606:4700::", "San Francisco"), ("2606:4700:ffff:ffff:ffff:ffff:ffff:ffff", "San Francisco"),
+    ("2a00:1450::", "Dublin"), ("2a00:1450::ffff", "Dublin"),
+])
+def test_range_edges_are_inclusive(index, ip, city):
+    assert index.lookup(ip)["city"] == city
+
+
+def test_missing_fields(index):
+    location = index.lookup("81.2.69.142")
+    assert location["isp"] is None
+
+    location = index.lookup("2a00:1450::1")
+    assert (location["lat"], location["lon"]) == (None, None)
+
+
+def test_invalid_range_is_rejected(tmp_path):
+    csv_path = tmp_path / "bad.csv"
+    csv_path.write_text("start,end,country,region,city,lat,lon,tz,isp\n8.8.8.9,8.8.8.1,X,,,,,,\n", encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        build_index(str(csv_path), str(tmp_path / "bad.bin"))
+
+
+def test_index_is_built_from_configured_csv(offline_geo_csv):
+    offline_geo_csv(*ROWS)
+
+    assert get_offline_index() is not None
+    assert offline_lookup("1.1.1.1")["city"] == "Brisbane"
+    assert offline_lookup("9.9.9.9") is None
+
+
+def test_get_api_location_resolves_offline(offline_geo_csv, monkeypatch):
+    offline_geo_csv(*ROWS)
+    monkeypatch.setattr(utils.requests, "get", lambda *a, **k: pytest.fail("offline hit went online"))
+
+    location = utils.get_api_location("2606:4700::6810:85e5")
+
+    assert (location["status"], location["city"], location["source"]) == ("success", "San Francisco", "offline")
+    # Not covered offline, and the online fallback is disabled in tests
+    assert utils.get_api_location("9.9.9.9") == {"status": "fail"}
+
+
+def test_bundled_sample_resolves_end_to_end(offline_geo_csv, monkeypatch):
+    sample = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "ip_ranges_sample.csv")
+    monkeypatch.setattr(config, "OFFLINE_GEO_CSV", sample)
+
+    assert utils.get_api_location("192.0.2.10")["city"] == "Ahmedabad"
+    assert utils.get_api_location("198.51.100.200")["city"] == "London"
+    assert utils.get_api_location("2001:db8::1")["city"] == "Frankfurt am Main"
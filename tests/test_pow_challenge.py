@@ -0,0 +1,134 @@
+"""
+Proof-of-work: signed challenges and pass cookies, and the challenge / verify round trip of a level 3 link
+"""
+
+import hashlib
+import re
+from itertools import count
+
+import pytest
+
+import pow_challenge
+from pow_challenge import PASS_COOKIE, ProofOfWork
+
+IP = "198.51.100.30"
+BROWSER_UA = "Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0"
+
+
+@pytest.fixture(autouse=True)
+def easy_puzzles(monkeypatch):
+    monkeypatch.setattr(pow_challenge, "POW_BASE_BITS", 6)
+
+
+def _solves(challenge: str, nonce: int, bits: int) -> bool:
+    digest = hashlib.sha256(f"{challenge}:{nonce}".encode()).digest()
+    return not int.from_bytes(digest[:4], "big") >> (32 - bits)
+
+
+def solve(challenge: str, bits: int) -> str:
+    return str(next(n for n in count() if _solves(challenge, n, bits)))
+
+
+def _tamper(token: str) -> str:
+    payload, _, signature = token.rpartition(".")
+    return f"{payload}.{'0' if signature[0] != '0' else '1'}{signature[1:]}"
+
+
+def test_solved_challenge_verifies():
+    pow_ = ProofOfWork("secret")
+    challenge, bits = pow_.new_challenge(7, 3, IP, now=1000.0)
+
+    assert bits == 6
+    assert pow_.check_solution(challenge, solve(challenge, bits), 7, IP, now=1001.0)
+    assert pow_.get_stats()["solved"] == 1
+
+
+def test_difficulty_grows_with_level():
+    assert ProofOfWork.difficulty(3) == 6
+    assert ProofOfWork.difficulty(5) == 6 + 2 * pow_challenge.POW_BITS_PER_LEVEL
+    assert ProofOfWork.difficulty(100) == pow_challenge.MAX_BITS
+
+
+def test_wrong_nonce_is_rejected():
+    pow_ = ProofOfWork("secret")
+    challenge, bits = pow_.new_challenge(7, 3, IP, now=1000.0)
+    nonce = solve(challenge, bits)
+    wrong = str(next(n for n in count() if not _solves(challenge, n, bits)))
+
+    assert not pow_.check_solution(challenge, wrong, 7, IP, now=1001.0)
+    assert not pow_.check_solution(challenge, "", 7, IP, now=1001.0)
+    assert not pow_.check_solution(challenge, "x" + nonce, 7, IP, now=1001.0)
+
+
+def test_tampered_expired_or_misdirected_challenge_is_rejected():
+    pow_ = ProofOfWork("secret")
+    challenge, bits = pow_.new_challenge(7, 3, IP, now=1000.0)
+    nonce = solve(challenge, bits)
+
+    assert not pow_.check_solution(_tamper(challenge), nonce, 7, IP, now=1001.0)
+    # An easier difficulty edited into the payload breaks the signature
+    assert not pow_.check_solution(challenge.replace(":6:", ":1:", 1), nonce, 7, IP, now=1001.0)
+    assert not pow_.check_solution(challenge, nonce, 8, IP, now=1001.0)
+    assert not pow_.check_solution(challenge, nonce, 7, "198.51.100.31", now=1001.0)
+    assert not pow_.check_solution(challenge, nonce, 7, IP, now=1000.0 + pow_challenge.POW_CHALLENGE_SECONDS + 1)
+    assert not ProofOfWork("other secret").check_solution(challenge, nonce, 7, IP, now=1001.0)
+    assert not pow_.check_solution("garbage", nonce, 7, IP, now=1001.0)
+
+
+def test_pass_cookie():
+    pow_ = ProofOfWork("secret")
+    token = pow_.issue_pass(7, IP, now=1000.0)
+
+    assert pow_.verify_pass(token, 7, IP, now=1001.0)
+    # Replayed from another address, for another link, after expiry, tampered or missing
+    assert not pow_.verify_pass(token, 7, "203.0.113.1", now=1001.0)
+    assert not pow_.verify_pass(token, 8, IP, now=1001.0)
+    assert not pow_.verify_pass(token, 7, IP, now=1000.0 + pow_challenge.POW_PASS_SECONDS + 1)
+    assert not pow_.verify_pass(_tamper(token), 7, IP, now=1001.0)
+    assert not pow_.verify_pass(token.replace("7:", "7:9", 1), 7, IP, now=1001.0)
+    assert not pow_.verify_pass(None, 7, IP)
+    assert not pow_.verify_pass("garbage", 7, IP)
+
+
+@pytest.fixture
+def protected_link(app, make_link):
+    from ddos_protection import ddos_protection
+    from fast_reject import fast_reject
+
+    link = make_link()
+    with app.test_request_context("/", headers={"User-Agent": BROWSER_UA}):
+        ddos_protection.apply_protection(link["id"], 3, "moderate_suspicious_activity")
+    yield link
+    fast_reject.clear()
+
+
+def test_verify_route_sets_pass_cookie(client, protected_link):
+    headers = {"User-Agent": BROWSER_UA, "X-Forwarded-For": IP}
+    page = client.get(f"/r/{protected_link['code']}", headers=headers)
+    assert page.status_code == 403
+    challenge = re.search(rb'value="([^"]+\.[0-9a-f]{64})"', page.data).group(1).decode()
+    bits = int(challenge.split(":")[1])
+
+    response = client.post(f"/r/{protected_link['code']}/verify", headers=headers,
+                           data={"challenge": challenge, "nonce": solve(challenge, bits)})
+
+    assert response.status_code == 303
+    assert response.location.endswith(f"/r/{protected_link['code']}")
+    cookie = client.get_cookie(PASS_COOKIE, path=f"/r/{protected_link['code']}")
+    assert cookie is not None and cookie.http_only
+    # With the pass the link redirects; the same cookie from another address gets a challenge
+    assert client.get(f"/r/{protected_link['code']}", headers=headers).status_code == 302
+    other = {"User-Agent": BROWSER_UA, "X-Forwarded-For": "203.0.113.31"}
+    assert client.get(f"/r/{protected_link['code']}", headers=other).status_code == 403
+
+
+def test_verify_route_rejects_wrong_solution(client, protected_link):
+    headers = {"User-Agent": BROWSER_UA, "X-Forwarded-For": IP}
+    page = client.get(f"/r/{protected_link['code']}", headers=headers)
+    challenge = re.search(rb'value="([^"]+\.[0-9a-f]{64})"', page.data).group(1).decode()
+
+    response = client.post(f"/r/{protected_link['code']}/verify", headers=headers,
+                           data={"challenge": _tamper(challenge), "nonce": "1"})
+
+    assert response.status_code == 303
+    assert client.get_cookie(PASS_COOKIE, path=f"/r/{protected_link['code']}") is None
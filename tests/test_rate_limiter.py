@@ -0,0 +1,210 @@
+"""
+Rate limiter: per-process sliding windows, and node-wide consistency of the shared backends across processes
+"""
+
+import math
+import multiprocessing
+import threading
+import time
+import uuid
+
+import pytest
+
+from rate_limiter import RateLimiter, SharedMemoryRateLimiter, SqliteRateLimiter, fcntl
+
+LIMIT = 50
+RULES = {"requests_per_ip_per_minute": LIMIT, "requests_per_ip_per_hour": 100000, "burst_threshold": 100000}
+WORKERS = 4
+REQUESTS_PER_WORKER = 100
+REQUEST_GAP_SECONDS = 0.02
+SYNC_SECONDS = 0.05
+
+# A request is turned away once its window already holds more than the limit, so limit + 1 get in
+MAX_ADMITTED = LIMIT + 1
+
+
+def _worker(backend, name, link_id, barrier, results):
+    if backend == "shm":
+        limiter = SharedMemoryRateLimiter(name=name, slots=1024)
+    else:
+        limiter = SqliteRateLimiter(interval=SYNC_SECONDS)
+    barrier.wait()
+    admitted = 0
+    for _ in range(REQUESTS_PER_WORKER):
+        if limiter.check("203.0.113.9", link_id, RULES) == "allowed":
+            admitted += 1
+        time.sleep(REQUEST_GAP_SECONDS)
+    limiter.shutdown()
+    results.put(admitted)
+
+
+def _run_workers(backend, name=None, link_id=None):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(WORKERS)
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_worker, args=(backend, name, link_id, barrier, results)) for _ in range(WORKERS)]
+    for p in processes:
+        p.start()
+    admitted = [results.get(timeout=60) for _ in processes]
+    for p in processes:
+        p.join(timeout=10)
+        assert p.exitcode == 0
+    return sum(admitted)
+
+
+def test_local_limiter_sliding_window():
+    limiter = RateLimiter()
+    statuses = [limiter.check("203.0.113.1", 1, RULES, now=1000.0 + i * 0.1) for i in range(60)]
+    assert statuses.count("allowed") == MAX_ADMITTED
+    assert statuses[-1] == "rate_limited"
+    # The first requests have left the minute window
+    assert limiter.check("203.0.113.1", 1, RULES, now=1061.0) == "allowed"
+
+
+def test_local_limiter_hourly_and_burst_limits():
+    rules = {"requests_per_ip_per_minute": 1000, "requests_per_ip_per_hour": 5, "burst_threshold": 1000}
+    limiter = RateLimiter()
+    statuses = [limiter.check("203.0.113.2", 1, rules, now=1000.0 + i * 60) for i in range(8)]
+    assert statuses == ["allowed"] * 6 + ["hourly_rate_limited"] * 2
+
+    rules = {"requests_per_ip_per_minute": 1000, "requests_per_ip_per_hour": 1000, "burst_threshold": 3}
+    statuses = [limiter.check("203.0.113.3", 1, rules, now=1000.0 + i * 0.5) for i in range(6)]
+    assert statuses == ["allowed"] * 4 + ["burst_attack"] * 2
+    # The 10 second burst window has moved on; the minute window still holds the admitted requests
+    assert limiter.check("203.0.113.3", 1, rules, now=1012.0) == "allowed"
+
+
+def test_local_limiter_does_not_count_rejected_requests():
+    limiter = RateLimiter()
+    for i in range(200):
+        limiter.check("203.0.113.4", 1, RULES, now=1000.0 + i * 0.1)
+    # Only the admitted requests age out, so the key is free again one minute after the first of them
+    assert limiter.check("203.0.113.4", 1, RULES, now=1060.5) == "allowed"
+    assert limiter.get_stats()["allowed"] == MAX_ADMITTED + 1
+
+
+def test_local_limiter_is_shared_by_threads():
+    limiter = RateLimiter()
+    statuses = []
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        for _ in range(20):
+            statuses.append(limiter.check("203.0.113.5", 1, RULES))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert statuses.count("allowed") == MAX_ADMITTED
+
+
+def test_local_limiter_keys_are_per_link():
+    limiter = RateLimiter()
+    for i in range(60):
+        limiter.check("203.0.113.6", 1, RULES, now=1000.0 + i * 0.1)
+    assert limiter.check("203.0.113.6", 1, RULES, now=1006.0) == "rate_limited"
+    assert limiter.check("203.0.113.6", 2, RULES, now=1006.0) == "allowed"
+
+    limiter.reset(link_id=1)
+    assert limiter.check("203.0.113.6", 1, RULES, now=1006.0) == "allowed"
+    assert limiter.get_stats()["tracked_keys"] == 2
+
+
+def test_local_limiter_evicts_coldest_key():
+    limiter = RateLimiter(max_keys=2)
+    for i, ip in enumerate(("a", "b", "c")):
+        limiter.check(ip, 1, RULES, now=1000.0 + i)
+    assert limiter.get_stats()["tracked_keys"] == 2
+    assert limiter.get_stats()["evictions"] == 1
+
+
+def test_local_limiter_eviction_follows_last_seen_order():
+    limiter = RateLimiter(max_keys=2)
+    limiter.check("a", 1, RULES, now=1000.0)
+    limiter.check("b", 1, RULES, now=1001.0)
+    # Seeing "a" again makes "b" the coldest key
+    limiter.check("a", 1, RULES, now=1002.0)
+    limiter.check("c", 1, RULES, now=1003.0)
+
+    assert list(limiter._counters) == [("a", 1), ("c", 1)]
+
+
+def test_local_limiter_expires_idle_keys():
+    limiter = RateLimiter(idle_seconds=3600)
+    limiter.check("a", 1, RULES, now=1000.0)
+    limiter.check("b", 1, RULES, now=2000.0)
+    limiter.check("a", 2, RULES, now=3000.0)
+
+    # Only the keys idle for longer than idle_seconds are dropped, oldest first
+    limiter.check("c", 1, RULES, now=4700.0)
+    assert list(limiter._counters) == [("b", 1), ("a", 2), ("c", 1)]
+    assert limiter.get_stats()["expired"] == 1
+
+    limiter.check("c", 1, RULES, now=7000.0)
+    assert list(limiter._counters) == [("c", 1)]
+    assert limiter.get_stats()["expired"] == 3
+
+
+@pytest.mark.skipif(fcntl is None, reason="the shared memory backend needs fcntl")
+def test_shared_memory_limit_holds_across_processes():
+    from multiprocessing import shared_memory
+
+    name = f"sl_test_{uuid.uuid4().hex[:12]}"
+    try:
+        admitted = _run_workers("shm", name=name)
+    finally:
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+            segment.close()
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+    assert admitted <= MAX_ADMITTED
+    assert admitted >= LIMIT
+
+
+def test_sqlite_limit_holds_within_two_sync_intervals(app):
+    link_id = 900000 + uuid.uuid4().int % 100000
+    admitted = _run_workers("sqlite", link_id=link_id)
+
+    # Documented bound: other workers' traffic shows up within two sync intervals of theirs
+    per_interval = math.ceil(SYNC_SECONDS / REQUEST_GAP_SECONDS)
+    assert admitted <= MAX_ADMITTED + WORKERS * 2 * per_interval
+    assert admitted >= LIMIT
+    # Per-process counters would have let every worker through to the limit
+    assert admitted < WORKERS * MAX_ADMITTED
+
+
+def test_sqlite_limiter_key_ceiling(app):
+    limiter = SqliteRateLimiter(interval=3600, max_keys=3)
+    link_id = 900000 + uuid.uuid4().int % 100000
+    # An IP-rotating flood: every request from a new address
+    for i in range(100):
+        limiter.check(f"198.51.100.{i}", link_id, RULES, now=1000.0 + i * 0.01)
+    stats = limiter.get_stats()
+    assert stats["tracked_keys"] == 3
+    assert stats["evictions"] == 97
+    assert stats["pending_keys"] <= 3 * 3
+
+    limiter.flush()
+    assert limiter.get_stats()["tracked_windows"] <= 3 * 3
+    limiter.reset(link_id)
+
+
+def test_sqlite_limiter_evicts_coldest_pair(app):
+    limiter = SqliteRateLimiter(interval=3600, max_keys=2)
+    link_id = 900000 + uuid.uuid4().int % 100000
+    for _ in range(LIMIT + 1):
+        limiter.check("203.0.113.1", link_id, RULES, now=1000.0)
+    limiter.check("203.0.113.2", link_id, RULES, now=1000.0)
+    # Keeps the limited IP the most recently seen, so the newcomer evicts 203.0.113.2
+    assert limiter.check("203.0.113.1", link_id, RULES, now=1000.0) == "rate_limited"
+    limiter.check("203.0.113.3", link_id, RULES, now=1000.0)
+
+    assert limiter.check("203.0.113.1", link_id, RULES, now=1000.0) == "rate_limited"
+    assert limiter.get_stats()["evictions"] == 1
+    limiter.reset(link_id)
@@ -0,0 +1,63 @@
+"""
+Referrer classification: query-param sources, in-app browsers and the longest-suffix match on the Referer host
+"""
+
+import pytest
+
+from referrer import NO_REFERRER, DomainSuffixTrie, classify_referrer_url, resolve_referrer, source_for_host
+
+
+def test_trie_matches_whole_labels_and_longest_suffix():
+    trie = DomainSuffixTrie([("example.com", "Example"), ("mail.example.com", "Mail")])
+
+    assert trie.lookup("example.com") == "Example"
+    assert trie.lookup("www.example.com") == "Example"
+    assert trie.lookup("inbox.mail.example.com") == "Mail"
+    assert trie.lookup("notexample.com") is None
+    assert trie.lookup("example.org") is None
+    assert trie.lookup("com") is None
+
+
+@pytest.mark.parametrize("host, source", [
+    ("l.facebook.com", "Facebook"),
+    ("lm.facebook.com", "Facebook"),
+    ("web.whatsapp.com", "WhatsApp"),
+    ("t.co", "Twitter"),
+    ("x.com", "Twitter"),
+    ("mail.google.com", "Gmail"),
+    ("www.google.com", "Google"),
+    ("www.google.de", "Google"),
+    ("www.google.co.in", "Google"),
+    ("WWW.LinkedIn.com.", "LinkedIn"),
+])
+def test_known_hosts(host, source):
+    assert source_for_host(host) == source
+
+
+@pytest.mark.parametrize("host", ["notfacebook.com", "facebook.com.evil.example", "google", "co.in", "", None])
+def test_unknown_hosts(host):
+    assert source_for_host(host) is None
+
+
+def test_classify_referrer_url():
+    assert classify_referrer_url("https://l.facebook.com/l.php?u=x") == "Facebook"
+    assert classify_referrer_url("https://blog.example.org/post") == "https://blog.example.org/post"
+    assert classify_referrer_url("https://links.example.net/dashboard", own_host="links.example.net") == NO_REFERRER
+    assert classify_referrer_url(None) == NO_REFERRER
+    assert classify_referrer_url(NO_REFERRER) == NO_REFERRER
+    assert classify_referrer_url("not a url") == NO_REFERRER
+
+
+def test_resolve_referrer_priority():
+    referer = "https://t.co/abc"
+
+    assert resolve_referrer({"utm_source": "newsletter"}, "Instagram", referer, "links.example.net") == "newsletter"
+    # ref wins over source and utm_source
+    assert resolve_referrer({"utm_source": "newsletter", "ref": "pdf"}, None, referer, "links.example.net") == "pdf"
+    assert resolve_referrer({}, "Instagram", referer, "links.example.net") == "Instagram"
+    assert resolve_referrer({}, None, referer, "links.example.net") == "Twitter"
+    assert resolve_referrer({}, None, None, "links.example.net") == NO_REFERRER
+
+
+def test_own_host_port_is_ignored():
+    assert resolve_referrer({}, None, "http://links.example.net/dashboard", "Links.Example.Net:8080") == NO_REFERRER
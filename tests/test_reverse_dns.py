@@ -0,0 +1,115 @@
+"""
+Reverse DNS: callers wait at most the deadline, and answers (including "no PTR record") are cached
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import reverse_dns as reverse_dns_module
+from reverse_dns import ReverseDNSResolver
+
+
+@pytest.fixture
+def ptr(monkeypatch):
+    """Fake PTR lookups: records maps IP to hostname, release unblocks lookups of IPs in slow"""
+    fake = SimpleNamespace(records={}, slow=set(), release=threading.Event(), calls=[])
+
+    def gethostbyaddr(ip):
+        fake.calls.append(ip)
+        if ip in fake.slow:
+            fake.release.wait(5)
+        return fake.records.get(ip)
+
+    monkeypatch.setattr(reverse_dns_module, "_gethostbyaddr", gethostbyaddr)
+    yield fake
+    fake.release.set()
+
+
+@pytest.fixture
+def resolver():
+    resolver = ReverseDNSResolver(workers=2, timeout=0.5, max_pending=2, ttl=60, negative_ttl=60)
+    yield resolver
+    resolver.shutdown()
+
+
+def _wait_cached(resolver, ip):
+    deadline = time.monotonic() + 5
+    while resolver.cache.get(ip) is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_hostname_is_cached(ptr, resolver):
+    ptr.records["198.51.100.1"] = "host-1.example.net"
+
+    assert resolver.resolve("198.51.100.1") == "host-1.example.net"
+    _wait_cached(resolver, "198.51.100.1")
+    assert resolver.resolve("198.51.100.1") == "host-1.example.net"
+    assert ptr.calls == ["198.51.100.1"]
+
+
+def test_missing_record_is_negatively_cached(ptr, resolver):
+    assert resolver.resolve("198.51.100.2") is None
+    _wait_cached(resolver, "198.51.100.2")
+    assert resolver.resolve("198.51.100.2") is None
+    assert ptr.calls == ["198.51.100.2"]
+
+
+def test_negative_entry_expires_first(ptr):
+    resolver = ReverseDNSResolver(workers=1, timeout=0.5, ttl=60, negative_ttl=0.05)
+    try:
+        assert resolver.resolve("198.51.100.3") is None
+        time.sleep(0.1)
+        ptr.records["198.51.100.3"] = "host-3.example.net"
+        assert resolver.resolve("198.51.100.3") == "host-3.example.net"
+        assert resolver.lookups == 2
+    finally:
+        resolver.shutdown()
+
+
+def test_slow_lookup_gives_up_at_deadline_and_fills_cache_later(ptr):
+    resolver = ReverseDNSResolver(workers=1, timeout=0.05)
+    try:
+        ptr.records["198.51.100.4"] = "slow.example.net"
+        ptr.slow.add("198.51.100.4")
+
+        started = time.monotonic()
+        assert resolver.resolve("198.51.100.4") is None
+        assert time.monotonic() - started < 0.5
+        assert resolver.get_stats()["timeouts"] == 1
+
+        ptr.release.set()
+        _wait_cached(resolver, "198.51.100.4")
+        assert resolver.resolve("198.51.100.4") == "slow.example.net"
+        assert ptr.calls == ["198.51.100.4"]
+    finally:
+        resolver.shutdown()
+
+
+def test_concurrent_callers_share_one_lookup(ptr, resolver):
+    ptr.records["198.51.100.5"] = "host-5.example.net"
+    ptr.slow.add("198.51.100.5")
+    results = []
+    callers = [threading.Thread(target=lambda: results.append(resolver.resolve("198.51.100.5"))) for _ in range(4)]
+    for t in callers:
+        t.start()
+    time.sleep(0.1)
+    ptr.release.set()
+    for t in callers:
+        t.join(5)
+
+    assert results == ["host-5.example.net"] * 4
+    assert resolver.lookups == 1
+
+
+def test_saturated_resolver_rejects_new_lookups(ptr, resolver):
+    ptr.slow.update({"198.51.100.6", "198.51.100.7"})
+    resolver.timeout = 0.01
+    resolver.resolve("198.51.100.6")
+    resolver.resolve("198.51.100.7")
+
+    assert resolver.resolve("198.51.100.8") is None
+    assert resolver.get_stats()["rejected"] == 1
+    assert "198.51.100.8" not in ptr.calls
@@ -0,0 +1,69 @@
+"""
+User-Agent classification: device, browser and OS with versions, bot flag and in-app source from one memoized pass
+"""
+
+import pytest
+
+import utils
+from utils import classify_user_agent, detect_device, parse_browser, parse_os
+
+EDGE = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/120.0.0.0 Safari/537.36 Edg/120.0.2210.91")
+CHROME = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+          "Chrome/120.0.0.0 Safari/537.36")
+SAFARI = ("Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+          "Version/17.1 Safari/605.1.15")
+ANDROID = ("Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) "
+           "Chrome/120.0.6099.144 Mobile Safari/537.36")
+FIREFOX = "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:121.0) Gecko/20100101 Firefox/121.0"
+INSTAGRAM = ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) "
+             "Mobile/15E148 Instagram 309.0.0.28.113")
+FACEBOOK_APP = ("Mozilla/5.0 (Linux; Android 13; SM-S908B) AppleWebKit/537.36 (KHTML, like Gecko) "
+                "Chrome/119.0.6045.193 Mobile Safari/537.36 [FB_IAB/FB4A;FBAV/442.0.0.34.109;]")
+
+
+@pytest.mark.parametrize("ua, device, browser, os", [
+    (EDGE, "Desktop", "Microsoft Edge (120.0.2210.91)", "Windows 10/11 x64"),
+    (CHROME, "Desktop", "Chrome (120.0.0.0)", "Windows 10/11 x64"),
+    (SAFARI, "Desktop", "Safari (17.1)", "macOS 10.15"),
+    (ANDROID, "Mobile", "Chrome (120.0.6099.144)", "Android 14"),
+    (FIREFOX, "Desktop", "Firefox (121.0)", "Ubuntu Linux"),
+])
+def test_browsers(ua, device, browser, os):
+    result = classify_user_agent(ua)
+
+    assert (result["device"], result["browser"], result["os"]) == (device, browser, os)
+    assert not result["is_bot"]
+    assert result["in_app"] is None
+
+
+@pytest.mark.parametrize("ua", ["facebookexternalhit/1.1", "WhatsApp/2.23.20.0 A", "Slackbot-LinkExpanding 1.0",
+                                "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"])
+def test_bots(ua):
+    assert classify_user_agent(ua)["is_bot"]
+
+
+@pytest.mark.parametrize("ua, source", [(INSTAGRAM, "Instagram"), (FACEBOOK_APP, "Facebook"),
+                                        ("WhatsApp/2.23.20.0 A", "WhatsApp")])
+def test_in_app_source(ua, source):
+    assert classify_user_agent(ua)["in_app"] == source
+
+
+@pytest.mark.parametrize("ua", [None, "", "unknown"])
+def test_missing_user_agent(ua):
+    assert classify_user_agent(ua) == {"device": "Desktop", "browser": "Unknown", "os": "Unknown",
+                                       "is_bot": False, "in_app": None}
+
+
+def test_wrappers_read_the_classification():
+    assert detect_device(ANDROID) == "Mobile"
+    assert parse_browser(SAFARI) == "Safari (17.1)"
+    assert parse_os(EDGE) == "Windows 10/11 x64"
+
+
+def test_classification_is_memoized(monkeypatch):
+    ua = FIREFOX + " memo"
+    first = classify_user_agent(ua)
+    monkeypatch.setattr(utils, "_classify_browser", lambda ua: pytest.fail("classified twice"))
+
+    assert classify_user_agent(ua) is first
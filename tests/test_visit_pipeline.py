@@ -0,0 +1,139 @@
+"""
+Visit pipeline: exact per-session visit counts across buffered, committed and failed writes, seeding from old rows,
+and the per-link ring buffers of recent visits
+"""
+
+from datetime import datetime
+
+import pytest
+
+import visit_pipeline
+from database import epoch_ms
+from visit_pipeline import PENDING_ENRICHMENT, RecentVisitWindows, VisitWriter
+
+
+def _visit(link_id, session_id):
+    now = datetime.utcnow()
+    values = dict(PENDING_ENRICHMENT)
+    values.update({
+        "link_id": link_id, "session_id": session_id, "ip_hash": "h", "user_agent": "Mozilla/5.0",
+        "ts": now.isoformat(), "ts_ms": epoch_ms(now), "behavior": "Curious", "is_suspicious": 0,
+        "target_url": "https://example.com/", "device": "Desktop", "browser": "Firefox", "os": "Linux",
+        "referrer": "", "ip_address": "198.51.100.1",
+    })
+    return values
+
+
+@pytest.fixture
+def writer(app):
+    writer = VisitWriter(interval_ms=3600000)
+    with app.app_context():
+        yield writer
+    writer.shutdown()
+
+
+def test_session_count_includes_buffered_visits(writer, make_link):
+    link = make_link()
+    for session_id in ("a", "a", "b"):
+        writer.add(_visit(link["id"], session_id))
+
+    assert writer.session_visit_count(link["id"], "a") == 2
+    assert writer.session_visit_count(link["id"], "b") == 1
+    assert writer.session_visit_count(link["id"], "c") == 0
+
+    writer.flush()
+    writer.add(_visit(link["id"], "a"))
+
+    assert writer.session_visit_count(link["id"], "a") == 3
+    assert writer.session_visit_count(link["id"], "b") == 1
+    assert writer.get_stats()["buffered_sessions"] == 1
+
+
+def test_session_count_survives_failed_flush(writer, make_link, monkeypatch):
+    link = make_link()
+    writer.add(_visit(link["id"], "a"))
+    writer.add(_visit(link["id"], "a"))
+
+    def connect_db(check_same_thread=True):
+        raise OSError("database unavailable")
+
+    monkeypatch.setattr(visit_pipeline, "connect_db", connect_db)
+    writer.flush()
+    assert writer.get_stats()["errors"] == 1
+    assert writer.session_visit_count(link["id"], "a") == 2
+
+    monkeypatch.undo()
+    writer.flush()
+    assert writer.session_visit_count(link["id"], "a") == 2
+    assert writer.get_stats()["buffered_sessions"] == 0
+
+
+def test_redirect_seeds_past_visits_without_ts_ms(client, make_link):
+    from database import connect_db
+
+    link = make_link()
+    conn = connect_db()
+    try:
+        # A row from before the ts_ms backfill
+        conn.execute(
+            "INSERT INTO visits (link_id, session_id, ip_hash, user_agent, ts, ts_ms, behavior, target_url) "
+            "VALUES (?, 'old', 'h', 'Mozilla/5.0', '2024-01-01T00:00:00', NULL, 'Curious', ?)",
+            [link["id"], link["primary_url"]],
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+    response = client.get(f"/r/{link['code']}", headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Firefox/120.0",
+                                                         "X-Forwarded-For": "198.51.100.20"})
+
+    assert response.status_code == 302
+    assert visit_pipeline.recent_visit_window(link["id"])
+
+
+def _insert_visits(link_id, *visits):
+    """visits: (epoch ms, ip_hash) pairs"""
+    from database import connect_db
+
+    conn = connect_db()
+    try:
+        for ts_ms, ip_hash in visits:
+            conn.execute(
+                "INSERT INTO visits (link_id, session_id, ip_hash, user_agent, ts, ts_ms, behavior, target_url) "
+                "VALUES (?, 's', ?, 'Mozilla/5.0', ?, ?, 'Curious', 'https://example.com/')",
+                [link_id, ip_hash, datetime.utcfromtimestamp(ts_ms / 1000).isoformat(), ts_ms],
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_visit_window_seeds_then_keeps_the_latest(app, make_link):
+    link, other = make_link(), make_link()
+    _insert_visits(link["id"], (1000000, "a"), (2000000, "b"), (3000000, "c"))
+    windows = RecentVisitWindows(size=4)
+
+    with app.app_context():
+        assert windows.recent(link["id"]) == [(3000.0, "c"), (2000.0, "b"), (1000.0, "a")]
+        windows.append(link["id"], 4000.0, "d")
+        windows.append(link["id"], 5000.0, "e")
+        # Untracked links are seeded from the table on their first read instead
+        windows.append(other["id"], 5000.0, "e")
+
+        assert windows.recent(link["id"]) == [(5000.0, "e"), (4000.0, "d"), (3000.0, "c"), (2000.0, "b")]
+        assert windows.recent(other["id"]) == []
+
+
+def test_visit_window_keeps_visits_recorded_while_seeding(app, make_link, monkeypatch):
+    link = make_link()
+    windows = RecentVisitWindows(size=4)
+
+    def recent_visits(link_id, limit, columns):
+        # Both committed meanwhile: one is in the seed rows, the other arrived after the query
+        windows.append(link_id, 2000.0, "b")
+        windows.append(link_id, 3000.0, "c")
+        return [{"ts_ms": 2000000, "ip_hash": "b"}, {"ts_ms": 1000000, "ip_hash": "a"}]
+
+    monkeypatch.setattr(visit_pipeline, "recent_visits", recent_visits)
+
+    assert windows.recent(link["id"]) == [(3000.0, "c"), (2000.0, "b"), (1000.0, "a")]
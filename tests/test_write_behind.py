@@ -0,0 +1,90 @@
+"""
+Write-behind buffers: batched writes, and nothing lost when a write fails
+"""
+
+from datetime import datetime
+
+import pytest
+
+import cache
+from bot_counter import BotCounter
+from database import connect_db
+from ddos_events import DDoSEventAggregator
+
+
+def _query(sql, params=()):
+    conn = connect_db()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def failing_db(monkeypatch):
+    def connect_db(check_same_thread=True):
+        raise OSError("database unavailable")
+
+    monkeypatch.setattr(cache, "connect_db", connect_db)
+
+
+def test_bot_counter_batches_hits(app, make_link):
+    link = make_link()
+    counter = BotCounter(interval=3600)
+    for _ in range(5):
+        counter.hit(link["id"])
+    assert counter.pending(link["id"]) == 5
+    assert _query("SELECT hits FROM bot_hits WHERE link_id = ?", [link["id"]]) == []
+
+    counter.shutdown()
+
+    assert _query("SELECT hits FROM bot_hits WHERE link_id = ?", [link["id"]])[0][0] == 5
+    assert counter.pending(link["id"]) == 0
+    assert counter.get_stats()["rows_flushed"] == 1
+
+
+def test_bot_counter_adds_to_stored_hits(app, make_link):
+    link, other = make_link(), make_link()
+    counter = BotCounter(interval=3600)
+    counter.hit(link["id"], now=datetime(2024, 1, 2))
+    counter.hit(other["id"], now=datetime(2024, 1, 2))
+    counter.flush()
+    # A late flush from another worker carries an older timestamp
+    counter.hit(link["id"], now=datetime(2024, 1, 1))
+    counter.hit(link["id"], now=datetime(2024, 1, 1))
+    counter.shutdown()
+
+    hits, last_seen = _query("SELECT hits, last_seen FROM bot_hits WHERE link_id = ?", [link["id"]])[0]
+    assert (hits, last_seen) == (3, datetime(2024, 1, 2).isoformat())
+    assert _query("SELECT hits FROM bot_hits WHERE link_id = ?", [other["id"]])[0][0] == 1
+    assert counter.get_stats()["hits"] == 4
+
+
+def test_failed_flush_is_merged_back(app, make_link, failing_db, monkeypatch):
+    link = make_link()
+    counter = BotCounter(interval=3600)
+    counter.hit(link["id"], now=datetime(2024, 1, 1))
+    counter.flush()
+    counter.hit(link["id"], now=datetime(2024, 1, 2))
+
+    assert counter.get_stats()["errors"] == 1
+    assert counter.pending(link["id"]) == 2
+
+    monkeypatch.undo()
+    counter.shutdown()
+
+    hits, last_seen = _query("SELECT hits, last_seen FROM bot_hits WHERE link_id = ?", [link["id"]])[0]
+    assert (hits, last_seen) == (2, datetime(2024, 1, 2).isoformat())
+
+
+def test_ddos_events_coalesce_across_failed_flush(app, make_link, failing_db, monkeypatch):
+    link = make_link()
+    aggregator = DDoSEventAggregator(interval=3600)
+    aggregator.log(link["id"], "rate_limit", 2, "198.51.100.1")
+    aggregator.flush()
+    aggregator.log(link["id"], "rate_limit", 3, "198.51.100.1")
+    monkeypatch.undo()
+    aggregator.shutdown()
+
+    rows = _query("SELECT severity, event_count FROM ddos_events WHERE link_id = ?", [link["id"]])
+    assert [tuple(r) for r in rows] == [(3, 2)]
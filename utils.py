@@ -4,11 +4,14 @@ Geolocation, device detection, email, and other utility functions
 """
 
 import hashlib
+import ipaddress
 import os
 import re
 import string
 import uuid
 import smtplib
+import threading
+import time
 import requests
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
@@ -16,7 +19,14 @@ from collections import Counter
 from email.message import EmailMessage
 from flask import request, session
 from database import query_db, execute_db
-from config import SUSPICIOUS_INTERVAL_SECONDS, MULTI_CLICK_THRESHOLD, RETURNING_WINDOW_HOURS
+from geo_cache import geo_cache
+from offline_geo import offline_lookup
+from reverse_dns import reverse_dns
+from cache import LRUCache, SingleFlight
+from visit_pipeline import session_visit_count
+from link_state import link_states
+from config import SUSPICIOUS_INTERVAL_SECONDS, MULTI_CLICK_THRESHOLD, RETURNING_WINDOW_HOURS, GEO_ONLINE_FALLBACK
+from config import PUBLIC_IP_FALLBACK, PUBLIC_IP_OVERRIDE, PUBLIC_IP_REFRESH_SECONDS, PUBLIC_IP_RETRY_SECONDS, UA_CACHE_SIZE
 
 
 def utcnow() -> datetime:
@@ -107,19 +117,12 @@ def classify_behavior(link_id: int, session_id: str, visits, now: datetime, beha
         interested_threshold = 2
         engaged_threshold = MULTI_CLICK_THRESHOLD
     
-    # Count recent visits within the custom window
-    recent = [datetime.fromisoformat(v["ts"]) for v in visits if (now - datetime.fromisoformat(v["ts"])) < timedelta(hours=returning_window_hours)]
+    # Count recent visits within the custom window (visits are (epoch, ip_hash), newest first)
+    window_start = now.replace(tzinfo=timezone.utc).timestamp() - returning_window_hours * 3600
+    recent = [epoch for epoch, _ in visits if epoch > window_start]
     
-    # Count total visits for this session
-    res = query_db(
-        """
-        SELECT COUNT(*) AS c FROM visits
-        WHERE link_id = ? AND session_id = ?
-        """,
-        [link_id, session_id],
-        one=True,
-    )
-    per_session = res["c"] if res else 0
+    # Count total visits for this session (session_stats + group-commit buffer, cached)
+    per_session = session_visit_count(link_id, session_id)
 
     # Apply custom thresholds
     if per_session >= engaged_threshold:
@@ -132,6 +135,7 @@ def classify_behavior(link_id: int, session_id: str, visits, now: datetime, beha
 def detect_suspicious(visits, now: datetime, ip_hash: str = None, rules: dict = None) -> bool:
     """
     Detect suspicious activity based on bot-like patterns.
+    visits are (epoch, ip_hash) tuples, newest first (see recent_visit_window).
     
     This function now looks for:
     1. Extremely rapid requests from the SAME IP (< Customizable)
@@ -172,13 +176,11 @@ def detect_suspicious(visits, now: datetime, ip_hash: str = None, rules: dict =
     # If we have the current IP hash, check for rapid requests from THIS specific IP
     if ip_hash:
         # Get recent visits from this specific IP
-        same_ip_visits = [v for v in visits if v['ip_hash'] == ip_hash]
+        same_ip_visits = [epoch for epoch, visit_ip_hash in visits if visit_ip_hash == ip_hash]
         
         if len(same_ip_visits) >= 2:
             # Check if this IP is making requests faster than humanly possible
-            latest = datetime.fromisoformat(same_ip_visits[0]["ts"])
-            second_latest = datetime.fromisoformat(same_ip_visits[1]["ts"])
-            delta = (latest - second_latest).total_seconds()
+            delta = same_ip_visits[0] - same_ip_visits[1]
             
             # Flag as suspicious if same IP makes requests < rapid_click_limit
             rapid_limit = rules.get('rapid_click_limit', 0.3)
@@ -188,9 +190,9 @@ def detect_suspicious(visits, now: datetime, ip_hash: str = None, rules: dict =
     # Check for burst pattern: 8+ requests in 1 second (clear bot signature)
     # Increased threshold from 5 to 8 and reduced time from 2s to 1s
     # This catches obvious bots but allows legitimate rapid clicking
-    recent_timestamps = [datetime.fromisoformat(v["ts"]) for v in visits[:15]]
+    recent_timestamps = [epoch for epoch, _ in visits[:15]]
     if len(recent_timestamps) >= 8:
-        time_span = (recent_timestamps[0] - recent_timestamps[7]).total_seconds()
+        time_span = recent_timestamps[0] - recent_timestamps[7]
         if time_span < 1.0:
             return True
     
@@ -217,39 +219,9 @@ def decide_target(link, behavior: str, session_count: int) -> str:
     return link["primary_url"]
 
 
-def evaluate_state(link_id: int, now: datetime, rules: dict = None) -> str:
-    """Evaluate link state based on activity"""
-    if not rules:
-        rules = {'health_kill_switch': 5}
-        
-    from config import STATE_DECAY_DAYS, ATTENTION_DECAY_DAYS
-    
-    recent = query_db(
-        """
-        SELECT ts, is_suspicious FROM visits
-        WHERE link_id = ?
-        ORDER BY ts DESC
-        LIMIT 30
-        """,
-        [link_id],
-    )
-    if not recent:
-        return "Active"
-
-    latest_time = datetime.fromisoformat(recent[0]["ts"])
-    days_since = (now - latest_time).days
-    suspicious_hits = sum(1 for v in recent if v["is_suspicious"])
-
-    kill_threshold = rules.get('health_kill_switch', 5)
-    if suspicious_hits >= kill_threshold:
-        return "Inactive"
-    if days_since > STATE_DECAY_DAYS:
-        return "Inactive"
-    if days_since > ATTENTION_DECAY_DAYS:
-        return "Decaying"
-    if len(recent) >= 10:
-        return "High Interest"
-    return "Active"
+def evaluate_state(link_id: int, now: datetime, rules: dict = None, suspicious: bool = False) -> str:
+    """Evaluate link state after a visit was recorded (O(1), from the in-memory link health counters)"""
+    return link_states.record_visit(link_id, now, suspicious, rules)
 
 
 def trust_score(link_id: int) -> int:
@@ -275,31 +247,18 @@ def trust_score(link_id: int) -> int:
 
 
 def attention_decay(visits):
-    """Calculate attention decay over time"""
+    """Calculate attention decay over time from visit rows with a ts_ms column"""
     if not visits:
         return []
-    # bucket by day to show drop-off
-    buckets = {}
-    for v in visits:
-        day = datetime.fromisoformat(v["ts"]).date().isoformat()
-        buckets[day] = buckets.get(day, 0) + 1
-    return [{"day": k, "count": buckets[k]} for k in sorted(buckets.keys())]
+    # bucket by UTC day number to show drop-off; only the distinct days are turned into dates
+    buckets = Counter(v["ts_ms"] // 86400000 for v in visits)
+    epoch = datetime(1970, 1, 1)
+    return [{"day": (epoch + timedelta(days=d)).date().isoformat(), "count": buckets[d]} for d in sorted(buckets)]
 
 
 def detect_device(user_agent: str) -> str:
     """Detect device type from user agent string"""
-    ua = user_agent.lower()
-    if "mobile" in ua or "android" in ua or "iphone" in ua:
-        return "Mobile"
-    elif "tablet" in ua or "ipad" in ua:
-        return "Tablet"
-    else:
-        return "Desktop"
-
-
-# Simple in-memory cache for geolocation (IP -> dict)
-# In production, use Redis or database
-geo_cache = {}
+    return classify_user_agent(user_agent)["device"]
 
 
 def get_client_ip():
@@ -316,33 +275,89 @@ def get_client_ip():
     return request.remote_addr or "unknown"
 
 
+_public_ip = {"ip": None, "checked_at": 0.0}
+_public_ip_lock = threading.Lock()
+
+
 def get_public_ip_fallback():
-    """Fetch the server's own public IP"""
+    """Return the server's own public IP (configured, or fetched from ipify and memoized)"""
+    if PUBLIC_IP_OVERRIDE:
+        return PUBLIC_IP_OVERRIDE
+    if not PUBLIC_IP_FALLBACK:
+        return None
+
+    now = time.monotonic()
+    # Refresh successes every PUBLIC_IP_REFRESH_SECONDS, retry failures sooner
+    max_age = PUBLIC_IP_REFRESH_SECONDS if _public_ip["ip"] else PUBLIC_IP_RETRY_SECONDS
+    if _public_ip["checked_at"] and now - _public_ip["checked_at"] < max_age:
+        return _public_ip["ip"]
+
+    with _public_ip_lock:
+        # Another thread may have refreshed it while we waited
+        if _public_ip["checked_at"] and time.monotonic() - _public_ip["checked_at"] < max_age:
+            return _public_ip["ip"]
+        public_ip = None
+        try:
+            response = requests.get('https://api.ipify.org', timeout=3)
+            if response.status_code == 200:
+                public_ip = response.text.strip()
+                print(f"Using public IP {public_ip} for private client IPs", flush=True)
+        except Exception as e:
+            print(f"Could not fetch public IP: {e}")
+        # Keep serving the last known IP if a refresh fails
+        _public_ip["ip"] = public_ip or _public_ip["ip"]
+        _public_ip["checked_at"] = time.monotonic()
+        return _public_ip["ip"]
+
+
+# Local-network ranges (RFC 1918, CGNAT, "this network", IPv6 ULA). Not ipaddress.is_private /
+# is_global: those also cover the documentation ranges (192.0.2.0/24, 2001:db8::/32, ...)
+# that geolocation datasets and the offline index can contain.
+_PRIVATE_NETWORKS = tuple(ipaddress.ip_network(n) for n in (
+    "10.0.0.0/8", "172.16.0.0/12", "192.168.0.0/16", "100.64.0.0/10", "0.0.0.0/8", "fc00::/7",
+))
+
+
+def is_private_ip(ip: str) -> bool:
+    """True for missing/invalid IPs and local addresses (RFC 1918, CGNAT, loopback, link-local, ULA, multicast)"""
+    if not ip or ip == "unknown":
+        return True
     try:
-        response = requests.get('https://api.ipify.org', timeout=3)
-        if response.status_code == 200:
-            return response.text.strip()
-    except Exception as e:
-        print(f"Could not fetch public IP: {e}")
-    return None
+        addr = ipaddress.ip_address(ip.strip())
+    except ValueError:
+        return True
+    if addr.version == 6 and addr.ipv4_mapped:
+        addr = addr.ipv4_mapped
+    if addr.is_loopback or addr.is_link_local or addr.is_multicast or addr.is_unspecified:
+        return True
+    return any(addr in network for network in _PRIVATE_NETWORKS if network.version == addr.version)
+
+
+def resolve_lookup_ip(ip: str):
+    """Return the IP to geolocate, swapping private IPs for the server's public IP (None if unavailable)"""
+    # Handle private IPs by using the server's public IP (for dev/testing)
+    if is_private_ip(ip):
+        return get_public_ip_fallback()
+    return ip
 
 
 def get_api_location(ip: str) -> dict:
-    """Get location data from ip-api.com with caching"""
-    
-    # Handle private IPs by trying to resolve public IP (for dev/testing)
-    if not ip or ip == "unknown" or ip.startswith("127.") or ip.startswith("192.168.") or ip.startswith("10."):
-        print(f"Private IP detected ({ip}). Attempting to fetch public IP for geolocation...", flush=True)
-        public_ip = get_public_ip_fallback()
-        if public_ip:
-            print(f"Using public IP {public_ip} instead of {ip}", flush=True)
-            ip = public_ip
-        else:
-            return {'status': 'private'}
-    
-    # Check cache
-    if ip in geo_cache:
-        return geo_cache[ip]
+    """Get location data from the offline index, else IP2Location.io / ip-api.com with two-tier caching"""
+    ip = resolve_lookup_ip(ip)
+    if not ip:
+        return {'status': 'private'}
+
+    # Offline index first: an mmap'd binary search, no network and no cache needed
+    offline = offline_lookup(ip)
+    if offline is not None:
+        return offline
+    if not GEO_ONLINE_FALLBACK:
+        return {'status': 'fail'}
+
+    # Check cache (memory LRU, then the persistent geo_cache table)
+    cached = geo_cache.get(ip)
+    if cached is not None:
+        return cached
     
     # Priority 1: IP2Location.io
     try:
@@ -365,7 +380,7 @@ def get_api_location(ip: str) -> dict:
                     'isp': data.get('isp'),
                     'org': data.get('as')
                 }
-                geo_cache[ip] = mapped_data
+                geo_cache.set(ip, mapped_data)
                 return mapped_data
     except Exception as e:
         print(f"IP2Location error: {e}")
@@ -377,58 +392,111 @@ def get_api_location(ip: str) -> dict:
         if response.status_code == 200:
             data = response.json()
             if data['status'] == 'success':
-                geo_cache[ip] = data
+                geo_cache.set(ip, data)
                 return data
     except Exception as e:
         print(f"API Geolocation error for {ip}: {e}")
-        
-    return {'status': 'fail'}
+    
+    # Negatively cache failures (shorter TTL) so a bad IP doesn't hit both providers every click
+    failed = {'status': 'fail'}
+    geo_cache.set(ip, failed)
+    return failed
+
+
+class IPIntel:
+    """Region, location, ISP, org and hostname of an IP, resolved from a single provider fetch"""
+
+    __slots__ = ("ip", "status", "data", "hostname")
+
+    def __init__(self, ip: str, status: str, data: dict = None, hostname: str = None):
+        self.ip = ip
+        self.status = status  # 'success', 'private' or 'fail'
+        self.data = data or {}
+        self.hostname = hostname
+
+    @property
+    def region(self) -> str:
+        """Display region, e.g. 'Ahmedabad, India'"""
+        if self.status == 'private':
+            return "Local/Private"
+        if self.status == 'success':
+            city = self.data.get('city', '')
+            country = self.data.get('country', 'Unknown Country')
+            if city:
+                return f"{city}, {country}"
+            return country
+        return "Unknown"
+
+    @property
+    def location(self) -> dict:
+        """Country, city, region, coordinates and timezone"""
+        location_info = {
+            'country': 'Unknown',
+            'city': 'Unknown', 
+            'region': 'Unknown',
+            'latitude': None,
+            'longitude': None,
+            'timezone': None
+        }
+        if self.status == 'private':
+            location_info['country'] = 'Local/Private'
+            location_info['region'] = 'Local/Private'
+        elif self.status == 'success':
+            location_info['country'] = self.data.get('country', 'Unknown')
+            location_info['city'] = self.data.get('city', 'Unknown')
+            location_info['region'] = self.data.get('regionName', 'Unknown')
+            location_info['latitude'] = self.data.get('lat')
+            location_info['longitude'] = self.data.get('lon')
+            location_info['timezone'] = self.data.get('timezone')
+        return location_info
+
+    @property
+    def isp_info(self) -> dict:
+        """ISP (provider data, else derived from the hostname), hostname and org"""
+        if self.status == 'private':
+            return {'isp': 'Local Network', 'hostname': 'localhost', 'org': 'Unknown'}
+
+        result = {'isp': 'Unknown', 'hostname': self.hostname or 'Unknown', 'org': 'Unknown'}
+        if self.hostname:
+            # Extract potential ISP from hostname
+            parts = self.hostname.split('.')
+            if len(parts) >= 2:
+                result['isp'] = '.'.join(parts[-2:])
+        # IP2Location's free tier has no ISP field; its AS name is the closest equivalent
+        provider_isp = self.data.get('isp') or self.data.get('org')
+        if provider_isp:
+            result['isp'] = normalize_isp(provider_isp)
+        if self.data.get('org'):
+            result['org'] = self.data['org']
+        return result
+
+
+# Coalesces concurrent lookups of the same IP (e.g. a burst from one NAT) into one upstream fetch
+_ip_lookups = SingleFlight()
+
+
+def _fetch_ip_intel(ip: str) -> IPIntel:
+    lookup_ip_address = resolve_lookup_ip(ip)
+    if not lookup_ip_address:
+        return IPIntel(ip, 'private')
+
+    data = get_api_location(lookup_ip_address)
+    return IPIntel(ip, data.get('status', 'fail'), data, reverse_dns(lookup_ip_address))
+
+
+def lookup_ip(ip: str) -> IPIntel:
+    """Resolve everything we know about an IP with one (cached, coalesced) provider fetch"""
+    return _ip_lookups.do(ip or "unknown", lambda: _fetch_ip_intel(ip))
 
 
 def detect_region(ip: str) -> str:
     """Detect region from IP address"""
-    data = get_api_location(ip)
-    
-    if data.get('status') == 'private':
-        return "Local/Private"
-        
-    if data.get('status') == 'success':
-        city = data.get('city', '')
-        country = data.get('country', 'Unknown Country')
-        if city:
-            return f"{city}, {country}"
-        return country
-        
-    return "Unknown"
+    return lookup_ip(ip).region
 
 
 def get_detailed_location(ip: str) -> dict:
     """Get detailed location information including country, city, coordinates"""
-    location_info = {
-        'country': 'Unknown',
-        'city': 'Unknown', 
-        'region': 'Unknown',
-        'latitude': None,
-        'longitude': None,
-        'timezone': None
-    }
-    
-    data = get_api_location(ip)
-    
-    if data.get('status') == 'private':
-        location_info['country'] = 'Local/Private'
-        location_info['region'] = 'Local/Private'
-        return location_info
-        
-    if data.get('status') == 'success':
-        location_info['country'] = data.get('country', 'Unknown')
-        location_info['city'] = data.get('city', 'Unknown')
-        location_info['region'] = data.get('regionName', 'Unknown')
-        location_info['latitude'] = data.get('lat')
-        location_info['longitude'] = data.get('lon')
-        location_info['timezone'] = data.get('timezone')
-    
-    return location_info
+    return lookup_ip(ip).location
 
 
 def country_to_continent(country: str) -> str:
@@ -659,61 +727,82 @@ def country_to_continent(country: str) -> str:
 
 def parse_browser(user_agent: str) -> str:
     """Parse browser name and version from User-Agent string"""
-    if not user_agent or user_agent == "unknown":
-        return "Unknown"
-    
-    ua = user_agent.lower()
-    
-    # Check for common browsers (order matters - more specific first)
+    return classify_user_agent(user_agent)["browser"]
+
+
+def parse_os(user_agent: str) -> str:
+    """Parse operating system from User-Agent string"""
+    return classify_user_agent(user_agent)["os"]
+
+
+# Precompiled User-Agent patterns (matched against the lowercased UA)
+_EDGE_RE = re.compile(r'edg[e]?/(\d+[\.\d]*)')
+_OPERA_RE = re.compile(r'(?:opr|opera)[/\s](\d+[\.\d]*)')
+_CHROME_RE = re.compile(r'chrome/(\d+[\.\d]*)')
+_FIREFOX_RE = re.compile(r'firefox/(\d+[\.\d]*)')
+_SAFARI_RE = re.compile(r'version/(\d+[\.\d]*)')
+_IE_RE = re.compile(r'(?:msie |rv:)(\d+[\.\d]*)')
+_MACOS_RE = re.compile(r'mac os x (\d+[_\.]\d+)')
+_IOS_RE = re.compile(r'iphone os (\d+[_\.]\d+)')
+_ANDROID_RE = re.compile(r'android (\d+[\.\d]*)')
+
+# Link previewers and crawlers - their hits are not counted as visits
+BOT_KEYWORDS = [
+    'whatsapp', 'telegram', 'facebook', 'twitter', 'linkedin',
+    'discord', 'skype', 'slack', 'bot', 'crawl', 'spider', 'preview'
+]
+_BOT_RE = re.compile('|'.join(re.escape(k) for k in BOT_KEYWORDS))
+
+# In-app browsers of social apps (they often strip the Referer header), first match wins
+IN_APP_SOURCES = [
+    # WhatsApp: direct identifier, short form, Android WebView (commonly used by WhatsApp)
+    ('WhatsApp', ['whatsapp', 'wa/', 'wv)']),
+    ('Instagram', ['instagram']),
+    # Facebook app, app version, in-app browser, iOS, Messenger, Android
+    ('Facebook', ['fban', 'fbav', 'fb_iab', 'fbios', 'messenger', 'fb4a']),
+    ('Twitter', ['twitter']),
+    ('LinkedIn', ['linkedin']),
+    ('Telegram', ['telegram']),
+]
+_IN_APP_RES = [(source, re.compile('|'.join(re.escape(t) for t in tokens))) for source, tokens in IN_APP_SOURCES]
+
+# Real traffic has only a few thousand distinct User-Agents
+_ua_cache = LRUCache(maxsize=UA_CACHE_SIZE)
+
+
+def _versioned(name: str, pattern, ua: str) -> str:
+    match = pattern.search(ua)
+    return f"{name} ({match.group(1)})" if match else name
+
+
+def _classify_device(ua: str) -> str:
+    if "mobile" in ua or "android" in ua or "iphone" in ua:
+        return "Mobile"
+    if "tablet" in ua or "ipad" in ua:
+        return "Tablet"
+    return "Desktop"
+
+
+def _classify_browser(ua: str) -> str:
+    # Order matters - more specific first
     if "edg/" in ua or "edge/" in ua:
-        import re
-        match = re.search(r'edg[e]?/(\d+[\.\d]*)', ua)
-        version = match.group(1) if match else ""
-        return f"Microsoft Edge ({version})" if version else "Microsoft Edge"
-    
+        return _versioned("Microsoft Edge", _EDGE_RE, ua)
     if "opr/" in ua or "opera" in ua:
-        import re
-        match = re.search(r'(?:opr|opera)[/\s](\d+[\.\d]*)', ua)
-        version = match.group(1) if match else ""
-        return f"Opera ({version})" if version else "Opera"
-    
+        return _versioned("Opera", _OPERA_RE, ua)
     if "chrome" in ua and "chromium" not in ua:
-        import re
-        match = re.search(r'chrome/(\d+[\.\d]*)', ua)
-        version = match.group(1) if match else ""
-        return f"Chrome ({version})" if version else "Chrome"
-    
+        return _versioned("Chrome", _CHROME_RE, ua)
     if "firefox" in ua:
-        import re
-        match = re.search(r'firefox/(\d+[\.\d]*)', ua)
-        version = match.group(1) if match else ""
-        return f"Firefox ({version})" if version else "Firefox"
-    
+        return _versioned("Firefox", _FIREFOX_RE, ua)
     if "safari" in ua and "chrome" not in ua:
-        import re
-        match = re.search(r'version/(\d+[\.\d]*)', ua)
-        version = match.group(1) if match else ""
-        return f"Safari ({version})" if version else "Safari"
-    
+        return _versioned("Safari", _SAFARI_RE, ua)
     if "msie" in ua or "trident" in ua:
-        import re
-        match = re.search(r'(?:msie |rv:)(\d+[\.\d]*)', ua)
-        version = match.group(1) if match else ""
-        return f"Internet Explorer ({version})" if version else "Internet Explorer"
-    
+        return _versioned("Internet Explorer", _IE_RE, ua)
     if "chromium" in ua:
         return "Chromium"
-    
     return "Unknown Browser"
 
 
-def parse_os(user_agent: str) -> str:
-    """Parse operating system from User-Agent string"""
-    if not user_agent or user_agent == "unknown":
-        return "Unknown"
-    
-    ua = user_agent.lower()
-    
+def _classify_os(ua: str) -> str:
     # Windows versions
     if "windows nt 10.0" in ua:
         if "windows nt 10.0; win64" in ua:
@@ -731,35 +820,24 @@ def parse_os(user_agent: str) -> str:
         return "Windows XP"
     if "windows" in ua:
         return "Windows"
-    
+
     # macOS
     if "mac os x" in ua:
-        import re
-        match = re.search(r'mac os x (\d+[_\.]\d+)', ua)
-        if match:
-            version = match.group(1).replace('_', '.')
-            return f"macOS {version}"
-        return "macOS"
-    
+        match = _MACOS_RE.search(ua)
+        return f"macOS {match.group(1).replace('_', '.')}" if match else "macOS"
+
     # iOS
     if "iphone" in ua:
-        import re
-        match = re.search(r'iphone os (\d+[_\.]\d+)', ua)
-        if match:
-            version = match.group(1).replace('_', '.')
-            return f"iOS {version} (iPhone)"
-        return "iOS (iPhone)"
+        match = _IOS_RE.search(ua)
+        return f"iOS {match.group(1).replace('_', '.')} (iPhone)" if match else "iOS (iPhone)"
     if "ipad" in ua:
         return "iOS (iPad)"
-    
+
     # Android
     if "android" in ua:
-        import re
-        match = re.search(r'android (\d+[\.\d]*)', ua)
-        if match:
-            return f"Android {match.group(1)}"
-        return "Android"
-    
+        match = _ANDROID_RE.search(ua)
+        return f"Android {match.group(1)}" if match else "Android"
+
     # Linux distributions
     if "ubuntu" in ua:
         return "Ubuntu Linux"
@@ -767,14 +845,44 @@ def parse_os(user_agent: str) -> str:
         return "Fedora Linux"
     if "linux" in ua:
         return "Linux"
-    
+
     # Chrome OS
     if "cros" in ua:
         return "Chrome OS"
-    
+
     return "Unknown OS"
 
 
+def classify_user_agent(user_agent: str) -> dict:
+    """Device, browser (with version), OS (with version), bot flag and in-app source of a User-Agent.
+
+    The UA is lowercased once and matched with precompiled patterns; results are memoized per UA string.
+    The returned dict is shared between callers and must not be modified.
+    """
+    user_agent = user_agent or ""
+    result = _ua_cache.get(user_agent)
+    if result is not None:
+        return result
+
+    ua = user_agent.lower()
+    known = bool(user_agent) and user_agent != "unknown"
+    in_app = None
+    for source, pattern in _IN_APP_RES:
+        if pattern.search(ua):
+            in_app = source
+            break
+
+    result = {
+        "device": _classify_device(ua),
+        "browser": _classify_browser(ua) if known else "Unknown",
+        "os": _classify_os(ua) if known else "Unknown",
+        "is_bot": _BOT_RE.search(ua) is not None,
+        "in_app": in_app,
+    }
+    _ua_cache.set(user_agent, result)
+    return result
+
+
 def normalize_isp(isp_name: str) -> str:
     """Normalize common ISP names to prevent duplicates in analytics"""
     if not isp_name or isp_name.lower() == 'unknown':
@@ -811,47 +919,23 @@ def normalize_isp(isp_name: str) -> str:
 
 
 def get_isp_info(ip: str) -> dict:
-    """Get ISP and hostname via DNS reverse lookup and API fallback"""
-    result = {
-        'isp': 'Unknown',
-        'hostname': 'Unknown',
-        'org': 'Unknown'
+    """Get ISP and hostname via DNS reverse lookup and the geolocation provider data"""
+    return lookup_ip(ip).isp_info
+
+
+def enrich_ip(ip: str) -> dict:
+    """Resolve every IP-derived visit field (region, location, ISP, hostname)"""
+    intel = lookup_ip(ip)
+    location_info = intel.location
+    isp_info = intel.isp_info
+    return {
+        'region': intel.region,
+        'country': location_info['country'],
+        'city': location_info['city'],
+        'latitude': location_info['latitude'],
+        'longitude': location_info['longitude'],
+        'timezone': location_info['timezone'],
+        'isp': isp_info['isp'],
+        'hostname': isp_info['hostname'],
+        'org': isp_info['org'],
     }
-    
-    if not ip or ip == "unknown" or ip.startswith("127.") or ip.startswith("192.168.") or ip.startswith("10."):
-        # Try to get public IP for dev mode to show real ISP
-        public_ip = get_public_ip_fallback()
-        if public_ip:
-            ip = public_ip
-        else:
-            result['isp'] = 'Local Network'
-            result['hostname'] = 'localhost'
-            return result
-    
-    # Try DNS reverse lookup for hostname
-    try:
-        import socket
-        hostname = socket.gethostbyaddr(ip)[0]
-        result['hostname'] = hostname
-        
-        # Extract potential ISP from hostname
-        parts = hostname.split('.')
-        if len(parts) >= 2:
-            result['isp'] = '.'.join(parts[-2:])
-    except (socket.herror, socket.gaierror, socket.timeout):
-        pass
-    
-    # Try ip-api.com for accurate ISP info
-    try:
-        import requests
-        response = requests.get(f"http://ip-api.com/json/{ip}?fields=isp,org,as", timeout=2)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('isp'):
-                result['isp'] = normalize_isp(data['isp'])
-            if data.get('org'):
-                result['org'] = data['org']
-    except Exception:
-        pass
-    
-    return result
\ No newline at end of file
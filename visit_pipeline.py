@@ -0,0 +1,541 @@
+"""
+Smart Link Intelligence - Visit Pipeline
+Group-committed visit writes and deferred geo/ISP enrichment in a background worker pool
+"""
+
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from cache import LRUCache
+from database import connect_db, epoch_ms
+from link_traffic import link_traffic
+from config import (
+    DEFERRED_VISIT_ENRICHMENT, ENRICHMENT_WORKERS, ENRICHMENT_QUEUE_SIZE,
+    ENRICHMENT_ENQUEUE_TIMEOUT, ENRICHMENT_SHUTDOWN_TIMEOUT,
+    VISIT_FLUSH_INTERVAL_MS, VISIT_FLUSH_MAX_ROWS, VISIT_BUFFER_MAX_ROWS,
+    SESSION_STATS_CACHE_SIZE, SESSION_STATS_CACHE_TTL_SECONDS,
+    VISIT_WINDOW_SIZE, VISIT_WINDOW_CACHE_LINKS, VISIT_WINDOW_TTL_SECONDS
+)
+
+VISIT_COLUMNS = (
+    "link_id", "session_id", "ip_hash", "user_agent", "ts", "ts_ms", "behavior", "is_suspicious", "target_url",
+    "region", "device", "country", "city", "latitude", "longitude", "timezone", "browser", "os",
+    "isp", "hostname", "org", "referrer", "ip_address",
+)
+INSERT_VISIT_SQL = f"INSERT INTO visits ({', '.join(VISIT_COLUMNS)}) VALUES ({', '.join('?' for _ in VISIT_COLUMNS)})"
+
+# Fields filled in by enrichment; stored as placeholders until the worker updates the row
+ENRICHED_FIELDS = ("region", "country", "city", "latitude", "longitude", "timezone", "isp", "hostname", "org")
+UPDATE_ENRICHMENT_SQL = f"UPDATE visits SET {', '.join(f'{name} = ?' for name in ENRICHED_FIELDS)} WHERE id = ?"
+UPSERT_SESSION_STATS_SQL = """
+    INSERT INTO session_stats (link_id, session_id, visit_count, first_ts, last_ts) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(link_id, session_id) DO UPDATE SET
+        visit_count = visit_count + excluded.visit_count,
+        first_ts = MIN(first_ts, excluded.first_ts),
+        last_ts = MAX(last_ts, excluded.last_ts)
+"""
+PENDING_ENRICHMENT = {
+    "region": "Pending",
+    "country": "Pending",
+    "city": "Pending",
+    "latitude": None,
+    "longitude": None,
+    "timezone": None,
+    "isp": "Pending",
+    "hostname": "Pending",
+    "org": "Pending",
+}
+
+_STOP = object()
+
+
+class PendingVisit:
+    """A visit row waiting in the write buffer; visit_id is set once it is committed"""
+
+    __slots__ = ("values", "visit_id", "flushing", "late_fields")
+
+    def __init__(self, values: dict):
+        self.values = values
+        self.visit_id = None
+        self.flushing = False
+        self.late_fields = None
+
+
+class VisitWriter:
+    """
+    Group-commit writer for visits.
+
+    Request threads append rows to an in-memory buffer; a flusher thread writes
+    them in one transaction with executemany every VISIT_FLUSH_INTERVAL_MS or as
+    soon as VISIT_FLUSH_MAX_ROWS are waiting. The interval is the durability
+    window: a crash can lose at most that much buffered traffic. An interval of 0
+    commits every visit synchronously in the calling thread.
+    """
+
+    def __init__(self, interval_ms: int = VISIT_FLUSH_INTERVAL_MS, max_rows: int = VISIT_FLUSH_MAX_ROWS,
+                 buffer_limit: int = VISIT_BUFFER_MAX_ROWS):
+        self.interval = interval_ms / 1000.0
+        self.max_rows = max_rows
+        self.buffer_limit = buffer_limit
+        self._inserts = []
+        self._inflight = []
+        self._updates = []
+        # (link_id, session_id) -> rows of that session in _inflight + _inserts
+        self._buffered_sessions = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._conn = None
+        self._thread = None
+        self._running = True
+        # (link_id, session_id) -> committed visit count, kept in step with session_stats.
+        # _session_epoch is odd while a flush is writing (seqlock for cache fills).
+        self.sessions = LRUCache(maxsize=SESSION_STATS_CACHE_SIZE, ttl=SESSION_STATS_CACHE_TTL_SECONDS)
+        self._session_epoch = 0
+        self.stats = {
+            "batches": 0,
+            "rows": 0,
+            "updates": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "errors": 0,
+        }
+
+    @property
+    def synchronous(self) -> bool:
+        return self.interval <= 0 or not self._running
+
+    def start(self):
+        """Start the flusher thread (idempotent)"""
+        with self._lock:
+            if self._thread or self.synchronous:
+                return
+            self._thread = threading.Thread(target=self._run, name="visit-writer", daemon=True)
+            self._thread.start()
+
+    def add(self, values: dict) -> PendingVisit:
+        """Buffer a visit row for the next group commit"""
+        pending = PendingVisit(values)
+        key = (values["link_id"], values["session_id"])
+        with self._lock:
+            self._inserts.append(pending)
+            self._buffered_sessions[key] = self._buffered_sessions.get(key, 0) + 1
+            waiting = len(self._inserts)
+            if waiting >= self.max_rows:
+                self._wakeup.notify()
+        if self.synchronous or waiting >= self.buffer_limit:
+            # Synchronous mode, or the flusher has fallen behind: write in the caller (backpressure)
+            self.flush()
+        else:
+            self.start()
+        return pending
+
+    def apply_enrichment(self, pending: PendingVisit, fields: dict):
+        """Attach enrichment results to a visit, patching it in place if it is still buffered"""
+        with self._lock:
+            if pending.visit_id is None:
+                if pending.flushing:
+                    # Being written right now; flush() turns this into an UPDATE once the id is known
+                    pending.late_fields = fields
+                else:
+                    pending.values.update((name, fields[name]) for name in ENRICHED_FIELDS)
+                return
+            self._updates.append([fields[name] for name in ENRICHED_FIELDS] + [pending.visit_id])
+        if self.synchronous:
+            self.flush()
+        else:
+            self.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._inserts) < self.max_rows:
+                    self._wakeup.wait(self.interval)
+                if not self._running:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Write every buffered insert and update in a single transaction"""
+        while self._flush_once() and self.synchronous and self._updates:
+            # Enrichment that raced with the write above left an UPDATE behind
+            pass
+
+    def _flush_once(self) -> bool:
+        with self._flush_lock:
+            with self._lock:
+                inserts, self._inserts = self._inserts, []
+                updates, self._updates = self._updates, []
+                for pending in inserts:
+                    pending.flushing = True
+                self._inflight = inserts
+                if inserts:
+                    self._session_epoch += 1
+            if not inserts and not updates:
+                return False
+
+            sessions = {}
+            for pending in inserts:
+                values = pending.values
+                entry = sessions.get((values["link_id"], values["session_id"]))
+                if entry is None:
+                    sessions[(values["link_id"], values["session_id"])] = [1, values["ts"], values["ts"]]
+                else:
+                    entry[0] += 1
+                    entry[1] = min(entry[1], values["ts"])
+                    entry[2] = max(entry[2], values["ts"])
+
+            started = time.perf_counter()
+            try:
+                if self._conn is None:
+                    self._conn = connect_db(check_same_thread=False)
+                conn = self._conn
+                conn.execute("BEGIN IMMEDIATE")
+                if inserts:
+                    conn.executemany(
+                        INSERT_VISIT_SQL,
+                        [[p.values[col] for col in VISIT_COLUMNS] for p in inserts],
+                    )
+                    # The write lock is held for the whole transaction, so the
+                    # AUTOINCREMENT ids of this batch are contiguous.
+                    last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                    conn.executemany(
+                        UPSERT_SESSION_STATS_SQL,
+                        [[link_id, session_id] + entry for (link_id, session_id), entry in sessions.items()],
+                    )
+                if updates:
+                    conn.executemany(UPDATE_ENRICHMENT_SQL, updates)
+                conn.commit()
+            except Exception as e:
+                print(f"Visit writer flush failed ({len(inserts)} visits, {len(updates)} updates): {e}")
+                try:
+                    self._conn.rollback()
+                except Exception:
+                    pass
+                with self._lock:
+                    self._inflight = []
+                    if inserts:
+                        self._session_epoch += 1
+                    self.stats["errors"] += 1
+                    # Keep the rows for the next attempt
+                    for pending in inserts:
+                        pending.flushing = False
+                        if pending.late_fields:
+                            pending.values.update((name, pending.late_fields[name]) for name in ENRICHED_FIELDS)
+                            pending.late_fields = None
+                    self._inserts[:0] = inserts
+                    self._updates[:0] = updates
+                return False
+
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            with self._lock:
+                self._inflight = []
+                if inserts:
+                    for key, entry in sessions.items():
+                        self.sessions.incr(key, entry[0])
+                        left = self._buffered_sessions.pop(key) - entry[0]
+                        if left:
+                            self._buffered_sessions[key] = left
+                    self._session_epoch += 1
+                    first_id = last_id - len(inserts) + 1
+                    for offset, pending in enumerate(inserts):
+                        pending.visit_id = first_id + offset
+                        pending.flushing = False
+                        if pending.late_fields:
+                            fields, pending.late_fields = pending.late_fields, None
+                            self._updates.append([fields[name] for name in ENRICHED_FIELDS] + [pending.visit_id])
+                stats = self.stats
+                stats["batches"] += 1
+                stats["rows"] += len(inserts)
+                stats["updates"] += len(updates)
+                stats["last_batch_size"] = len(inserts)
+                stats["max_batch_size"] = max(stats["max_batch_size"], len(inserts))
+                stats["last_flush_ms"] = round(elapsed_ms, 3)
+                stats["max_flush_ms"] = max(stats["max_flush_ms"], round(elapsed_ms, 3))
+                stats["total_flush_ms"] += elapsed_ms
+            return True
+
+    def buffered(self, link_id: int) -> list:
+        """Visit rows of a link that are not committed yet, oldest first (read-your-writes for readers)"""
+        with self._lock:
+            return [p.values for p in self._inflight + self._inserts if p.values["link_id"] == link_id]
+
+    def session_visit_count(self, link_id: int, session_id: str) -> int:
+        """Visits of a session on a link so far (committed count from session_stats plus buffered rows)"""
+        from database import query_db
+
+        key = (link_id, session_id)
+        committed = 0
+        for _ in range(3):
+            with self._lock:
+                epoch = self._session_epoch
+                cached = self.sessions.get(key)
+                buffered = self._buffered_sessions.get(key, 0)
+            if cached is not None:
+                return cached + buffered
+
+            row = query_db(
+                "SELECT visit_count FROM session_stats WHERE link_id = ? AND session_id = ?",
+                [link_id, session_id],
+                one=True,
+            )
+            committed = row["visit_count"] if row else 0
+            with self._lock:
+                # Only trust the read if no flush started or finished meanwhile
+                if self._session_epoch == epoch and epoch % 2 == 0:
+                    self.sessions.set(key, committed)
+                    return committed + buffered
+        return committed + buffered
+
+    def get_stats(self) -> dict:
+        """Return batch size and flush latency counters"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["buffered"] = len(self._inserts)
+            stats["buffered_sessions"] = len(self._buffered_sessions)
+        stats["session_cache"] = self.sessions.stats()
+        stats["avg_batch_size"] = round(stats["rows"] / stats["batches"], 2) if stats["batches"] else 0
+        stats["avg_flush_ms"] = round(stats["total_flush_ms"] / stats["batches"], 3) if stats["batches"] else 0
+        stats["durability_window_ms"] = int(self.interval * 1000)
+        return stats
+
+    def shutdown(self):
+        """Stop the flusher thread and commit everything still buffered"""
+        with self._lock:
+            self._running = False
+            self._wakeup.notify_all()
+            thread, self._thread = self._thread, None
+        if thread:
+            thread.join()
+        self.flush()
+
+
+class VisitEnricher:
+    """Bounded worker pool that fills in IP-derived fields of stored visits"""
+
+    def __init__(self, visit_writer: VisitWriter, workers: int = ENRICHMENT_WORKERS,
+                 queue_size: int = ENRICHMENT_QUEUE_SIZE):
+        self.writer = visit_writer
+        self.workers = workers
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._accepting = True
+        self.stats = {"enqueued": 0, "inline": 0, "completed": 0, "failed": 0}
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"visit-enricher-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, pending: PendingVisit, ip_address: str) -> bool:
+        """
+        Queue a visit for enrichment.
+
+        Applies backpressure: if the queue stays full for ENRICHMENT_ENQUEUE_TIMEOUT
+        (or the pool is shutting down) the caller enriches the row itself.
+        Returns True if the job was queued, False if it ran inline.
+        """
+        if self._accepting:
+            self.start()
+            try:
+                self.jobs.put((pending, ip_address), timeout=ENRICHMENT_ENQUEUE_TIMEOUT)
+                self._count("enqueued")
+                return True
+            except queue.Full:
+                pass
+        self._count("inline")
+        self._enrich(pending, ip_address)
+        return False
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is _STOP:
+                    return
+                self._enrich(*job)
+            finally:
+                self.jobs.task_done()
+
+    def _enrich(self, pending, ip_address):
+        from utils import enrich_ip
+
+        try:
+            self.writer.apply_enrichment(pending, enrich_ip(ip_address))
+            self._count("completed")
+        except Exception as e:
+            self._count("failed")
+            print(f"Visit enrichment failed for {ip_address}: {e}")
+
+    def get_stats(self) -> dict:
+        """Return job counters and current queue depth"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.jobs.qsize()
+        return stats
+
+    def shutdown(self, timeout: float = ENRICHMENT_SHUTDOWN_TIMEOUT):
+        """Stop accepting jobs and flush the queue, waiting at most timeout seconds"""
+        self._accepting = False
+        with self._lock:
+            threads, self._threads = self._threads, []
+        deadline = time.monotonic() + timeout
+        for _ in threads:
+            try:
+                self.jobs.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        pending = sum(1 for job in list(self.jobs.queue) if job is not _STOP)
+        if pending:
+            print(f"Visit enricher shut down with {pending} jobs still pending")
+
+
+class RecentVisitWindows:
+    """
+    Per-link ring buffers of the latest visits as (epoch, ip_hash), newest last.
+
+    Seeded lazily from the database (plus the write buffer) and appended on every
+    recorded visit, so readers get preparsed numbers with no SQL. Links are held in
+    an LRU, which keeps memory flat however many links there are.
+    """
+
+    def __init__(self, size: int = VISIT_WINDOW_SIZE, max_links: int = VISIT_WINDOW_CACHE_LINKS,
+                 ttl: int = VISIT_WINDOW_TTL_SECONDS):
+        self.size = size
+        self.windows = LRUCache(maxsize=max_links, ttl=ttl)
+        self._lock = threading.Lock()
+        self._seeding = {}  # link_id -> visits appended while its seed query was running
+
+    def append(self, link_id: int, epoch: float, ip_hash: str):
+        """Add a just-recorded visit to the link's window (if the link is being tracked)"""
+        with self._lock:
+            window = self.windows.get(link_id)
+            if window is not None:
+                window.append((epoch, ip_hash))
+            elif link_id in self._seeding:
+                self._seeding[link_id].append((epoch, ip_hash))
+
+    def recent(self, link_id: int) -> list:
+        """Latest visits of a link as (epoch, ip_hash) tuples, newest first"""
+        with self._lock:
+            window = self.windows.get(link_id)
+            if window is not None:
+                return list(reversed(window))
+            self._seeding.setdefault(link_id, [])
+
+        try:
+            rows = recent_visits(link_id, self.size, "ts_ms, ip_hash")
+            seeded = [(r["ts_ms"] / 1000.0, r["ip_hash"]) for r in reversed(rows)]
+        except Exception:
+            with self._lock:
+                self._seeding.pop(link_id, None)
+            raise
+
+        with self._lock:
+            window = deque(seeded, maxlen=self.size)
+            seen = set(seeded)
+            for visit in self._seeding.pop(link_id, []):
+                if visit not in seen:
+                    window.append(visit)
+            self.windows.set(link_id, window)
+            return list(reversed(window))
+
+    def get_stats(self) -> dict:
+        """Return LRU counters"""
+        return self.windows.stats()
+
+
+writer = VisitWriter()
+enricher = VisitEnricher(writer)
+visit_windows = RecentVisitWindows()
+# atexit runs handlers in reverse order: drain enrichment first, then commit the buffer
+atexit.register(writer.shutdown)
+atexit.register(enricher.shutdown)
+
+
+def record_visit(link_id: int, session_id: str, ip_hash: str, user_agent: str, ts: str, behavior: str,
+                 suspicious: bool, target_url: str, device: str, browser: str, os_name: str,
+                 referrer: str, ip_address: str) -> PendingVisit:
+    """Buffer a visit, enriching IP-derived fields inline or via the worker pool"""
+    if DEFERRED_VISIT_ENRICHMENT:
+        fields = PENDING_ENRICHMENT
+    else:
+        from utils import enrich_ip
+        fields = enrich_ip(ip_address)
+
+    values = dict(fields)
+    values.update({
+        "link_id": link_id,
+        "session_id": session_id,
+        "ip_hash": ip_hash,
+        "user_agent": user_agent,
+        "ts": ts,
+        "ts_ms": epoch_ms(datetime.fromisoformat(ts)),
+        "behavior": behavior,
+        "is_suspicious": 1 if suspicious else 0,
+        "target_url": target_url,
+        "device": device,
+        "browser": browser,
+        "os": os_name,
+        "referrer": referrer,
+        "ip_address": ip_address,
+    })
+    pending = writer.add(values)
+    visit_windows.append(link_id, values["ts_ms"] / 1000.0, ip_hash)
+    link_traffic.add(link_id, values["ts_ms"] / 1000.0, suspicious)
+
+    if DEFERRED_VISIT_ENRICHMENT:
+        enricher.submit(pending, ip_address)
+    return pending
+
+
+def recent_visits(link_id: int, limit: int = 20, columns: str = "ts_ms, ip_hash") -> list:
+    """Most recent visits of a link (newest first), including rows still in the write buffer; columns must include ts_ms"""
+    from database import query_db
+
+    # Rows never given a ts_ms (older than the backfill) sort last anyway; callers do arithmetic on it
+    rows = query_db(
+        f"SELECT {columns} FROM visits WHERE link_id = ? AND ts_ms IS NOT NULL ORDER BY ts_ms DESC LIMIT ?",
+        [link_id, limit],
+    )
+    pending = writer.buffered(link_id)
+    if not pending:
+        return rows
+    names = [c.strip() for c in columns.split(",")]
+    merged = [{name: values[name] for name in names} for values in reversed(pending)] + [dict(r) for r in rows]
+    merged.sort(key=lambda v: v["ts_ms"], reverse=True)
+    return merged[:limit]
+
+
+def recent_visit_window(link_id: int) -> list:
+    """Latest visits of a link as (epoch, ip_hash), newest first, from the in-memory ring buffer"""
+    return visit_windows.recent(link_id)
+
+
+def session_visit_count(link_id: int, session_id: str) -> int:
+    """Number of visits a session has made to a link, an O(1) lookup whatever the link's traffic"""
+    return writer.session_visit_count(link_id, session_id)
+
+
+def pipeline_stats() -> dict:
+    """Return writer, enricher, visit window and link traffic counters for monitoring"""
+    return {"writer": writer.get_stats(), "enricher": enricher.get_stats(), "visit_windows": visit_windows.get_stats(),
+            "link_traffic": link_traffic.get_stats()}